@@ -1,8 +1,18 @@
 #!/bin/sh
 
-sass --watch --style=compressed \
-    /app/src/scss:/app/src/static/css &
+set -a
+. /app/.env
+set +a
 
-huey_consumer.py src.sync.huey --logfile=/var/log/huey.log &
+if [ "${PROJECT_ENVIRONMENT}" = "production" ]; then
+    /app/src/assets.py build
+else
+    /app/src/assets.py clean
+    sass --watch --style=compressed \
+        /app/src/scss:/app/src/static/css &
+fi
+
+huey_consumer.py src.tasks.huey --worker-type=thread \
+    --workers="${PROJECT_SYNC_WORKERS:-4}" --logfile=/var/log/huey.log &
 
 /app/src/app.py > /var/log/app.log 2>&1
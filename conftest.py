@@ -12,12 +12,17 @@ from src.database import initialize_db
 def db():
     with (
         tempfile.TemporaryDirectory() as temp_dir,
+        tempfile.TemporaryDirectory() as data_dir,
         patch("src.database.Config.sqlite.db", return_value=SQLiteDB.MEMORY),
         patch(
             "src.paprika.Config.paprika.client",
             return_value=PaprikaClientType.MOCK,
         ),
-        patch("src.paprika._IMAGE_DIR", Path(temp_dir)),
+        patch("src.images._IMAGE_DIR", Path(temp_dir)),
+        patch("src.images._GC_GRACE", 0),
+        patch(
+            "src.navigation._STAMP_FILE", Path(data_dir) / "categories.stamp"
+        ),
     ):
         initialize_db(force=True)
         yield
@@ -1,65 +1,307 @@
 #!/usr/bin/env python3
+import hashlib
 import logging
 import os
-from datetime import timezone
+from collections.abc import Callable, Iterator
+from datetime import datetime, timezone
+from functools import cache
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
-import uvicorn
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, PlainTextResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
 from peewee import fn
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
 
+from src.assets import AssetFiles, load_manifest, static_url
+from src.compression import CompressionMiddleware
+from src.conditional import Validators
 from src.config import MAINTENANCE_FILE, STATIC_DIR, Config, Environment
-from src.database import initialize_db
-from src.paprika import Category, CategoryRecipe, Recipe, RecipeStatus
-from src.render import ingredients, markdown
+from src.facets import (
+    Facet,
+    facet_counts,
+    facet_options,
+    matching_recipes,
+    parse_filters,
+)
+from src.ingredients import (
+    load_ingredients,
+    parse_ingredients,
+    parse_scale,
+    scale_text,
+)
+from src.navigation import category_tree, tree_version
+from src.paprika import (
+    Category,
+    CategoryRecipe,
+    Recipe,
+    RecipeRedirect,
+    RecipeStatus,
+)
+from src.profiling import ProfilingMiddleware
+from src.render import photo_map, renderer
+from src.similar import similar_recipes, similar_updated, similar_versions
+from src.timing import TimingMiddleware, timer
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
 
-initialize_db()
-
 _BASE_DIR = Path(__file__).parent
 
 
-class MaintenanceMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        if os.path.exists(MAINTENANCE_FILE):
-            return templates.TemplateResponse("503.html", {"request": request})
-        return await call_next(request)
+class MaintenanceMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and os.path.exists(MAINTENANCE_FILE):
+            request = Request(scope, receive)
+            response = template_response("503.html", {"request": request})
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+class DeferredMiddleware:
+    """Build middleware from the settings on the first call, so importing
+    the app does no I/O."""
+
+    def __init__(self, app: ASGIApp, build: Callable[[ASGIApp], ASGIApp]):
+        self.app = app
+        self._build = build
+        self._built: ASGIApp | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if self._built is None:
+            self._built = self._build(self.app)
+        await self._built(scope, receive, send)
+
+
+def _compression(app: ASGIApp) -> ASGIApp:
+    if not Config.app.compress_html:
+        return app
+    return CompressionMiddleware(
+        app, cache_bytes=Config.app.compression_cache_mb * 1024 * 1024
+    )
+
+
+def _timing(app: ASGIApp) -> ASGIApp:
+    return TimingMiddleware(
+        app,
+        server_timing=Config.app.server_timing,
+        slow_request_ms=Config.app.slow_request_ms,
+    )
+
+
+def _profiling(app: ASGIApp) -> ASGIApp:
+    if not Config.app.profile_secret:
+        return app
+    return ProfilingMiddleware(
+        app,
+        secret=Config.app.profile_secret,
+        directory=Path(Config.app.profile_dir),
+    )
+
+
+@cache
+def _static_files() -> AssetFiles:
+    return AssetFiles(
+        directory=STATIC_DIR,
+        cache_control={"images": Config.app.cache_control.images},
+    )
+
+
+async def _static(scope: Scope, receive: Receive, send: Send):
+    await _static_files()(scope, receive, send)
 
 
 app = FastAPI()
 app.add_middleware(MaintenanceMiddleware)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.add_middleware(DeferredMiddleware, build=_compression)
+app.add_middleware(DeferredMiddleware, build=_timing)
+app.add_middleware(DeferredMiddleware, build=_profiling)
+app.mount("/static", _static, name="static")
 templates = Jinja2Templates(directory=_BASE_DIR / "templates")
 
 
+@cache
+def _manifest() -> dict[str, str]:
+    return load_manifest()
+
+
+def _static_url(path: str) -> str:
+    return static_url(_manifest(), path)
+
+
+templates.env.globals["static_url"] = _static_url
+
+
+# Scale options offered on recipe pages, as (label, query value)
+SCALES = (("½×", "1/2"), ("1×", "1"), ("2×", "2"), ("3×", "3"))
+
+
+# Anything besides the database that changes the rendered pages
+@cache
+def _page_version() -> str:
+    return hashlib.md5(
+        repr(
+            (
+                Config.title,
+                Config.email,
+                Config.paprika.timezone,
+                Config.paprika.listed_categories,
+                Config.paprika.secret_categories,
+                Config.paprika.hidden_categories,
+                Config.paprika.show_uncategorized,
+                max(
+                    path.stat().st_mtime
+                    for path in (_BASE_DIR / "templates").iterdir()
+                ),
+            )
+        ).encode()
+    ).hexdigest()
+
+
+_STREAM_CHUNK_SIZE = 8192
+
+
+def _encode_chunks(chunks: Iterator[str]) -> Iterator[bytes]:
+    # Jinja yields many tiny strings; group them into reasonably sized writes
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= _STREAM_CHUNK_SIZE:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def template_response(
+    name: str, context: dict, headers: dict[str, str] | None = None
+) -> Response:
+    if Config.app.stream_templates:
+        # Rendering happens while the body is sent, after the Server-Timing
+        # header, so streamed pages report no template timing
+        template = templates.get_template(name)
+        return StreamingResponse(
+            _encode_chunks(template.generate(context)),
+            media_type="text/html",
+            headers=headers,
+        )
+    with timer("template"):
+        return templates.TemplateResponse(
+            context["request"], name, context, headers=headers
+        )
+
+
+def _latest(*values: datetime | str | None) -> datetime | None:
+    parsed: list[datetime] = [
+        datetime.fromisoformat(value) if isinstance(value, str) else value
+        for value in values
+        if value is not None
+    ]
+    return max(parsed, default=None)
+
+
+def _category_state() -> tuple[int, datetime | None]:
+    count, time_updated = Category.select(
+        fn.COUNT(Category.uid),
+        fn.MAX(fn.COALESCE(Category.time_updated, Category.time_created)),
+    ).tuples()[0]
+    return count, _latest(time_updated)
+
+
+def _tree_state() -> tuple[tuple[int, int] | None, datetime | None]:
+    # The navigation on every page shows listed recipe counts per category
+    version = tree_version()
+    if version is None:
+        return None, None
+    return version, datetime.fromtimestamp(version[1] / 1e9)
+
+
+def recipe_validators(slug: str, *variant) -> Validators | None:
+    recipe = (
+        Recipe.select(
+            Recipe.uid, Recipe.hash, Recipe.time_created, Recipe.time_updated
+        )
+        .where(Recipe.slug == slug)
+        .tuples()
+        .first()
+    )
+    if not recipe:
+        return None
+    uid, _, time_created, time_updated = recipe
+    category_count, category_time_updated = _category_state()
+    tree, tree_time_updated = _tree_state()
+    similar_time_updated = _latest(similar_updated([uid]))
+    neighbours = similar_versions(uid)
+    return Validators(
+        _page_version(),
+        *variant,
+        category_count,
+        category_time_updated,
+        tree,
+        similar_time_updated,
+        neighbours,
+        recipe,
+        last_modified=_latest(
+            category_time_updated,
+            tree_time_updated,
+            similar_time_updated,
+            *(neighbour[-1] for neighbour in neighbours),
+            time_updated or time_created,
+        ),
+    )
+
+
+def gallery_validators(
+    slug: str | None, filters: dict[Facet, str]
+) -> Validators:
+    recipes = Recipe.select(
+        fn.COUNT(Recipe.uid),
+        fn.MAX(fn.COALESCE(Recipe.time_updated, Recipe.time_created)),
+    ).where(Recipe.in_trash == 0)
+    if slug:
+        recipes = recipes.join(
+            CategoryRecipe, on=(Recipe.uid == CategoryRecipe.recipe)
+        ).where(
+            CategoryRecipe.category.in_(
+                Category.select(Category.uid).where(Category.slug == slug)
+            )
+        )
+    recipe_count, recipe_time_updated = recipes.tuples()[0]
+    recipe_time_updated = _latest(recipe_time_updated)
+    category_count, category_time_updated = _category_state()
+    tree, tree_time_updated = _tree_state()
+    return Validators(
+        _page_version(),
+        slug,
+        sorted(filters.items()),
+        category_count,
+        category_time_updated,
+        tree,
+        recipe_count,
+        recipe_time_updated,
+        last_modified=_latest(
+            category_time_updated, tree_time_updated, recipe_time_updated
+        ),
+    )
+
+
 def base():
     return {
         "title": Config.title,
         "email": Config.email,
-        "categories": {
-            category.name: category.slug
-            for category in Category.select()
-            if (
-                Category.parent_uid.is_null()
-                and (
-                    category.name in Config.paprika.listed_categories
-                    or (
-                        not Config.paprika.listed_categories
-                        and category.name
-                        not in Config.paprika.hidden_categories
-                        and category.name
-                        not in Config.paprika.secret_categories
-                    )
-                )
-            )
-        },
+        "categories": category_tree(),
     }
 
 
@@ -69,18 +311,29 @@ async def robots():
 
 
 @app.get("/r/{slug}", response_class=HTMLResponse)
-async def recipe(request: Request, slug: str):
+async def recipe(request: Request, slug: str, scale: str | None = None):
+    cache_control = Config.app.cache_control.recipe
+    factor = parse_scale(scale)
+    validators = recipe_validators(slug, factor)
+    if validators and validators.is_not_modified(request.headers):
+        return validators.not_modified(cache_control)
+
     response = base()
     try:
-        recipe = [
-            recipe
-            for recipe in Recipe.select().where(Recipe.slug == slug)
-            if recipe.status == RecipeStatus.LISTED and not recipe.trashed
-        ]
-        if len(recipe) > 1:
+        recipe = Recipe.get_by_slug(slug)
+        if recipe is None:
+            redirect = RecipeRedirect.get_or_none(RecipeRedirect.slug == slug)
+            if redirect:
+                url = f"/r/{redirect.recipe.slug}"
+                if request.url.query:
+                    url = f"{url}?{request.url.query}"
+                return RedirectResponse(url, status_code=301)
+        if (
+            recipe is None
+            or recipe.status != RecipeStatus.LISTED
+            or recipe.trashed
+        ):
             raise Recipe.DoesNotExist
-        else:
-            recipe = recipe[0]
 
         zone_info = ZoneInfo(Config.paprika.timezone)
 
@@ -99,34 +352,45 @@ async def recipe(request: Request, slug: str):
             else:
                 recipe.time_updated = local_time_updated.strftime("%B %-d, %Y")
 
+        # Recipes synced before ingredients were stored are parsed here
+        ingredients = load_ingredients(recipe.uid) or parse_ingredients(
+            recipe.ingredients
+        )
+        recipe.servings = scale_text(recipe.servings, factor)
+
         response["recipe"] = recipe
-        for attribute in Recipe.markdown_fields:
-            content = getattr(recipe, attribute)
-            if attribute == "ingredients":
-                setattr(
-                    recipe,
-                    attribute,
-                    ingredients(recipe.uid, content),
-                )
-            else:
-                setattr(
-                    recipe,
-                    attribute,
-                    markdown(recipe.uid, content),
-                )
+        response["similar"] = similar_recipes(recipe.uid)
+        response["scales"] = [
+            (label, value, parse_scale(value) == factor)
+            for label, value in SCALES
+        ]
+        with timer("render"):
+            photos = photo_map([recipe.uid])[recipe.uid]
+            rendered = renderer().render_recipe(
+                recipe, photos, ingredients=ingredients, scale=factor
+            )
+            for attribute, html in rendered.items():
+                setattr(recipe, attribute, html)
     except Recipe.DoesNotExist:
-        return templates.TemplateResponse(
+        return template_response(
             "404.html", {"request": request, "response": response}
         )
-    return templates.TemplateResponse(
+    return template_response(
         "recipe.html",
         {"request": request, "response": response, "page_title": recipe.name},
+        headers=validators.headers(cache_control) if validators else None,
     )
 
 
 @app.get("/", response_class=HTMLResponse)
 @app.get("/c/{slug}", response_class=HTMLResponse)
 async def index(request: Request, slug: str | None = None):
+    cache_control = Config.app.cache_control.gallery
+    filters = parse_filters(request.query_params)
+    validators = gallery_validators(slug, filters)
+    if validators.is_not_modified(request.headers):
+        return validators.not_modified(cache_control)
+
     recipes = (
         Recipe.select()
         .where(Recipe.in_trash == 0)
@@ -138,30 +402,22 @@ async def index(request: Request, slug: str | None = None):
     )
 
     if slug:
-        category = Category.select().where(Category.slug == slug)
-        if category.count() > 1:
-            logger.warning("Multiple categories found with the same slug")
-            return templates.TemplateResponse(
+        category = Category.get_or_none(Category.slug == slug)
+        if category is None:
+            return template_response(
                 "404.html", {"request": request, "response": base()}
             )
-        else:
-            category = category.get()
 
         recipes = recipes.join(
             CategoryRecipe, on=(Recipe.uid == CategoryRecipe.recipe)
         ).where(CategoryRecipe.category == category)
 
-    recipes = recipes.group_by(Recipe.slug)
-
-    if multi_recipes := recipes.having(fn.Count(Recipe.uid) > 1):
-        for recipe in multi_recipes:
-            logger.warning(
-                f"More than one recipe found with slug {recipe.slug}"
-            )
-        recipes = recipes.having(fn.Count(Recipe.uid) == 1)
+    if filters:
+        recipes = recipes.where(Recipe.uid.in_(matching_recipes(filters)))
 
     response = base()
     response["current_category_slug"] = slug
+    response["filters"] = filters
     response["recipes"] = []
     for recipe in recipes:
         if recipe.status not in [RecipeStatus.LISTED, RecipeStatus.SECRET]:
@@ -172,6 +428,7 @@ async def index(request: Request, slug: str | None = None):
             continue
         response["recipes"].append(
             {
+                "uid": recipe.uid,
                 "name": recipe.name,
                 "slug": recipe.slug,
                 "rating": recipe.rating,
@@ -179,12 +436,21 @@ async def index(request: Request, slug: str | None = None):
                 "secret": recipe.status == RecipeStatus.SECRET,
             }
         )
-    return templates.TemplateResponse(
-        "gallery.html", {"request": request, "response": response}
+    response["facets"] = facet_options(
+        request.url.path,
+        filters,
+        facet_counts([recipe["uid"] for recipe in response["recipes"]]),
+    )
+    return template_response(
+        "gallery.html",
+        {"request": request, "response": response},
+        headers=validators.headers(cache_control),
     )
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     logging.basicConfig(level=logging.ERROR)
     uvicorn.run(
         "src.app:app",
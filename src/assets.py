@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Usage:
+    ./%(script_name)s build [--skip-sass]
+    ./%(script_name)s clean
+
+Options:
+    -h --help           Show this screen.
+    --skip-sass         Fingerprint the existing CSS without compiling SCSS.
+
+Examples:
+    # Compile, fingerprint and precompress the static assets
+    ./%(script_name)s build
+
+    # Remove the built assets and fall back to the unfingerprinted files
+    ./%(script_name)s clean
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import stat
+import subprocess
+import sys
+from pathlib import Path
+
+import brotli
+from docopt import docopt
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from src.compression import accepted_encodings
+from src.config import STATIC_DIR
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+__doc__ %= {
+    "script_name": Path(__file__).name,
+}
+
+_BASE_DIR = Path(__file__).parent
+_SCSS_DIR = _BASE_DIR / "scss"
+
+DIST_DIR = STATIC_DIR / "dist"
+MANIFEST_FILE = DIST_DIR / "manifest.json"
+
+# Synced recipe photos are managed by the sync, not the build
+_EXCLUDED_DIRS = {"dist", "images"}
+_COMPRESSIBLE = {".css", ".js", ".json", ".map", ".svg", ".txt"}
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def compile_scss() -> None:
+    subprocess.run(
+        [
+            "sass",
+            "--no-source-map",
+            "--style=compressed",
+            f"{_SCSS_DIR}:{STATIC_DIR / 'css'}",
+        ],
+        check=True,
+    )
+
+
+def _sources() -> list[Path]:
+    return sorted(
+        path
+        for path in STATIC_DIR.rglob("*")
+        if path.is_file()
+        and not path.name.startswith(".")
+        and path.relative_to(STATIC_DIR).parts[0] not in _EXCLUDED_DIRS
+    )
+
+
+def _precompress(path: Path, data: bytes) -> None:
+    for suffix, compressed in (
+        (".br", brotli.compress(data, quality=11)),
+        (".gz", gzip.compress(data, compresslevel=9, mtime=0)),
+    ):
+        if len(compressed) < len(data):
+            path.with_name(path.name + suffix).write_bytes(compressed)
+
+
+def build(skip_sass: bool = False) -> dict[str, str]:
+    if not skip_sass:
+        compile_scss()
+
+    manifest = {}
+    for source in _sources():
+        data = source.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        relative_path = source.relative_to(STATIC_DIR)
+        fingerprinted = relative_path.with_name(
+            f"{source.stem}.{digest}{source.suffix}"
+        )
+        dest = DIST_DIR / fingerprinted
+        if not dest.exists():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(data)
+            if source.suffix in _COMPRESSIBLE:
+                _precompress(dest, data)
+            logger.debug(f"Built asset: {dest}")
+        manifest[str(relative_path)] = str(Path("dist") / fingerprinted)
+
+    # Replace the manifest atomically so running apps never read half of it
+    DIST_DIR.mkdir(parents=True, exist_ok=True)
+    temp_file = MANIFEST_FILE.with_suffix(".tmp")
+    temp_file.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(temp_file, MANIFEST_FILE)
+    logger.info(f"Built {len(manifest)} assets: {MANIFEST_FILE}")
+    return manifest
+
+
+def clean() -> None:
+    if DIST_DIR.exists():
+        shutil.rmtree(DIST_DIR)
+        logger.info(f"Removed built assets: {DIST_DIR}")
+
+
+def load_manifest() -> dict[str, str]:
+    if not MANIFEST_FILE.exists():
+        return {}
+    return json.loads(MANIFEST_FILE.read_text())
+
+
+def static_url(manifest: dict[str, str], path: str) -> str:
+    return f"/static/{manifest.get(path, path)}"
+
+
+class AssetFiles(StaticFiles):
+    def __init__(
+        self,
+        *,
+        directory: str | os.PathLike[str],
+        cache_control: dict[str, str] | None = None,
+        **kwargs,
+    ):
+        super().__init__(directory=directory, **kwargs)
+        # Cache-Control by top-level directory, e.g. {"images": "max-age=60"}
+        self.cache_control = {"dist": IMMUTABLE} | (cache_control or {})
+        self._root = Path(os.path.realpath(directory))
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = Path(full_path)
+        response = None
+
+        if full_path.suffix in _COMPRESSIBLE:
+            accepted = accepted_encodings(request_headers)
+            for encoding, suffix in _ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                compressed = full_path.with_name(full_path.name + suffix)
+                try:
+                    compressed_stat = os.stat(compressed)
+                except OSError:
+                    continue
+                if stat.S_ISREG(compressed_stat.st_mode):
+                    response = FileResponse(
+                        compressed,
+                        status_code=status_code,
+                        stat_result=compressed_stat,
+                        headers={"Content-Encoding": encoding},
+                        media_type=mimetypes.guess_type(full_path.name)[0],
+                    )
+                    break
+            if response is None:
+                response = FileResponse(
+                    full_path, status_code=status_code, stat_result=stat_result
+                )
+            response.headers["Vary"] = "Accept-Encoding"
+        else:
+            response = FileResponse(
+                full_path, status_code=status_code, stat_result=stat_result
+            )
+
+        if full_path.is_relative_to(self._root):
+            directory = full_path.relative_to(self._root).parts[0]
+            if cache_control := self.cache_control.get(directory):
+                response.headers["Cache-Control"] = cache_control
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def main(argv: list[str] | None = None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    args = docopt(__doc__, argv=argv)
+    if args.get("build"):
+        build(skip_sass=bool(args.get("--skip-sass")))
+    elif args.get("clean"):
+        clean()
+    else:
+        raise NotImplementedError("Invalid option")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Usage:
+    ./%(script_name)s [--dir=<dir>] [--keep=<n>]
+    ./%(script_name)s list [--dir=<dir>]
+
+Options:
+    -h --help       Show this screen.
+    --dir=<dir>     Directory holding the snapshots [default: data/backups].
+    --keep=<n>      Number of snapshots to keep [default: config].
+
+Examples:
+    # Snapshot the databases and images, keeping the configured number
+    ./%(script_name)s
+
+    # List snapshots, oldest first
+    ./%(script_name)s list
+"""
+
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+from docopt import docopt
+
+from src import images
+from src.config import Config
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+__doc__ %= {
+    "script_name": Path(__file__).name,
+}
+
+_BASE_DIR: Path = Path(__file__).parent
+_DATA_DIR: Path = _BASE_DIR.parent / "data"
+BACKUP_DIR: Path = _DATA_DIR / "backups"
+
+_DATABASES = ("sqlite.db", "huey.db")
+# Pages copied per step of the online backup; the database is only locked
+# while a step runs, so the app and sync keep reading and writing between
+_PAGES_PER_STEP = 1024
+_STEP_SLEEP = 0.01  # seconds
+
+
+class Snapshot(NamedTuple):
+    path: Path
+    copied: int
+    linked: int
+    copied_bytes: int
+
+
+def backup_database(source: Path, dest: Path) -> None:
+    """Copy a live SQLite database with the online backup API."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst, pages=_PAGES_PER_STEP, sleep=_STEP_SLEEP)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _image_files(image_dir: Path) -> list[Path]:
+    if not image_dir.exists():
+        return []
+    # Stored objects and their public names, but not partial downloads
+    return sorted(image_dir.glob(f"{images._OBJECTS}/*/*")) + sorted(
+        path
+        for path in image_dir.iterdir()
+        if path.is_file() and not path.name.startswith(".")
+    )
+
+
+def _link(source: Path, dest: Path) -> bool:
+    try:
+        os.link(source, dest)
+    except OSError:
+        # On another filesystem
+        return False
+    return True
+
+
+def backup_images(dest: Path, previous: Path | None = None) -> Snapshot:
+    """Copy images into dest, hardlinking files unchanged since previous.
+
+    Stored objects are named by their digest, so an object at the same path
+    with the same size and mtime is the same content. Public names can be
+    pointed at another object, so they are only linked to the objects of
+    this snapshot: files that are hardlinks of each other stay hardlinks.
+    """
+    image_dir = images._IMAGE_DIR
+    copied, linked, copied_bytes = 0, 0, 0
+    seen: dict[tuple[int, int], Path] = {}
+    for path in _image_files(image_dir):
+        relative = path.relative_to(image_dir)
+        target = dest / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            # Collected while the snapshot was running
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in seen and _link(seen[inode], target):
+            linked += 1
+            continue
+        seen[inode] = target
+
+        old = (
+            previous / relative
+            if previous and relative.parts[0] == images._OBJECTS
+            else None
+        )
+        if old is not None and old.exists():
+            old_stat = old.stat()
+            if (old_stat.st_size, old_stat.st_mtime_ns) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ) and _link(old, target):
+                linked += 1
+                continue
+        shutil.copy2(path, target)
+        copied += 1
+        copied_bytes += stat.st_size
+    return Snapshot(dest, copied, linked, copied_bytes)
+
+
+def snapshots(backup_dir: Path = BACKUP_DIR) -> list[Path]:
+    """Complete snapshots, oldest first."""
+    if not backup_dir.exists():
+        return []
+    return sorted(
+        path
+        for path in backup_dir.iterdir()
+        if path.is_dir() and not path.name.startswith(".")
+    )
+
+
+def prune_backups(backup_dir: Path, keep: int) -> list[Path]:
+    removed = snapshots(backup_dir)[:-keep] if keep > 0 else []
+    for path in removed:
+        shutil.rmtree(path)
+        logger.info(f"Removed backup: {path}")
+    return removed
+
+
+def create_backup(
+    backup_dir: Path = BACKUP_DIR, keep: int | None = None
+) -> Snapshot:
+    """Snapshot the databases and images into a new dated directory.
+
+    The snapshot is built under a hidden name and renamed when complete, so
+    an interrupted backup is never used as the base of the next one.
+    """
+    existing = snapshots(backup_dir)
+    previous = existing[-1] if existing else None
+    name = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = backup_dir / name
+    suffix = 1
+    while path.exists():
+        suffix += 1
+        path = backup_dir / f"{name}-{suffix}"
+    partial = backup_dir / f".{path.name}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+
+    try:
+        for database in _DATABASES:
+            source = _DATA_DIR / database
+            if source.exists():
+                backup_database(source, partial / database)
+        snapshot = backup_images(
+            partial / "images", previous / "images" if previous else None
+        )
+        partial.rename(path)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    logger.info(
+        f"Backed up to {path}: {snapshot.copied} images copied, "
+        f"{snapshot.linked} linked"
+    )
+
+    prune_backups(backup_dir, Config.backup.keep if keep is None else keep)
+    return snapshot._replace(path=path)
+
+
+def main(argv: list[str] | None = None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    args = docopt(__doc__, argv=argv)
+    backup_dir = Path(args["--dir"])
+
+    if args.get("list"):
+        for path in snapshots(backup_dir):
+            print(path.name)
+        return
+
+    keep = args.get("--keep")
+    snapshot = create_backup(
+        backup_dir, keep=int(keep) if keep and keep.isdigit() else None
+    )
+    print(
+        f"{snapshot.path}: {snapshot.copied} images copied "
+        f"({snapshot.copied_bytes} bytes), {snapshot.linked} linked"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Usage:
+    ./%(script_name)s render [--recipes=<n>] [--repeat=<n>] [--seed=<n>]
+    ./%(script_name)s imports [--repeat=<n>] [--json] [<module>...]
+
+Options:
+    -h --help           Show this screen.
+    --recipes=<n>       Number of recipes to generate [default: 200].
+    --repeat=<n>        Number of times to render every recipe; the best run
+                            is reported [default: 5].
+    --seed=<n>          Seed for the generated database [default: 0].
+    --json              Print the report as JSON.
+
+Examples:
+    # Compare rendering recipes one field at a time with the batch renderer
+    ./%(script_name)s render
+
+    # Track the import time of every entry point with python -X importtime
+    ./%(script_name)s imports
+
+    # Show the slowest imports of the sync CLI
+    ./%(script_name)s imports src.sync
+"""
+
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from docopt import docopt
+from markdown import markdown as _markdown
+
+from src.loadtest import generate_database
+from src.paprika import Photo, Recipe
+from src.render import Renderer
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+__doc__ %= {
+    "script_name": Path(__file__).name,
+}
+
+_BASE_DIR = Path(__file__).parent
+
+ENTRY_POINTS = (
+    "src.app",
+    "src.sync",
+    "src.tasks",
+    "src.maintenance",
+    "src.assets",
+)
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$")
+_SLOWEST_IMPORTS = 5
+
+
+def _per_call_markdown(recipe_uid: str, content: str) -> str:
+    # How fields were rendered before the Renderer: a photo query and a new
+    # Markdown pipeline for every field
+    photo_names = re.findall(r"\[photo:(\d+)\]", content)
+    if photo_names:
+        photos = Photo.select().where(Photo.recipe_uid == recipe_uid)
+        photo_html = {
+            photo.name: f'<img src="/static/images/{photo.filename}">'
+            for photo in photos
+        }
+        for name in photo_names:
+            search = f"[photo:{name}]"
+            content = content.replace(search, photo_html.get(name, search))
+    return _markdown(content, extensions=["nl2br"])
+
+
+def _per_call_ingredients(recipe_uid: str, content: str) -> str:
+    single_number = (
+        r"(?:\d+\s+\d+/\d+|\d+/\d+|\d+\.\d+|\d+|[\u00BC-\u00BE\u2150-\u215E])"
+    )
+    range_number = rf"(?:\s*[-–]\s*{single_number})?"
+    pattern = re.compile(rf"^\s*({single_number}{range_number})")
+
+    lines: list[str] = []
+    for line in content.splitlines():
+        if line.startswith("**") and line.endswith("**"):
+            if lines:
+                lines.append("</ul>")
+            lines.append(_per_call_markdown(recipe_uid, line))
+            lines.append("<ul>")
+        elif line != "":
+            if not lines:
+                lines.append("<ul>")
+            marked = pattern.sub(r"<span>\1</span>", line)
+            lines.append(f"<li>{marked}</li>")
+    if lines:
+        lines.append("</ul>")
+    return "\n".join(lines)
+
+
+def _render_per_call(recipes: list[Recipe]) -> None:
+    for recipe in recipes:
+        for attribute in Recipe.markdown_fields:
+            content = getattr(recipe, attribute)
+            if attribute == "ingredients":
+                _per_call_ingredients(recipe.uid, content)
+            else:
+                _per_call_markdown(recipe.uid, content)
+
+
+def _render_batch(recipes: list[Recipe]) -> None:
+    Renderer().render_recipes(recipes)
+
+
+def _best_time(func: Callable[[list[Recipe]], None], recipes, repeat) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(recipes)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_render(recipes: int, repeat: int, seed: int = 0) -> str:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        generate_database(
+            Path(temp_dir) / "benchmark.db",
+            recipes=recipes,
+            categories=0,
+            seed=seed,
+        )
+        rows = list(Recipe.select())
+        per_call = _best_time(_render_per_call, rows, repeat)
+        batch = _best_time(_render_batch, rows, repeat)
+
+    lines = [f"Rendering {len(rows)} recipes (best of {repeat}):"]
+    for name, duration in (("per call", per_call), ("batch", batch)):
+        lines.append(
+            f"  {name:<10} {duration * 1000:9.2f}ms total  "
+            f"{duration / len(rows) * 1e6:9.1f}us per recipe"
+        )
+    lines.append(f"  speedup    {per_call / batch:9.2f}x")
+    return "\n".join(lines)
+
+
+def _import_times(module: str) -> tuple[float, list[tuple[str, int]]]:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=_BASE_DIR.parent,
+        env=os.environ | {"PYTHONPATH": str(_BASE_DIR.parent)},
+    )
+    wall_time = time.perf_counter() - start
+    # Only direct imports of the entry point, by cumulative microseconds
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match and len(match.group(3)) == 3:
+            imports.append((match.group(4), int(match.group(2))))
+        elif match and match.group(4) == module:
+            imports.append((module, int(match.group(2))))
+    return wall_time, imports
+
+
+def benchmark_imports(modules: list[str], repeat: int) -> dict:
+    report = {}
+    for module in modules:
+        wall_time, imports = min(
+            (_import_times(module) for _ in range(repeat)),
+            key=lambda result: result[0],
+        )
+        cumulative = dict(imports)
+        children = sorted(
+            (item for item in imports if item[0] != module),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        report[module] = {
+            "process_ms": wall_time * 1000,
+            "import_ms": cumulative.get(module, 0) / 1000,
+            "slowest": {
+                name: duration / 1000
+                for name, duration in children[:_SLOWEST_IMPORTS]
+            },
+        }
+    return report
+
+
+def format_imports(report: dict) -> str:
+    lines = [f"{'entry point':<18}{'process ms':>12}{'import ms':>12}"]
+    for module, result in report.items():
+        lines.append(
+            f"{module:<18}{result['process_ms']:>12.1f}"
+            f"{result['import_ms']:>12.1f}"
+        )
+        for name, duration in result["slowest"].items():
+            lines.append(f"    {name:<26}{duration:>12.1f}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    args = docopt(__doc__, argv=argv)
+    if args.get("render"):
+        print(
+            benchmark_render(
+                recipes=int(args["--recipes"]),
+                repeat=int(args["--repeat"]),
+                seed=int(args["--seed"]),
+            )
+        )
+    elif args.get("imports"):
+        report = benchmark_imports(
+            args["<module>"] or list(ENTRY_POINTS),
+            repeat=int(args["--repeat"]),
+        )
+        if args.get("--json"):
+            print(json.dumps(report, indent=2))
+        else:
+            print(format_imports(report))
+    else:
+        raise NotImplementedError("Invalid option")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    main()
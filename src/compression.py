@@ -0,0 +1,195 @@
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+_BROTLI_QUALITY = 5
+_GZIP_LEVEL = 6
+
+
+def accepted_encodings(headers: Headers) -> set[str]:
+    encodings = set()
+    for item in headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=_GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(
+                _GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+        self._encoding = encoding
+
+    def compress(self, data: bytes) -> bytes:
+        # Flush every chunk so the client can render it as soon as it arrives
+        if self._encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        if self._encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class CompressedBodyCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._store: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, str]) -> bytes | None:
+        with self._lock:
+            body = self._store.get(key)
+            if body is not None:
+                self._store.move_to_end(key)
+            return body
+
+    def set(self, key: tuple[str, str], body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._store:
+                self._size -= len(self._store.pop(key))
+            self._store[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._store.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class CompressionMiddleware:
+    encodings = ("br", "gzip")
+    media_types = ("text/html",)
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        cache_bytes: int = 0,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = CompressedBodyCache(cache_bytes) if cache_bytes else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = accepted_encodings(Headers(scope=scope))
+        encoding = next((e for e in self.encodings if e in accepted), None)
+
+        start_message: Message | None = None
+        compressor: _StreamCompressor | None = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, compressor, passthrough
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if not headers.get("content-type", "").startswith(
+                    self.media_types
+                ) or ("content-encoding" in headers):
+                    passthrough = True
+                    await send(message)
+                    return
+                MutableHeaders(scope=message).add_vary_header("Accept-Encoding")
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                    return
+                # Hold the start until the first body chunk shows whether
+                # the response is buffered or streamed
+                start_message = message
+                return
+
+            if (
+                passthrough
+                or encoding is None
+                or message["type"] != "http.response.body"
+            ):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None and not more_body:
+                await self._send_buffered(start_message, body, encoding, send)
+                start_message = None
+                return
+
+            if start_message is not None:
+                headers = MutableHeaders(scope=start_message)
+                del headers["content-length"]
+                headers["Content-Encoding"] = encoding
+                await send(start_message)
+                start_message = None
+                compressor = _StreamCompressor(encoding)
+            elif compressor is None:
+                # Body after the response was already complete
+                await send(message)
+                return
+
+            chunk = compressor.compress(body) if body else b""
+            if not more_body:
+                chunk += compressor.finish()
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": more_body,
+                }
+            )
+
+        await self.app(scope, receive, send_compressed)
+
+    async def _send_buffered(
+        self, start_message: Message, body: bytes, encoding: str, send: Send
+    ) -> None:
+        headers = MutableHeaders(scope=start_message)
+        if len(body) < self.minimum_size:
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        etag = headers.get("etag")
+        compressed = None
+        if self.cache and etag:
+            compressed = self.cache.get((etag, encoding))
+        if compressed is None:
+            compressed = compress(body, encoding)
+            if self.cache and etag:
+                self.cache.set((etag, encoding), compressed)
+
+        headers["Content-Encoding"] = encoding
+        headers["Content-Length"] = str(len(compressed))
+        await send(start_message)
+        await send({"type": "http.response.body", "body": compressed})
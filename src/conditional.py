@@ -0,0 +1,55 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+
+class Validators:
+    def __init__(self, *parts, last_modified: datetime | None = None):
+        data = "|".join(str(part) for part in parts)
+        # Weak, since the same page may be sent with different encodings
+        self.etag = f'W/"{hashlib.md5(data.encode()).hexdigest()}"'
+        self.last_modified = (
+            last_modified.astimezone(timezone.utc).replace(microsecond=0)
+            if last_modified
+            else None
+        )
+
+    def headers(self, cache_control: str | None = None) -> dict[str, str]:
+        headers = {"ETag": self.etag}
+        if self.last_modified:
+            headers["Last-Modified"] = format_datetime(
+                self.last_modified, usegmt=True
+            )
+        if cache_control:
+            headers["Cache-Control"] = cache_control
+        return headers
+
+    def is_not_modified(self, request_headers: Headers) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-Modified-Since is ignored when If-None-Match is present
+            tags = {tag.strip() for tag in if_none_match.split(",")}
+            return "*" in tags or _weak(self.etag) in {
+                _weak(tag) for tag in tags
+            }
+
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since and self.last_modified:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.last_modified <= since
+        return False
+
+    def not_modified(self, cache_control: str | None = None) -> Response:
+        return Response(status_code=304, headers=self.headers(cache_control))
+
+
+def _weak(tag: str) -> str:
+    return tag.removeprefix("W/")
@@ -1,8 +1,7 @@
+import threading
 from enum import StrEnum
 from pathlib import Path
 
-from dynaconf import Dynaconf, Validator
-
 _BASE_DIR = Path(__file__).parent
 
 STATIC_DIR = _BASE_DIR / "static"
@@ -24,36 +23,104 @@ class PaprikaClientType(StrEnum):
     API = "api"
 
 
-EnvConfig = Dynaconf(
-    load_dotenv=True,
-    settings_files=[_BASE_DIR.parent / ".env"],
-    envvar_prefix="PROJECT",
-    validators=[
-        Validator("hostname", must_exist=True, is_type_of=str),
-        Validator("name", must_exist=True, is_type_of=str),
-    ],
-)
-
-Config = Dynaconf(
-    settings_files=[_BASE_DIR.parent / "config.toml"],
-    validators=[
-        Validator("title", must_exist=True, is_type_of=str),
-        Validator("sqlite.db", must_exist=True, is_in=SQLiteDB),
-        Validator("paprika.client", must_exist=True, is_in=PaprikaClientType),
-        Validator("paprika.api_delay", is_type_of=int, default=1),
-        Validator("paprika.email", must_exist=True, is_type_of=str),
-        Validator("paprika.password", must_exist=True, is_type_of=str),
-        Validator("paprika.secret_categories", is_type_of=list),
-        Validator("paprika.hidden_categories", is_type_of=list),
-        Validator("paprika.show_uncategorized", is_type_of=bool, default=True),
-        Validator("paprika.cron", is_type_of=str, default="0 * * * *"),
-    ],
-)
-
-Config.update(
-    {
-        "environment": EnvConfig.environment,
-        "hostname": EnvConfig.hostname,
-        "project_name": EnvConfig.name,
-    }
-)
+class LazySettings:
+    """Load settings on first use, so importing a module does no I/O."""
+
+    def __init__(self, load):
+        self._load = load
+        self._settings = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.setup(), name)
+
+    def setup(self):
+        if self._settings is None:
+            with self._lock:
+                if self._settings is None:
+                    self._settings = self._load()
+        return self._settings
+
+
+def _load_env_config():
+    from dynaconf import Dynaconf, Validator
+
+    return Dynaconf(
+        load_dotenv=True,
+        settings_files=[_BASE_DIR.parent / ".env"],
+        envvar_prefix="PROJECT",
+        validators=[
+            Validator("hostname", must_exist=True, is_type_of=str),
+            Validator("name", must_exist=True, is_type_of=str),
+        ],
+    )
+
+
+def _load_config():
+    from dynaconf import Dynaconf, Validator
+
+    env_config = EnvConfig.setup()
+    config = Dynaconf(
+        settings_files=[_BASE_DIR.parent / "config.toml"],
+        validators=[
+            Validator("title", must_exist=True, is_type_of=str),
+            Validator("sqlite.db", must_exist=True, is_in=SQLiteDB),
+            Validator(
+                "paprika.client", must_exist=True, is_in=PaprikaClientType
+            ),
+            Validator("paprika.api_delay", is_type_of=(int, float), default=1),
+            Validator(
+                "paprika.min_api_delay", is_type_of=(int, float), default=0.25
+            ),
+            Validator("paprika.max_retries", is_type_of=int, default=5),
+            Validator("paprika.response_cache_mb", is_type_of=int, default=0),
+            Validator("paprika.record_dir", is_type_of=str, default=""),
+            Validator("paprika.mock_dir", is_type_of=str, default=""),
+            Validator("paprika.api_budget", is_type_of=int, default=0),
+            Validator("paprika.time_budget", is_type_of=int, default=0),
+            Validator("paprika.email", must_exist=True, is_type_of=str),
+            Validator("paprika.password", must_exist=True, is_type_of=str),
+            Validator("paprika.secret_categories", is_type_of=list),
+            Validator("paprika.hidden_categories", is_type_of=list),
+            Validator(
+                "paprika.show_uncategorized", is_type_of=bool, default=True
+            ),
+            Validator("paprika.cron", is_type_of=str, default="0 * * * *"),
+            Validator("app.server_timing", is_type_of=bool, default=True),
+            Validator("app.slow_request_ms", is_type_of=int, default=500),
+            Validator("app.profile_secret", is_type_of=str, default=""),
+            Validator("app.compress_html", is_type_of=bool, default=True),
+            Validator("app.compression_cache_mb", is_type_of=int, default=16),
+            Validator("app.stream_templates", is_type_of=bool, default=False),
+            Validator(
+                "app.cache_control.recipe", is_type_of=str, default="no-cache"
+            ),
+            Validator(
+                "app.cache_control.gallery", is_type_of=str, default="no-cache"
+            ),
+            Validator(
+                "app.cache_control.images",
+                is_type_of=str,
+                default="public, max-age=86400",
+            ),
+            Validator(
+                "app.profile_dir",
+                is_type_of=str,
+                default=str(_BASE_DIR.parent / "data" / "profiles"),
+            ),
+            Validator("backup.keep", is_type_of=int, default=7),
+            Validator("backup.after_sync", is_type_of=bool, default=False),
+        ],
+    )
+    config.update(
+        {
+            "environment": env_config.environment,
+            "hostname": env_config.hostname,
+            "project_name": env_config.name,
+        }
+    )
+    return config
+
+
+EnvConfig = LazySettings(_load_env_config)
+Config = LazySettings(_load_config)
@@ -1,5 +1,10 @@
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from pathlib import Path, PosixPath
+from typing import NamedTuple
 
 from peewee import DateTimeField, Model, Proxy, SqliteDatabase
 
@@ -13,6 +18,13 @@ _SQLITE_FILE_PATH: PosixPath = _BASE_DIR.parent / "data" / "sqlite.db"
 
 _INITIALIZED_DB: bool = False
 
+_QUERIES: ContextVar[list["Query"] | None] = ContextVar("queries", default=None)
+
+
+class Query(NamedTuple):
+    sql: str
+    duration: float
+
 
 class LazyProxy(Proxy):
     def __getattr__(self, attr):
@@ -24,6 +36,31 @@ class LazyProxy(Proxy):
 db_proxy: Proxy = LazyProxy()
 
 
+class TracingSqliteDatabase(SqliteDatabase):
+    def execute_sql(self, sql, params=None):
+        queries = _QUERIES.get()
+        if queries is None:
+            return super().execute_sql(sql, params)
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params)
+        finally:
+            queries.append(Query(sql, time.perf_counter() - start))
+
+
+@contextmanager
+def track_queries() -> Iterator[list[Query]]:
+    parent = _QUERIES.get()
+    queries: list[Query] = []
+    token = _QUERIES.set(queries)
+    try:
+        yield queries
+    finally:
+        _QUERIES.reset(token)
+        if parent is not None:
+            parent.extend(queries)
+
+
 class BaseModel(Model):
     time_created = DateTimeField(default=datetime.now)
     time_updated = DateTimeField(null=True)
@@ -40,22 +77,30 @@ class BaseModel(Model):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+    @classmethod
+    def migrate(cls) -> None:
+        """Fix up an existing table before new indexes are created on it."""
+
 
-def initialize_db(force: bool = False) -> None:
+def initialize_db(force: bool = False, path: Path | None = None) -> None:
     global _SQLITE, _INITIALIZED_DB
     if _INITIALIZED_DB and not force:
         return
     if _SQLITE is None or force:
-        database = (
-            ":memory:"
-            if Config.sqlite.db == SQLiteDB.MEMORY
-            else _SQLITE_FILE_PATH
-        )
-        _SQLITE = SqliteDatabase(database, pragmas={"foreign_keys": 1})
+        if path is not None:
+            database = str(path)
+        elif Config.sqlite.db == SQLiteDB.MEMORY:
+            database = ":memory:"
+        else:
+            database = str(_SQLITE_FILE_PATH)
+        _SQLITE = TracingSqliteDatabase(database, pragmas={"foreign_keys": 1})
 
     _SQLITE.connect()
     db_proxy.initialize(_SQLITE)
 
     models = get_all_subclasses(BaseModel)
+    for model in models:
+        if model.table_exists():
+            model.migrate()
     _SQLITE.create_tables(models)
     _INITIALIZED_DB = True
@@ -0,0 +1,274 @@
+import re
+from collections import Counter
+from collections.abc import Iterable, Mapping
+from enum import StrEnum
+from urllib.parse import urlencode
+
+from peewee import (
+    CharField,
+    CompositeKey,
+    ForeignKeyField,
+    SelectBase,
+    fn,
+)
+
+from src.database import BaseModel, db_proxy
+from src.ingredients import UNITS, Ingredient
+from src.paprika import Recipe
+
+
+class Facet(StrEnum):
+    RATING = "rating"
+    TOTAL_TIME = "total_time"
+    PREP_TIME = "prep_time"
+    COOK_TIME = "cook_time"
+    SOURCE = "source"
+    INGREDIENT = "ingredient"
+
+
+TIME_FACETS = (Facet.TOTAL_TIME, Facet.PREP_TIME, Facet.COOK_TIME)
+
+# Upper bounds in minutes; longer times go in the "more" bucket
+TIME_BUCKETS = {15: "15 min", 30: "30 min", 60: "1 hr", 120: "2 hr"}
+_MORE = "more"
+RATINGS = range(1, 6)
+
+_FACET_LABELS = {
+    Facet.RATING: "Rating",
+    Facet.TOTAL_TIME: "Total time",
+    Facet.PREP_TIME: "Prep time",
+    Facet.COOK_TIME: "Cook time",
+    Facet.SOURCE: "Source",
+    Facet.INGREDIENT: "Ingredient",
+}
+_TOP_VALUES = 10
+_COUNT_BATCH_SIZE = 500
+
+_HOURS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:h|hr|hrs|hour|hours)(?![a-z])", re.I)
+_MINUTES = re.compile(r"(\d+)\s*(?:m|min|mins|minute|minutes)(?![a-z])", re.I)
+_CLOCK = re.compile(r"^\s*(\d+):(\d{2})\s*$")
+_NUMBER = re.compile(r"^\s*(\d+)\s*$")
+_WORD = re.compile(r"[a-z]+")
+
+_STOPWORDS = {
+    "and",
+    "chopped",
+    "diced",
+    "fresh",
+    "for",
+    "large",
+    "medium",
+    "minced",
+    "optional",
+    "or",
+    "sliced",
+    "small",
+    "taste",
+    "the",
+    "to",
+    "with",
+}
+
+
+class RecipeFacet(BaseModel):
+    """Posting lists: the recipes that have each facet value."""
+
+    facet = CharField()
+    value = CharField()
+    recipe = ForeignKeyField(Recipe, on_delete="CASCADE")
+
+    class Meta:
+        table_name = "recipe_facets"
+        primary_key = CompositeKey("facet", "value", "recipe")
+
+
+def parse_minutes(value: str | None) -> int | None:
+    if not value:
+        return None
+    if match := _CLOCK.match(value):
+        return int(match.group(1)) * 60 + int(match.group(2))
+    if match := _NUMBER.match(value):
+        return int(match.group(1))
+    hours = sum(float(hours) for hours in _HOURS.findall(value))
+    minutes = sum(int(minutes) for minutes in _MINUTES.findall(value))
+    if not hours and not minutes:
+        return None
+    return round(hours * 60) + minutes
+
+
+def time_bucket(minutes: int) -> str:
+    for bound in TIME_BUCKETS:
+        if minutes <= bound:
+            return str(bound)
+    return _MORE
+
+
+def normalize_term(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("oes") and len(word) > 4:
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def ingredient_terms(text: str) -> set[str]:
+    return {
+        normalize_term(word)
+        for word in _WORD.findall(text.lower())
+        if len(word) > 2 and word not in UNITS and word not in _STOPWORDS
+    }
+
+
+def recipe_facets(
+    recipe: Recipe, ingredients: Iterable[Ingredient]
+) -> set[tuple[str, str]]:
+    facets: set[tuple[str, str]] = set()
+    if recipe.rating:
+        facets.add((Facet.RATING, str(recipe.rating)))
+    for facet in TIME_FACETS:
+        minutes = parse_minutes(getattr(recipe, facet))
+        if minutes is not None:
+            facets.add((facet, time_bucket(minutes)))
+    if domain := recipe.source_domain_name:
+        facets.add((Facet.SOURCE, domain))
+    for ingredient in ingredients:
+        if not ingredient.heading:
+            for term in ingredient_terms(ingredient.text):
+                facets.add((Facet.INGREDIENT, term))
+    return facets
+
+
+def save_facets(recipe: Recipe, ingredients: Iterable[Ingredient]) -> None:
+    rows = [
+        {"facet": facet, "value": value, "recipe": recipe.uid}
+        for facet, value in sorted(recipe_facets(recipe, ingredients))
+    ]
+    with db_proxy.atomic():
+        RecipeFacet.delete().where(RecipeFacet.recipe == recipe.uid).execute()
+        if rows:
+            RecipeFacet.insert_many(rows).execute()
+
+
+def parse_filters(params: Mapping[str, str]) -> dict[Facet, str]:
+    filters = {}
+    for facet in Facet:
+        value = (params.get(facet) or "").strip().lower()
+        if not value:
+            continue
+        if facet == Facet.RATING and not (
+            value.isdigit() and int(value) in RATINGS
+        ):
+            continue
+        if facet in TIME_FACETS and value not in map(str, TIME_BUCKETS):
+            continue
+        filters[facet] = value
+    return filters
+
+
+def _filter_values(facet: Facet, value: str) -> list[list[str]]:
+    # Each inner list is one posting list lookup; all must match
+    if facet == Facet.RATING:
+        return [[str(rating) for rating in RATINGS if rating >= int(value)]]
+    if facet in TIME_FACETS:
+        return [[str(bound) for bound in TIME_BUCKETS if bound <= int(value)]]
+    if facet == Facet.INGREDIENT:
+        return [[term] for term in sorted(ingredient_terms(value))] or [[value]]
+    return [[value]]
+
+
+def matching_recipes(filters: dict[Facet, str]):
+    """A subquery of the uids of recipes matching all filters, or None."""
+    query: SelectBase | None = None
+    for facet, value in filters.items():
+        for values in _filter_values(facet, value):
+            postings = RecipeFacet.select(RecipeFacet.recipe).where(
+                (RecipeFacet.facet == facet) & RecipeFacet.value.in_(values)
+            )
+            query = postings if query is None else query & postings
+    return query
+
+
+def facet_counts(recipe_uids: list[str]) -> dict[str, Counter]:
+    counts: dict[str, Counter] = {facet: Counter() for facet in Facet}
+    for i in range(0, len(recipe_uids), _COUNT_BATCH_SIZE):
+        batch = recipe_uids[i : i + _COUNT_BATCH_SIZE]
+        for facet, value, count in (
+            RecipeFacet.select(
+                RecipeFacet.facet,
+                RecipeFacet.value,
+                fn.COUNT(RecipeFacet.recipe),
+            )
+            .where(RecipeFacet.recipe.in_(batch))
+            .group_by(RecipeFacet.facet, RecipeFacet.value)
+            .tuples()
+            .iterator()
+        ):
+            counts[facet][value] += count
+    return counts
+
+
+def _url(path: str, filters: dict[Facet, str], facet: Facet, value: str) -> str:
+    params = dict(filters)
+    if params.get(facet) == value:
+        params.pop(facet, None)
+    else:
+        params[facet] = value
+    query = urlencode(sorted(params.items()))
+    return f"{path}?{query}" if query else path
+
+
+def facet_options(
+    path: str, filters: dict[Facet, str], counts: dict[str, Counter]
+) -> list[dict]:
+    """Subnav links for each facet; following an active one removes it."""
+    facets = []
+
+    options = []
+    for rating in RATINGS:
+        count = sum(
+            n
+            for value, n in counts[Facet.RATING].items()
+            if int(value) >= rating
+        )
+        options.append((f"{rating}+ ★", str(rating), count))
+    facets.append((Facet.RATING, options))
+
+    for facet in TIME_FACETS:
+        options = []
+        for bound, label in TIME_BUCKETS.items():
+            count = sum(
+                n
+                for value, n in counts[facet].items()
+                if value != _MORE and int(value) <= bound
+            )
+            options.append((f"≤ {label}", str(bound), count))
+        facets.append((facet, options))
+
+    for facet in (Facet.SOURCE, Facet.INGREDIENT):
+        facets.append(
+            (
+                facet,
+                [
+                    (value, value, count)
+                    for value, count in counts[facet].most_common(_TOP_VALUES)
+                ],
+            )
+        )
+
+    result = []
+    for facet, options in facets:
+        links = [
+            {
+                "label": label,
+                "count": count,
+                "url": _url(path, filters, facet, value),
+                "active": filters.get(facet) == value,
+            }
+            for label, value, count in options
+            if count or filters.get(facet) == value
+        ]
+        if links:
+            result.append({"name": _FACET_LABELS[facet], "options": links})
+    return result
@@ -0,0 +1,350 @@
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from enum import StrEnum
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import urlparse
+
+from peewee import CharField, IntegerField
+
+from src.database import BaseModel, db_proxy
+from src.paprika import PaprikaClient, Photo, Recipe
+
+_BASE_DIR: Path = Path(__file__).parent
+_IMAGE_DIR: Path = _BASE_DIR / "static" / "images"
+
+# Content lives once under its digest; public names are hardlinks to it
+_OBJECTS = ".objects"
+_BATCH_SIZE = 500
+# Files written or linked this recently are kept by collect_images(): a
+# concurrent store_image() may not have committed the rows referencing them
+_GC_GRACE = 15 * 60  # seconds
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+
+class Problem(StrEnum):
+    MISSING = "missing"
+    TRUNCATED = "truncated"
+    CORRUPT = "corrupt"
+
+
+class Audit(NamedTuple):
+    checked: int
+    broken: dict[str, Problem]
+    orphaned: list[Path]
+    # Referenced files from before the object store
+    unadopted: list[str]
+
+
+class Image(BaseModel):
+    # The public filename under static/images
+    name = CharField(primary_key=True)
+    digest = CharField(index=True)
+    # Paprika's photo hash, to skip downloads of content we already have
+    source_hash = CharField(null=True, index=True)
+    size = IntegerField()
+
+    class Meta:
+        table_name = "images"
+
+
+def image_name(url: str | None) -> str | None:
+    if not url:
+        return None
+    return Path(urlparse(url).path).name or None
+
+
+def _object_path(digest: str) -> Path:
+    return _IMAGE_DIR / _OBJECTS / digest[:2] / digest
+
+
+def _file_digest(path: Path) -> str:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def _link(source: Path, dest: Path) -> None:
+    if dest.exists():
+        if dest.samefile(source):
+            return
+        dest.unlink()
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+def _add_object(path: Path) -> str:
+    """Move a file into the object store, dropping it if already stored."""
+    digest = _file_digest(path)
+    dest = _object_path(digest)
+    if dest.exists():
+        path.unlink()
+        logger.debug(f"Image already stored: {digest}")
+    else:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        path.replace(dest)
+    return digest
+
+
+def _known_digest(source_hash: str | None) -> str | None:
+    if not source_hash:
+        return None
+    for image in Image.select(Image.digest).where(
+        Image.source_hash == source_hash
+    ):
+        if _object_path(image.digest).exists():
+            return image.digest
+    return None
+
+
+def store_image(url: str | None, source_hash: str | None = None) -> str | None:
+    """Make the image at url available by name, downloading only new content.
+
+    Returns the public filename, or None if the url has no filename.
+    """
+    name = image_name(url)
+    if not url or not name:
+        return None
+
+    image = Image.get_or_none(name=name)
+    public = _IMAGE_DIR / name
+    if (
+        image
+        and source_hash
+        and image.source_hash == source_hash
+        and public.exists()
+    ):
+        logger.debug(f"Image unchanged: {name}")
+        return name
+
+    digest = _known_digest(source_hash)
+    if digest:
+        logger.debug(f"Reusing stored image for {name}: {digest}")
+    else:
+        tmp = _IMAGE_DIR / _OBJECTS / f"tmp-{uuid.uuid4().hex}"
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with PaprikaClient.get() as client:
+                client.download_photo(url, tmp)
+            digest = _add_object(tmp)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    obj = _object_path(digest)
+    _link(obj, public)
+    Image.insert(
+        name=name,
+        digest=digest,
+        source_hash=source_hash,
+        size=obj.stat().st_size,
+    ).on_conflict_replace().execute()
+    logger.debug(f"Saved image: {name}")
+    return name
+
+
+def referenced_images() -> set[str]:
+    names = set()
+    for model in (Recipe, Photo):
+        for (url,) in model.select(model.photo_url).tuples().iterator():
+            if name := image_name(url):
+                names.add(name)
+    return names
+
+
+def _public_files() -> dict[str, Path]:
+    if not _IMAGE_DIR.exists():
+        return {}
+    return {
+        path.name: path
+        for path in _IMAGE_DIR.iterdir()
+        if path.is_file() and not path.name.startswith(".")
+    }
+
+
+def _adopt(files: dict[str, Path], digests: dict[str, str]) -> list[dict]:
+    """Move files from before the object store into it, by their digests."""
+    adopted = []
+    for name, digest in digests.items():
+        obj = _object_path(digest)
+        if not obj.exists():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            _link(files[name], obj)
+        _link(obj, files[name])
+        adopted.append(
+            {"name": name, "digest": digest, "size": obj.stat().st_size}
+        )
+    with db_proxy.atomic():
+        for i in range(0, len(adopted), _BATCH_SIZE):
+            Image.insert_many(adopted[i : i + _BATCH_SIZE]).execute()
+    return adopted
+
+
+def _recent(path: Path, cutoff: float) -> bool:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return True
+    # Linking a stored object to another name updates its ctime
+    return max(stat.st_mtime, stat.st_ctime) > cutoff
+
+
+def collect_images() -> int:
+    """Remove images nothing references, then content no image points to.
+
+    Referenced files from before the object store are adopted into it.
+    Files changed within _GC_GRACE are left for a later run.
+    """
+    cutoff = time.time() - _GC_GRACE
+    referenced = referenced_images()
+    files = _public_files()
+    objects = _IMAGE_DIR / _OBJECTS
+    stored = list(objects.glob("*/*")) if objects.exists() else []
+    # Before anything is removed: unlinking a name changes its object's ctime
+    kept = referenced | {
+        name for name, path in files.items() if _recent(path, cutoff)
+    }
+    recent = {path for path in stored if _recent(path, cutoff)}
+    images: dict[str, str] = dict(
+        Image.select(Image.name, Image.digest).tuples().iterator()
+    )
+
+    legacy = (referenced & set(files)) - set(images)
+    for row in _adopt(
+        files, {name: _file_digest(files[name]) for name in legacy}
+    ):
+        images[row["name"]] = row["digest"]
+
+    unreferenced = [name for name in images if name not in kept]
+    with db_proxy.atomic():
+        for i in range(0, len(unreferenced), _BATCH_SIZE):
+            batch = unreferenced[i : i + _BATCH_SIZE]
+            Image.delete().where(Image.name.in_(batch)).execute()
+
+    removed = 0
+    for name, path in files.items():
+        if name not in kept:
+            path.unlink()
+            removed += 1
+
+    digests = {digest for name, digest in images.items() if name in kept}
+    for path in stored:
+        if path.name not in digests and path not in recent:
+            path.unlink(missing_ok=True)
+            removed += 1
+
+    logger.info(f"Removed {removed} unreferenced image files")
+    return removed
+
+
+def _sources() -> dict[str, tuple[str, str | None]]:
+    """The url and Paprika hash of every referenced image, by name."""
+    sources = {}
+    for model, source_hash_field in (
+        (Photo, Photo.hash),
+        (Recipe, Recipe.photo_hash),
+    ):
+        for url, source_hash in (
+            model.select(model.photo_url, source_hash_field).tuples().iterator()
+        ):
+            if name := image_name(url):
+                sources[name] = (url, source_hash)
+    return sources
+
+
+def _check(name: str, digest: str | None, size: int | None) -> Problem | None:
+    public = _IMAGE_DIR / name
+    if digest is None or not public.exists():
+        return Problem.MISSING
+    if public.stat().st_size != size:
+        return Problem.TRUNCATED
+    # Hashing releases the GIL, so threads spread this across cores
+    if _file_digest(public) != digest:
+        return Problem.CORRUPT
+    return None
+
+
+def audit_images(workers: int | None = None, adopt: bool = False) -> Audit:
+    """Check every referenced image exists with the expected size and hash.
+
+    Referenced files from before the object store are reported unadopted,
+    or with adopt, moved into it like collect_images() does. Otherwise the
+    audit changes nothing.
+    """
+    sources = _sources()
+    files = _public_files()
+    images = {
+        name: (digest, size)
+        for name, digest, size in Image.select(
+            Image.name, Image.digest, Image.size
+        )
+        .tuples()
+        .iterator()
+    }
+    names = sorted(sources)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        legacy = sorted((set(sources) & set(files)) - set(images))
+        if adopt:
+            legacy_digests = pool.map(
+                _file_digest, [files[name] for name in legacy]
+            )
+            for row in _adopt(files, dict(zip(legacy, legacy_digests))):
+                images[row["name"]] = (row["digest"], row["size"])
+            legacy = []
+
+        checked = [name for name in names if name not in legacy]
+        problems = pool.map(
+            lambda name: _check(name, *images.get(name, (None, None))),
+            checked,
+        )
+        broken = {
+            name: problem
+            for name, problem in zip(checked, problems)
+            if problem is not None
+        }
+
+    digests = {
+        digest for name, (digest, _) in images.items() if name in sources
+    }
+    orphaned = [path for name, path in files.items() if name not in sources]
+    objects = _IMAGE_DIR / _OBJECTS
+    if objects.exists():
+        orphaned += [
+            path for path in objects.glob("*/*") if path.name not in digests
+        ]
+    return Audit(
+        checked=len(names),
+        broken=broken,
+        orphaned=sorted(orphaned),
+        unadopted=legacy,
+    )
+
+
+def repair_images(broken: dict[str, Problem]) -> int:
+    """Re-download broken images, leaving intact stored content in place."""
+    sources = _sources()
+    repaired = 0
+    for name, problem in broken.items():
+        if problem != Problem.MISSING:
+            image = Image.get_or_none(name=name)
+            if image:
+                (_IMAGE_DIR / name).unlink(missing_ok=True)
+                obj = _object_path(image.digest)
+                if obj.exists() and _file_digest(obj) != image.digest:
+                    obj.unlink()
+                image.delete_instance()
+        url, source_hash = sources[name]
+        try:
+            store_image(url, source_hash=source_hash)
+        except Exception:
+            logger.exception(f"Could not repair image: {name}")
+            continue
+        repaired += 1
+    return repaired
@@ -0,0 +1,235 @@
+import re
+import unicodedata
+from fractions import Fraction
+from typing import NamedTuple
+
+from peewee import BooleanField, CharField, ForeignKeyField, IntegerField
+
+from src.database import BaseModel, db_proxy
+from src.paprika import Recipe
+
+_UNICODE_FRACTIONS = "¼-¾⅐-⅞"
+_NUMBER = (
+    rf"\d+\s*[{_UNICODE_FRACTIONS}]|\d+\s+\d+/\d+|\d+/\d+|\d+\.\d+|\d+|"
+    rf"[{_UNICODE_FRACTIONS}]"
+)
+QUANTITY_PATTERN = re.compile(
+    rf"^\s*(?P<quantity>(?P<low>{_NUMBER})(?:\s*[-–]\s*(?P<high>{_NUMBER}))?)"
+)
+_UNIT_PATTERN = re.compile(r"^\s*([A-Za-z]+\.?)(?=\s|$)")
+
+UNITS = {
+    "c",
+    "can",
+    "cans",
+    "clove",
+    "cloves",
+    "cup",
+    "cups",
+    "dash",
+    "g",
+    "gram",
+    "grams",
+    "kg",
+    "l",
+    "lb",
+    "lbs",
+    "liter",
+    "liters",
+    "ml",
+    "ounce",
+    "ounces",
+    "oz",
+    "pinch",
+    "pound",
+    "pounds",
+    "qt",
+    "quart",
+    "quarts",
+    "pt",
+    "pint",
+    "pints",
+    "stick",
+    "sticks",
+    "tablespoon",
+    "tablespoons",
+    "tbs",
+    "tbsp",
+    "teaspoon",
+    "teaspoons",
+    "tsp",
+}
+
+_MAX_DENOMINATOR = 8
+
+
+class RecipeIngredient(BaseModel):
+    recipe = ForeignKeyField(Recipe, on_delete="CASCADE")
+    position = IntegerField()
+    heading = BooleanField(default=False)
+    # Exact fractions, e.g. "3/2"
+    quantity = CharField(null=True)
+    quantity_max = CharField(null=True)
+    # The quantity as written, so unscaled pages render the original text
+    quantity_text = CharField(null=True)
+    unit = CharField(null=True)
+    # The line after the quantity, unit included
+    text = CharField()
+
+    class Meta:
+        table_name = "recipe_ingredients"
+        indexes = ((("recipe", "position"), True),)
+
+
+class Ingredient(NamedTuple):
+    text: str
+    heading: bool = False
+    quantity: Fraction | None = None
+    quantity_max: Fraction | None = None
+    quantity_text: str | None = None
+    unit: str | None = None
+
+    def scaled(self, factor: Fraction) -> str | None:
+        if self.quantity is None:
+            return None
+        if factor == 1:
+            return self.quantity_text
+        quantity = format_quantity(self.quantity * factor)
+        if self.quantity_max is None:
+            return quantity
+        return f"{quantity}-{format_quantity(self.quantity_max * factor)}"
+
+
+def _parse_number(value: str) -> Fraction:
+    value = value.strip()
+    for i, char in enumerate(value):
+        if "¼" <= char <= "¾" or "⅐" <= char <= "⅞":
+            whole = value[:i].strip()
+            fraction = Fraction(unicodedata.numeric(char)).limit_denominator(
+                _MAX_DENOMINATOR * 2
+            )
+            return (int(whole) if whole else 0) + fraction
+    whole, _, part = value.rpartition(" ")
+    return (int(whole) if whole else 0) + Fraction(part)
+
+
+def format_quantity(quantity: Fraction) -> str:
+    rounded = quantity.limit_denominator(_MAX_DENOMINATOR)
+    if abs(rounded - quantity) > Fraction(1, 100):
+        return f"{float(quantity):.2f}".rstrip("0").rstrip(".")
+    whole, remainder = divmod(rounded.numerator, rounded.denominator)
+    if not remainder:
+        return str(whole)
+    fraction = f"{remainder}/{rounded.denominator}"
+    return f"{whole} {fraction}" if whole else fraction
+
+
+def parse_line(line: str) -> Ingredient:
+    if line.startswith("**") and line.endswith("**"):
+        return Ingredient(text=line, heading=True)
+
+    match = QUANTITY_PATTERN.match(line)
+    if not match:
+        return Ingredient(text=line)
+
+    try:
+        quantity = _parse_number(match.group("low"))
+        quantity_max = (
+            _parse_number(match.group("high")) if match.group("high") else None
+        )
+    except (ValueError, ZeroDivisionError):
+        # e.g. "1/0 cup", which is left as written
+        return Ingredient(text=line)
+
+    text = line[match.end() :]
+    unit_match = _UNIT_PATTERN.match(text)
+    unit = None
+    if unit_match and unit_match.group(1).rstrip(".").lower() in UNITS:
+        unit = unit_match.group(1).rstrip(".").lower()
+    return Ingredient(
+        text=text,
+        quantity=quantity,
+        quantity_max=quantity_max,
+        quantity_text=match.group("quantity"),
+        unit=unit,
+    )
+
+
+def parse_ingredients(content: str | None) -> list[Ingredient]:
+    return [parse_line(line) for line in (content or "").splitlines() if line]
+
+
+def parse_scale(value: str | None) -> Fraction:
+    if not value:
+        return Fraction(1)
+    try:
+        scale = Fraction(value)
+    except (ValueError, ZeroDivisionError):
+        return Fraction(1)
+    if scale <= 0 or scale > 100:
+        return Fraction(1)
+    return scale
+
+
+def scale_text(value: str | None, factor: Fraction) -> str | None:
+    if not value or factor == 1:
+        return value
+    ingredient = parse_line(value)
+    if ingredient.quantity is None:
+        return value
+    return f"{ingredient.scaled(factor)}{ingredient.text}"
+
+
+def save_ingredients(recipe_uid: str, content: str | None) -> list[Ingredient]:
+    ingredients = parse_ingredients(content)
+    rows = [
+        {
+            "recipe": recipe_uid,
+            "position": position,
+            "heading": ingredient.heading,
+            "quantity": _str(ingredient.quantity),
+            "quantity_max": _str(ingredient.quantity_max),
+            "quantity_text": ingredient.quantity_text,
+            "unit": ingredient.unit,
+            "text": ingredient.text,
+        }
+        for position, ingredient in enumerate(ingredients)
+    ]
+    with db_proxy.atomic():
+        RecipeIngredient.delete().where(
+            RecipeIngredient.recipe == recipe_uid
+        ).execute()
+        if rows:
+            RecipeIngredient.insert_many(rows).execute()
+    return ingredients
+
+
+def load_ingredients(recipe_uid: str) -> list[Ingredient]:
+    return [
+        Ingredient(
+            text=text,
+            heading=heading,
+            quantity=Fraction(quantity) if quantity else None,
+            quantity_max=Fraction(quantity_max) if quantity_max else None,
+            quantity_text=quantity_text,
+            unit=unit,
+        )
+        for heading, quantity, quantity_max, quantity_text, unit, text in (
+            RecipeIngredient.select(
+                RecipeIngredient.heading,
+                RecipeIngredient.quantity,
+                RecipeIngredient.quantity_max,
+                RecipeIngredient.quantity_text,
+                RecipeIngredient.unit,
+                RecipeIngredient.text,
+            )
+            .where(RecipeIngredient.recipe == recipe_uid)
+            .order_by(RecipeIngredient.position)
+            .tuples()
+            .iterator()
+        )
+    ]
+
+
+def _str(value: Fraction | None) -> str | None:
+    return None if value is None else str(value)
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Usage:
+    ./%(script_name)s [--requests=<n>] [--concurrency=<n>] [--mix=<mix>]
+        [--recipes=<n>] [--categories=<n>] [--seed=<n>] [--uvicorn]
+        [--max-p95=<ms>] [--json]
+
+Options:
+    -h --help           Show this screen.
+    --requests=<n>      Number of requests to send [default: 1000].
+    --concurrency=<n>   Number of concurrent clients [default: 10].
+    --mix=<mix>         Weighted request mix of the index, category and recipe
+                            pages [default: index=1,category=2,recipe=4].
+    --recipes=<n>       Number of recipes to generate [default: 500].
+    --categories=<n>    Number of categories to generate [default: 20].
+    --seed=<n>          Seed for the generated database and request mix
+                            [default: 0].
+    --uvicorn           Serve the app with a local uvicorn instead of driving
+                            the ASGI app in-process.
+    --max-p95=<ms>      Exit with an error if the overall p95 latency exceeds
+                            this many milliseconds.
+    --json              Print the report as JSON.
+
+Examples:
+    # Load test the app in-process with the default mix
+    ./%(script_name)s
+
+    # Load test a local uvicorn with a larger library
+    ./%(script_name)s --uvicorn --recipes=5000 --concurrency=50
+
+    # Fail when the p95 latency regresses past 50ms
+    ./%(script_name)s --max-p95=50
+"""
+
+import asyncio
+import json
+import logging
+import random
+import re
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.client import HTTPConnection
+from pathlib import Path
+from typing import NamedTuple
+
+import uvicorn
+from docopt import docopt
+from slugify import slugify
+
+from src import asgi_client
+from src.app import app
+from src.database import db_proxy, initialize_db, track_queries
+from src.paprika import Category, CategoryRecipe, Photo, Recipe
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+__doc__ %= {
+    "script_name": Path(__file__).name,
+}
+
+ROUTES = ("index", "category", "recipe")
+
+_BATCH_SIZE = 100
+
+_WORDS = (
+    "apple basil butter carrot chili cumin garlic ginger honey lemon lime "
+    "mint miso onion paprika pepper rice saffron sesame thyme tomato"
+).split()
+_UNITS = ("cup", "cups", "tbsp", "tsp", "g", "oz", "")
+_QUANTITIES = ("1", "2", "1/2", "1 1/2", "½", "2-3", "0.5", "250")
+_SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class Sample(NamedTuple):
+    route: str
+    status: int
+    latency: float
+    queries: int | None
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        route, _, weight = item.partition("=")
+        route = route.strip()
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route in mix: {route}")
+        weights[route] = int(weight) if weight else 1
+    if not any(weights.values()):
+        raise ValueError("The request mix must have a positive weight")
+    return weights
+
+
+def percentile(values: list[float], n: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[n - 1]
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize()
+
+
+def _ingredients(rng: random.Random) -> str:
+    lines = []
+    for i in range(rng.randint(4, 15)):
+        if i and i % 6 == 0:
+            lines.append(f"**{_sentence(rng, 2)}**")
+        unit = rng.choice(_UNITS)
+        lines.append(
+            f"{rng.choice(_QUANTITIES)} {unit} {_sentence(rng, 2)}".replace(
+                "  ", " "
+            )
+        )
+    return "\n".join(lines)
+
+
+def _directions(rng: random.Random, photo_names: list[str]) -> str:
+    steps = [
+        f"{i}. {_sentence(rng, rng.randint(8, 30))}."
+        for i in range(1, rng.randint(3, 10))
+    ]
+    for name in photo_names:
+        steps.append(f"[photo:{name}]")
+    return "\n\n".join(steps)
+
+
+def generate_database(
+    path: Path, recipes: int, categories: int, seed: int = 0
+) -> None:
+    rng = random.Random(seed)
+    # Importing the app above registers every model its pages query, so all
+    # of their tables are created here
+    initialize_db(force=True, path=path)
+    now = datetime(2024, 1, 1)
+
+    category_names = [f"{_sentence(rng, 1)} {i}" for i in range(categories)]
+    category_rows = [
+        {
+            "uid": f"category-{i}",
+            "order_flag": i,
+            "name": name,
+            "slug": slugify(name),
+            "parent_uid": None,
+        }
+        for i, name in enumerate(category_names)
+    ]
+
+    recipe_rows, photo_rows, category_recipe_rows = [], [], []
+    for i in range(recipes):
+        uid = f"recipe-{i}"
+        name = f"{_sentence(rng, rng.randint(2, 4))} {i}"
+        photo_names = [str(n) for n in range(1, rng.randint(0, 3) + 1)]
+        created = now - timedelta(days=rng.randint(0, 3650))
+        recipe_rows.append(
+            {
+                "uid": uid,
+                "hash": f"{uid}-hash",
+                "name": name,
+                "slug": slugify(name),
+                "ingredients": _ingredients(rng),
+                "directions": _directions(rng, photo_names),
+                "description": _sentence(rng, 20),
+                "notes": _sentence(rng, 10),
+                "nutritional_info": f"{rng.randint(100, 900)} calories",
+                "servings": str(rng.randint(1, 8)),
+                "prep_time": f"{rng.randint(5, 60)} min",
+                "cook_time": f"{rng.randint(5, 120)} min",
+                "rating": rng.randint(0, 5),
+                "in_trash": False,
+                "photo_large": f"{uid}.jpg",
+                "created": created,
+                "time_updated": created + timedelta(days=rng.randint(0, 30)),
+                "categories": "[]",
+            }
+        )
+        for name in photo_names:
+            photo_rows.append(
+                {
+                    "uid": f"{uid}-photo-{name}",
+                    "filename": f"{uid}-photo-{name}.jpg",
+                    "recipe_uid": uid,
+                    "order_flag": int(name),
+                    "name": name,
+                    "hash": f"{uid}-photo-{name}-hash",
+                }
+            )
+        if categories:
+            for category in rng.sample(
+                category_rows, k=min(categories, rng.randint(1, 3))
+            ):
+                category_recipe_rows.append(
+                    {"category": category["uid"], "recipe": uid}
+                )
+
+    with db_proxy.atomic():
+        for model, rows in (
+            (Category, category_rows),
+            (Recipe, recipe_rows),
+            (Photo, photo_rows),
+            (CategoryRecipe, category_recipe_rows),
+        ):
+            for i in range(0, len(rows), _BATCH_SIZE):
+                model.insert_many(rows[i : i + _BATCH_SIZE]).execute()
+
+    logger.info(
+        f"Generated database with {recipes} recipes and {categories} "
+        f"categories: {path}"
+    )
+
+
+def request_paths(
+    count: int, weights: dict[str, int], seed: int = 0
+) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    recipe_slugs = [recipe.slug for recipe in Recipe.select(Recipe.slug)]
+    category_slugs = [
+        category.slug for category in Category.select(Category.slug)
+    ]
+    paths = {
+        "index": ["/"],
+        "category": [f"/c/{slug}" for slug in category_slugs],
+        "recipe": [f"/r/{slug}" for slug in recipe_slugs],
+    }
+    routes = [route for route in weights if paths[route]]
+    if not routes:
+        raise ValueError("The generated database has nothing to request")
+    chosen = rng.choices(
+        routes, weights=[weights[route] for route in routes], k=count
+    )
+    return [(route, rng.choice(paths[route])) for route in chosen]
+
+
+async def _run_in_process(
+    paths: list[tuple[str, str]], concurrency: int
+) -> list[Sample]:
+    queue: asyncio.Queue[tuple[str, str]] = asyncio.Queue()
+    for item in paths:
+        queue.put_nowait(item)
+    samples = []
+
+    async def worker():
+        while not queue.empty():
+            route, path = queue.get_nowait()
+            with track_queries() as queries:
+                start = time.perf_counter()
+                response = await asgi_client.get(
+                    app, path, {"host": "loadtest"}
+                )
+                latency = time.perf_counter() - start
+            samples.append(
+                Sample(route, response.status, latency, len(queries))
+            )
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def run_in_process(
+    paths: list[tuple[str, str]], concurrency: int
+) -> list[Sample]:
+    return asyncio.run(_run_in_process(paths, concurrency))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_uvicorn(paths: list[tuple[str, str]], concurrency: int) -> list[Sample]:
+    port = _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(
+            "src.app:app", host="127.0.0.1", port=port, log_level="error"
+        )
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    local = threading.local()
+    lock = threading.Lock()
+    samples = []
+
+    def get(item: tuple[str, str]) -> None:
+        route, path = item
+        if not hasattr(local, "connection"):
+            local.connection = HTTPConnection("127.0.0.1", port)
+        start = time.perf_counter()
+        local.connection.request("GET", path)
+        response = local.connection.getresponse()
+        response.read()
+        latency = time.perf_counter() - start
+        match = _SERVER_TIMING_QUERIES.search(
+            response.getheader("Server-Timing", "")
+        )
+        queries = int(match.group(1)) if match else None
+        with lock:
+            samples.append(Sample(route, response.status, latency, queries))
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(get, paths))
+    finally:
+        server.should_exit = True
+        thread.join()
+    return samples
+
+
+def summarize(samples: list[Sample], duration: float) -> dict:
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample.route].append(sample)
+        by_route["all"].append(sample)
+
+    routes = {}
+    for route in (*ROUTES, "all"):
+        if route not in by_route:
+            continue
+        route_samples = by_route[route]
+        latencies = [sample.latency * 1000 for sample in route_samples]
+        queries = [
+            sample.queries
+            for sample in route_samples
+            if sample.queries is not None
+        ]
+        routes[route] = {
+            "requests": len(route_samples),
+            "errors": sum(
+                1 for sample in route_samples if sample.status >= 400
+            ),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "queries_per_request": (
+                statistics.mean(queries) if queries else None
+            ),
+        }
+
+    return {
+        "requests": len(samples),
+        "duration_s": duration,
+        "throughput_rps": len(samples) / duration if duration else 0.0,
+        "routes": routes,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Requests:    {report['requests']}",
+        f"Duration:    {report['duration_s']:.2f}s",
+        f"Throughput:  {report['throughput_rps']:.1f} req/s",
+        "",
+        f"{'route':<10}{'requests':>10}{'errors':>8}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}",
+    ]
+    for route, stats in report["routes"].items():
+        queries = stats["queries_per_request"]
+        lines.append(
+            f"{route:<10}{stats['requests']:>10}{stats['errors']:>8}"
+            f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+            f"{stats['p99_ms']:>10.2f}"
+            f"{'n/a' if queries is None else f'{queries:.1f}':>10}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+
+    args = docopt(__doc__, argv=argv)
+    requests = int(args["--requests"])
+    concurrency = int(args["--concurrency"])
+    seed = int(args["--seed"])
+    weights = parse_mix(args["--mix"])
+    max_p95 = float(args["--max-p95"]) if args.get("--max-p95") else None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        generate_database(
+            Path(temp_dir) / "loadtest.db",
+            recipes=int(args["--recipes"]),
+            categories=int(args["--categories"]),
+            seed=seed,
+        )
+        paths = request_paths(requests, weights, seed=seed)
+        run = run_uvicorn if args.get("--uvicorn") else run_in_process
+
+        start = time.perf_counter()
+        samples = run(paths, concurrency)
+        report = summarize(samples, time.perf_counter() - start)
+
+    if args.get("--json"):
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+
+    if max_p95 is not None and report["routes"]["all"]["p95_ms"] > max_p95:
+        logger.error(
+            f"p95 latency {report['routes']['all']['p95_ms']:.2f}ms exceeds "
+            f"{max_p95:.2f}ms"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main())
@@ -0,0 +1,320 @@
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from enum import StrEnum
+from typing import TYPE_CHECKING, NamedTuple
+
+from peewee import (
+    AutoField,
+    BooleanField,
+    CharField,
+    FloatField,
+    IntegerField,
+    TextField,
+)
+
+from src.database import BaseModel
+
+if TYPE_CHECKING:
+    from src.profiling import PhaseProfiler
+
+
+class Phase(StrEnum):
+    CATEGORIES = "categories"
+    RECIPE_LIST = "recipe_list"
+    RECIPE_DETAILS = "recipe_details"
+    PHOTOS = "photos"
+    DB_WRITES = "db_writes"
+
+
+class RecordType(StrEnum):
+    CATEGORY = "category"
+    RECIPE = "recipe"
+    PHOTO = "photo"
+
+
+class SyncRunStatus(StrEnum):
+    RUNNING = "running"
+    SUCCESS = "success"
+    FAILED = "failed"
+
+
+class Stats(NamedTuple):
+    added: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+    def __add__(self, other):
+        if not isinstance(other, Stats):
+            return NotImplementedError
+        return Stats(
+            added=self.added + other.added,
+            updated=self.updated + other.updated,
+            deleted=self.deleted + other.deleted,
+        )
+
+
+class SyncRun(BaseModel):
+    id = AutoField()
+    command = CharField()
+    force = BooleanField(default=False)
+    status = CharField(default=SyncRunStatus.RUNNING)
+    error = TextField(null=True)
+    duration = FloatField(default=0)
+
+    # Wall time per phase, in seconds
+    categories_time = FloatField(default=0)
+    recipe_list_time = FloatField(default=0)
+    recipe_details_time = FloatField(default=0)
+    photos_time = FloatField(default=0)
+    db_writes_time = FloatField(default=0)
+
+    api_calls = IntegerField(default=0)
+    api_bytes = IntegerField(default=0)
+    images_downloaded = IntegerField(default=0)
+    image_bytes = IntegerField(default=0)
+
+    added = IntegerField(default=0)
+    updated = IntegerField(default=0)
+    deleted = IntegerField(default=0)
+
+    class Meta:
+        table_name = "sync_runs"
+
+
+class RunMetrics:
+    def __init__(
+        self,
+        command: str,
+        force: bool = False,
+        profiler: "PhaseProfiler | None" = None,
+    ):
+        self.id: int | None = None
+        self.command = command
+        self.force = force
+        self.profiler = profiler
+        self.started = datetime.now()
+        self.phases: dict[Phase, float] = defaultdict(float)
+        self.stats: dict[RecordType, Stats] = defaultdict(Stats)
+        self.api_calls = 0
+        self.api_bytes = 0
+        self.api_retries = 0
+        # Requests per second the rate limiter settled on
+        self.api_rate: float | None = None
+        self.images_downloaded = 0
+        self.image_bytes = 0
+        self._start = time.perf_counter()
+        self._end: float | None = None
+        self._mark = self._start
+        self._stack: list[Phase] = []
+
+    @property
+    def duration(self) -> float:
+        end = self._end if self._end is not None else time.perf_counter()
+        return end - self._start
+
+    @property
+    def totals(self) -> Stats:
+        return sum(self.stats.values(), Stats())
+
+    def _flush(self) -> None:
+        # Credit the time since the last mark to the innermost phase so that
+        # nested phases are never counted twice
+        now = time.perf_counter()
+        if self._stack:
+            self.phases[self._stack[-1]] += now - self._mark
+        self._mark = now
+
+    def enter(self, phase: Phase) -> None:
+        self._flush()
+        self._stack.append(phase)
+        if self.profiler is not None:
+            self.profiler.switch(self._stack)
+
+    def exit(self) -> None:
+        self._flush()
+        self._stack.pop()
+        if self.profiler is not None:
+            self.profiler.switch(self._stack)
+
+    def finish(self) -> None:
+        self._flush()
+        self._end = self._mark
+
+    def as_dict(self) -> dict:
+        totals = self.totals
+        return dict(
+            duration=self.duration,
+            **{f"{phase}_time": self.phases[phase] for phase in Phase},
+            api_calls=self.api_calls,
+            api_bytes=self.api_bytes,
+            images_downloaded=self.images_downloaded,
+            image_bytes=self.image_bytes,
+            added=totals.added,
+            updated=totals.updated,
+            deleted=totals.deleted,
+        )
+
+
+_RUN: ContextVar[RunMetrics | None] = ContextVar("sync_run", default=None)
+
+
+def current_run() -> RunMetrics | None:
+    return _RUN.get()
+
+
+@contextmanager
+def record_run(
+    command: str,
+    force: bool = False,
+    profiler: "PhaseProfiler | None" = None,
+) -> Iterator[RunMetrics]:
+    run = RunMetrics(command, force=force, profiler=profiler)
+    sync_run = SyncRun.create(
+        command=command, force=force, time_created=run.started
+    )
+    run.id = sync_run.id
+    token = _RUN.set(run)
+    status, error = SyncRunStatus.SUCCESS, None
+    if profiler is not None:
+        profiler.start()
+    try:
+        yield run
+    except BaseException as e:
+        # Interrupted and cancelled runs did not finish either
+        status, error = SyncRunStatus.FAILED, repr(e)
+        raise
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        _RUN.reset(token)
+        run.finish()
+        sync_run.update_from_dict(**run.as_dict(), status=status, error=error)
+        sync_run.save()
+
+
+@contextmanager
+def record_task(run_id: int | None) -> Iterator[None]:
+    """Add the work of a worker task to the scheduled run that queued it.
+
+    Tasks of one run finish concurrently on several workers, so their
+    counts are added to the row in SQL rather than written over it.
+    """
+    if run_id is None:
+        yield
+        return
+    run = RunMetrics("task")
+    run.id = run_id
+    token = _RUN.set(run)
+    try:
+        yield
+    finally:
+        _RUN.reset(token)
+        run.finish()
+        totals = {
+            getattr(SyncRun, name): getattr(SyncRun, name) + value
+            for name, value in run.as_dict().items()
+            if name != "duration" and value
+        }
+        if totals:
+            SyncRun.update(totals).where(SyncRun.id == run_id).execute()
+
+
+def finish_run(run_id: int) -> None:
+    """Extend a scheduled run's duration to when its last task finished."""
+    sync_run = SyncRun.get_or_none(SyncRun.id == run_id)
+    if sync_run is not None:
+        duration = (datetime.now() - sync_run.time_created).total_seconds()
+        SyncRun.update(duration=duration).where(SyncRun.id == run_id).execute()
+
+
+@contextmanager
+def phase(name: Phase) -> Iterator[None]:
+    run = _RUN.get()
+    if run is None:
+        yield
+        return
+    run.enter(name)
+    try:
+        yield
+    finally:
+        run.exit()
+
+
+def record_api_call(num_bytes: int) -> None:
+    if run := _RUN.get():
+        run.api_calls += 1
+        run.api_bytes += num_bytes
+
+
+def record_api_rate(rate: float) -> None:
+    if run := _RUN.get():
+        run.api_rate = rate
+
+
+def record_api_retry(rate: float) -> None:
+    if run := _RUN.get():
+        run.api_retries += 1
+        run.api_rate = rate
+
+
+def record_image(num_bytes: int) -> None:
+    if run := _RUN.get():
+        run.images_downloaded += 1
+        run.image_bytes += num_bytes
+
+
+def record_stats(record_type: RecordType, stats: Stats) -> None:
+    if run := _RUN.get():
+        run.stats[record_type] += stats
+
+
+_PHASE_LABELS = {
+    Phase.CATEGORIES: "Categories",
+    Phase.RECIPE_LIST: "Recipe list",
+    Phase.RECIPE_DETAILS: "Recipe details",
+    Phase.PHOTOS: "Photos",
+    Phase.DB_WRITES: "DB writes",
+}
+
+
+def _format_bytes(num_bytes: int) -> str:
+    size = float(num_bytes)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def format_summary(run: RunMetrics) -> str:
+    lines = [
+        f"Sync run {run.id} ({run.command}) finished in {run.duration:.2f}s",
+        "",
+    ]
+    for name, label in _PHASE_LABELS.items():
+        lines.append(f"  {label:<18}{run.phases[name]:>9.2f}s")
+    lines += [
+        "",
+        f"  API calls:        {run.api_calls} ({_format_bytes(run.api_bytes)})",
+    ]
+    if run.api_rate is not None:
+        lines.append(
+            f"  API rate:         {run.api_rate:.2f}/s "
+            f"({run.api_retries} retries)"
+        )
+    lines += [
+        f"  Images:           {run.images_downloaded} "
+        f"({_format_bytes(run.image_bytes)})",
+    ]
+    for record_type in RecordType:
+        stats = run.stats[record_type]
+        label = f"{record_type.capitalize()} rows:"
+        lines.append(
+            f"  {label:<18}{stats.added} added, {stats.updated} updated, "
+            f"{stats.deleted} deleted"
+        )
+    return "\n".join(lines)
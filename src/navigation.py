@@ -0,0 +1,148 @@
+import os
+import threading
+import uuid
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import NamedTuple
+
+from src.config import Config
+from src.database import db_proxy
+from src.paprika import (
+    Category,
+    CategoryRecipe,
+    Recipe,
+    RecipeStatus,
+    recipe_status,
+)
+
+_BASE_DIR: Path = Path(__file__).parent
+
+# Touched by sync, which runs in another process, whenever the tree changes
+_STAMP_FILE: Path = _BASE_DIR.parent / "data" / "categories.stamp"
+
+_lock = threading.Lock()
+_cache: tuple[tuple, list["CategoryNode"]] | None = None
+
+
+class CategoryNode(NamedTuple):
+    name: str
+    slug: str | None
+    recipe_count: int
+    children: list["CategoryNode"]
+
+
+def _is_shown(name: str) -> bool:
+    listed = Config.paprika.listed_categories
+    if listed:
+        return name in listed
+    return (
+        name not in Config.paprika.hidden_categories
+        and name not in Config.paprika.secret_categories
+    )
+
+
+def _listed_counts() -> Counter:
+    categories: defaultdict[str, set[str]] = defaultdict(set)
+    names: dict[str, str] = {}
+    for category_uid, recipe_uid, name in (
+        CategoryRecipe.select(
+            CategoryRecipe.category, CategoryRecipe.recipe, Category.name
+        )
+        .join_from(CategoryRecipe, Category)
+        .join_from(CategoryRecipe, Recipe)
+        .where(Recipe.in_trash.is_null() | (Recipe.in_trash == 0))
+        .tuples()
+        .iterator()
+    ):
+        categories[recipe_uid].add(category_uid)
+        names[category_uid] = name
+
+    counts: Counter[str] = Counter()
+    for category_uids in categories.values():
+        status = recipe_status({names[uid] for uid in category_uids})
+        if status == RecipeStatus.LISTED:
+            counts.update(category_uids)
+    return counts
+
+
+def build_category_tree() -> list[CategoryNode]:
+    """Shown categories nested by parent, with their listed recipe counts.
+
+    Children of a category that is not shown move up to its nearest shown
+    ancestor.
+    """
+    categories = {
+        category.uid: category
+        for category in Category.select().order_by(
+            Category.order_flag, Category.name
+        )
+    }
+    counts = _listed_counts()
+
+    children = defaultdict(list)
+    for category in categories.values():
+        parent_uid = category.parent_uid
+        seen = {category.uid}
+        while parent_uid in categories and not _is_shown(
+            categories[parent_uid].name
+        ):
+            if parent_uid in seen:
+                parent_uid = None
+                break
+            seen.add(parent_uid)
+            parent_uid = categories[parent_uid].parent_uid
+        if parent_uid not in categories:
+            parent_uid = None
+        children[parent_uid].append(category)
+
+    def nodes(parent_uid: str | None, ancestors: frozenset) -> list:
+        return [
+            CategoryNode(
+                name=category.name,
+                slug=category.slug,
+                recipe_count=counts[category.uid],
+                children=nodes(category.uid, ancestors | {category.uid}),
+            )
+            for category in children[parent_uid]
+            if _is_shown(category.name) and category.uid not in ancestors
+        ]
+
+    return nodes(None, frozenset())
+
+
+def _stamp() -> tuple[int, int] | None:
+    try:
+        stat = _STAMP_FILE.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def tree_version() -> tuple[int, int] | None:
+    """Changes whenever sync changes the category tree or its counts."""
+    return _stamp()
+
+
+def category_tree() -> list[CategoryNode]:
+    """The cached category tree, rebuilt only after sync changes it."""
+    global _cache
+    key = (id(db_proxy.obj), _stamp())
+    cached = _cache
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with _lock:
+        if _cache is not None and _cache[0] == key:
+            return _cache[1]
+        tree = build_category_tree()
+        _cache = (key, tree)
+        return tree
+
+
+def invalidate_category_tree() -> None:
+    global _cache
+    _cache = None
+    # A new file each time, so the inode changes even if the mtime does not
+    _STAMP_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _STAMP_FILE.with_name(f".{_STAMP_FILE.name}.{uuid.uuid4().hex}")
+    tmp.touch()
+    os.replace(tmp, _STAMP_FILE)
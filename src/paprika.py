@@ -1,19 +1,22 @@
+import gzip
 import hashlib
+import io
 import json
 import logging
 import shutil
-import time
+import threading
 from base64 import b64encode
-from datetime import datetime
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
 from enum import StrEnum
-from functools import cached_property
-from http.client import HTTPSConnection
+from functools import cache, cached_property
+from http.client import HTTPResponse, HTTPSConnection, ImproperConnectionState
 from pathlib import Path
-from typing import Self
+from typing import NamedTuple, Self
 from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
 
-import requests
 from peewee import (
     BooleanField,
     CharField,
@@ -22,15 +25,22 @@ from peewee import (
     ForeignKeyField,
     IntegerField,
     TextField,
+    fn,
 )
 from slugify import slugify
 
 from src.config import Config, Environment, PaprikaClientType
 from src.database import BaseModel
-from src.util import cache_client
+from src.metrics import (
+    record_api_call,
+    record_api_rate,
+    record_api_retry,
+    record_image,
+)
+from src.responses import CACHE_DIR, ResponseCache, recording
+from src.util import RateLimiter, iter_json_array
 
 _BASE_DIR = Path(__file__).parent
-_IMAGE_DIR = _BASE_DIR / "static" / "images"
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
@@ -50,6 +60,62 @@ class ClientError(Exception):
     pass
 
 
+def unique_slug(
+    model: type["Category"] | type["Recipe"], name: str | None, uid: str
+) -> str:
+    """The slug for name, with the lowest free numeric suffix if taken."""
+    base = slugify(name or "") or slugify(uid)
+    taken = {
+        slug
+        for (slug,) in model.select(model.slug)
+        .where(
+            ((model.slug == base) | model.slug.startswith(f"{base}-"))
+            & (model.uid != uid)
+        )
+        .tuples()
+        .iterator()
+    }
+    slug, n = base, 1
+    while slug in taken:
+        n += 1
+        slug = f"{base}-{n}"
+    return slug
+
+
+def _slug_matches(slug: str | None, name: str | None) -> bool:
+    # Whether slug is still a valid, possibly suffixed, slug for name
+    if not slug:
+        return False
+    base = slugify(name or "")
+    suffix = slug.removeprefix(f"{base}-")
+    return slug == base or (suffix != slug and suffix.isdigit())
+
+
+def _deduplicate_slugs(model: type["Category"] | type["Recipe"]) -> None:
+    duplicates = (
+        model.select(model.slug)
+        .where(model.slug.is_null(False))
+        .group_by(model.slug)
+        .having(fn.COUNT(model.uid) > 1)
+    )
+    rows = list(
+        model.select(model.uid, model.name, model.slug)
+        .where(model.slug.in_(duplicates))
+        .order_by(model.slug, model.uid)
+        .tuples()
+        .iterator()
+    )
+    seen = set()
+    for uid, name, slug in rows:
+        if slug not in seen:
+            # The first row keeps its slug
+            seen.add(slug)
+            continue
+        model.update(slug=unique_slug(model, name, uid)).where(
+            model.uid == uid
+        ).execute()
+
+
 class Category(BaseModel):
     uid = CharField(primary_key=True)
     order_flag = IntegerField()
@@ -57,17 +123,33 @@ class Category(BaseModel):
     parent_uid = CharField(null=True)
 
     # Admin
-    slug = CharField(null=True)
+    slug = CharField(null=True, unique=True)
     icon = CharField(null=True)
 
     def save(self, *args, **kwargs):
-        self.slug = slugify(self.name)
+        if not _slug_matches(self.slug, self.name):
+            self.slug = unique_slug(Category, self.name, self.uid)
         super().save(*args, **kwargs)
 
+    @classmethod
+    def migrate(cls) -> None:
+        _deduplicate_slugs(cls)
+
     @property
     def hash(self) -> str:
-        data = f"{self.uid}{self.order_flag}{self.name}{self.parent_uid}"
-        return hashlib.md5(data.encode()).hexdigest()
+        return _category_hash(
+            self.uid, self.order_flag, self.name, self.parent_uid
+        )
+
+
+def _category_hash(uid, order_flag, name, parent_uid) -> str:
+    data = f"{uid}{order_flag}{name}{parent_uid}"
+    return hashlib.md5(data.encode()).hexdigest()
+
+
+@cache
+def _timezone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
 
 
 class Recipe(BaseModel):
@@ -100,7 +182,7 @@ class Recipe(BaseModel):
     photo_url = CharField(null=True)
 
     # Custom
-    slug = CharField(null=True)
+    slug = CharField(null=True, unique=True)
 
     markdown_fields = [
         "ingredients",
@@ -114,18 +196,36 @@ class Recipe(BaseModel):
         return field in self.markdown_fields
 
     def save(self, *args, **kwargs):
-        self.slug = slugify(self.name)
+        previous = self.slug
+        if not _slug_matches(previous, self.name):
+            self.slug = unique_slug(Recipe, self.name, self.uid)
         super().save(*args, **kwargs)
+        if previous != self.slug:
+            RecipeRedirect.delete().where(
+                RecipeRedirect.slug == self.slug
+            ).execute()
+            if previous:
+                RecipeRedirect.insert(
+                    slug=previous, recipe=self.uid
+                ).on_conflict_replace().execute()
+
+    @classmethod
+    def migrate(cls) -> None:
+        _deduplicate_slugs(cls)
+
+    @classmethod
+    def get_by_slug(cls, slug: str) -> Self | None:
+        return cls.get_or_none(cls.slug == slug)
 
     @classmethod
     def from_api(cls, data: dict) -> Self:
         created_str = data.get("created")
         if created_str:
             date_format = "%Y-%m-%d %H:%M:%S"
-            naive_date = datetime.strptime(created_str, date_format)
-            tz = ZoneInfo(Config.paprika.timezone)
+            naive_date = datetime.fromisoformat(created_str)
+            tz = _timezone(Config.paprika.timezone)
             local_date = naive_date.replace(tzinfo=tz)
-            utc_date = local_date.astimezone(ZoneInfo("UTC"))
+            utc_date = local_date.astimezone(UTC)
             utc_date_str = utc_date.strftime(date_format)
             data["created"] = utc_date_str
         return cls(**data)
@@ -139,7 +239,7 @@ class Recipe(BaseModel):
         if not self.source_url:
             return None
         parsed_url = urlparse(self.source_url)
-        return parsed_url.netloc.lstrip("www.")
+        return parsed_url.netloc.removeprefix("www.")
 
     @property
     def categories_list(self) -> set[Category]:
@@ -150,14 +250,29 @@ class Recipe(BaseModel):
 
     @property
     def status(self) -> RecipeStatus:
-        categories = {category.name for category in self.categories_list}
-        if not Config.paprika.show_uncategorized and not categories:
-            return RecipeStatus.HIDDEN
-        if categories & set(Config.paprika.hidden_categories):
-            return RecipeStatus.HIDDEN
-        if categories & set(Config.paprika.secret_categories):
-            return RecipeStatus.SECRET
-        return RecipeStatus.LISTED
+        return recipe_status(
+            {category.name for category in self.categories_list}
+        )
+
+
+def recipe_status(categories: set[str]) -> RecipeStatus:
+    if not Config.paprika.show_uncategorized and not categories:
+        return RecipeStatus.HIDDEN
+    if categories & set(Config.paprika.hidden_categories):
+        return RecipeStatus.HIDDEN
+    if categories & set(Config.paprika.secret_categories):
+        return RecipeStatus.SECRET
+    return RecipeStatus.LISTED
+
+
+class RecipeRedirect(BaseModel):
+    """Old slugs of renamed recipes."""
+
+    slug = CharField(primary_key=True)
+    recipe = ForeignKeyField(Recipe, backref="redirects", on_delete="CASCADE")
+
+    class Meta:
+        table_name = "recipe_redirects"
 
 
 class Photo(BaseModel):
@@ -181,16 +296,60 @@ class CategoryRecipe(BaseModel):
         primary_key = CompositeKey("category", "recipe")
 
 
-class PaprikaClient:
-    _client: Self | None = None
+# List endpoints return a record per item on the account, and the diff only
+# reads a few fields from each, so they become tuples rather than models
+
+
+def _from_item(cls, item: dict):
+    return cls(*(item.get(field) for field in cls._fields))
+
+
+class RecipeItem(NamedTuple):
+    uid: str
+    hash: str
+
+
+class PhotoItem(NamedTuple):
+    uid: str
+    filename: str | None
+    recipe_uid: str | None
+    order_flag: int | None
+    name: str | None
+    hash: str | None
+
+
+class CategoryItem(NamedTuple):
+    uid: str
+    order_flag: int
+    name: str
+    parent_uid: str | None
+
+    @property
+    def hash(self) -> str:
+        return _category_hash(*self)
+
+
+class _CountingReader:
+    def __init__(self, file, tee=None):
+        self._file = file
+        self._tee = tee
+        self.count = 0
 
-    _recipes: list[Recipe] | None = None
-    _photos: list[Photo] | None = None
-    _use_cache: bool = True
-    _cache_lock_key: str = "paprika_cache_lock"
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        self.count += len(data)
+        if self._tee is not None:
+            self._tee.write(data)
+        return data
 
-    def __init__(self, use_cache: bool = True):
-        self._use_cache = use_cache
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # GzipFile only seeks its file to rewind, which a response cannot do
+        raise io.UnsupportedOperation("seek")
+
+
+class PaprikaClient:
+    # Connections are not shared, so each sync worker thread gets a client
+    _local = threading.local()
 
     def __enter__(self) -> Self:
         return self
@@ -201,44 +360,61 @@ class PaprikaClient:
     def _request(self, method, endpoint) -> dict:
         raise NotImplementedError
 
+    def _stream(self, method, endpoint) -> Iterator[dict]:
+        """Yield the records of a list endpoint as the response arrives.
+
+        The response must be read to the end before the next request.
+        """
+        raise NotImplementedError
+
+    def _response_cache(self) -> ResponseCache | None:
+        return None
+
+    def _get_record(self, endpoint: str, record_hash: str | None) -> dict:
+        # Served from the cache when the list reported the same hash
+        cache = self._response_cache()
+        if cache is not None and record_hash:
+            result = cache.get(endpoint, record_hash)
+            if result is not None:
+                logger.debug(f"Cached response: {endpoint}")
+                return result
+        result = self._request("GET", endpoint)
+        if cache is not None and result.get("hash"):
+            cache.put(endpoint, result["hash"], result)
+        return result
+
     @classmethod
-    def get(cls) -> Self:
-        if not cls._client:
-            cls._client = (
+    def get(cls) -> "PaprikaClient":
+        client = getattr(cls._local, "client", None)
+        if client is None:
+            client = cls._local.client = (
                 PaprikaMockClient()
                 if Config.paprika.client == PaprikaClientType.MOCK
                 else PaprikaAPIClient()
             )
-        return cls._client
+        return client
 
-    def get_recipes(self) -> list[Recipe]:
-        if not self._use_cache or self._recipes is None:
-            recipes = self._request("GET", "/api/v1/sync/recipes")
-            self.recipes = [Recipe.from_api(recipe) for recipe in recipes]
-        return self.recipes
+    def get_recipes(self) -> Iterator[RecipeItem]:
+        for item in self._stream("GET", "/api/v1/sync/recipes"):
+            yield _from_item(RecipeItem, item)
 
-    def get_recipe(self, uid: str) -> Recipe:
-        recipe = self._request("GET", f"/api/v1/sync/recipe/{uid}")
+    def get_recipe(self, uid: str, record_hash: str | None = None) -> Recipe:
+        recipe = self._get_record(f"/api/v1/sync/recipe/{uid}", record_hash)
         return Recipe.from_api(recipe)
 
-    def get_photos(self) -> list[Photo]:
-        if not self._use_cache or self._photos is None:
-            photos = self._request("GET", "/api/v1/sync/photos")
-            self.photos = [Photo(**photo) for photo in photos]
-        return self.photos
+    def get_photos(self) -> Iterator[PhotoItem]:
+        for item in self._stream("GET", "/api/v1/sync/photos"):
+            yield _from_item(PhotoItem, item)
 
-    def get_photo(self, uid: str) -> Photo:
-        photo = self._request("GET", f"/api/v1/sync/photo/{uid}")
+    def get_photo(self, uid: str, record_hash: str | None = None) -> Photo:
+        photo = self._get_record(f"/api/v1/sync/photo/{uid}", record_hash)
         return Photo(**photo)
 
-    def get_categories(self) -> list[Category]:
-        categories = self._request("GET", "/api/v1/sync/categories")
-        return [Category(**category) for category in categories]
-
-    def delete_photo(self, path: str) -> None:
-        raise NotImplementedError
+    def get_categories(self) -> Iterator[CategoryItem]:
+        for item in self._stream("GET", "/api/v1/sync/categories"):
+            yield _from_item(CategoryItem, item)
 
-    def save_photo(self, path: str) -> None:
+    def download_photo(self, url: str, dest: Path) -> None:
         raise NotImplementedError
 
 
@@ -252,39 +428,64 @@ class PaprikaMockClient(PaprikaClient):
             raise RuntimeError(
                 "The mocked client should not be used in production"
             )
+        if Config.paprika.mock_dir:
+            # Replays a session saved with paprika.record_dir
+            self._response_folder = Path(Config.paprika.mock_dir)
 
-    def _request(self, method, endpoint) -> dict:
+    def _response_file(self, endpoint) -> Path:
         response_file = self._response_folder / f"{endpoint.strip('/')}"
 
         if not response_file.exists():
             raise DoesNotExistError(
                 f"Mock response file not found: {response_file}"
             )
+        return response_file
 
-        with open(response_file, "r") as file:
-            return json.load(file)["result"]
-
-    def delete_photo(self, path: str) -> None:
-        dest = _IMAGE_DIR / Path(path).name
-        if dest.exists():
-            dest.unlink()
-            logger.debug(f"Deleted photo: {dest}")
-        else:
-            logger.debug(f"Photo does not exist: {dest}")
-
-    def save_photo(self, path: str) -> None:
-        dest = _IMAGE_DIR / Path(path).name
-        if not dest.exists():
-            shutil.copyfile(path, dest)
-            logger.debug(f"Saved photo to: {dest}")
-        else:
-            logger.debug(f"Photo already exists: {dest}")
+    def _request(self, method, endpoint) -> dict:
+        response = self._response_file(endpoint).read_bytes()
+        record_api_call(len(response))
+        return json.loads(response)["result"]
+
+    def _stream(self, method, endpoint) -> Iterator[dict]:
+        with open(self._response_file(endpoint), "rb") as file:
+            reader = _CountingReader(file)
+            try:
+                found = yield from iter_json_array(reader, "result")
+            finally:
+                record_api_call(reader.count)
+        if not found:
+            raise ClientError(f"No result in mock response: {endpoint}")
+
+    def download_photo(self, url: str, dest: Path) -> None:
+        shutil.copyfile(url, dest)
+        record_image(dest.stat().st_size)
+        logger.debug(f"Downloaded photo: {url}")
+
+
+def _retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header, in seconds or a date."""
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        # A -0000 offset is parsed as a naive date, but it is still UTC
+        date = date.replace(tzinfo=UTC)
+    return max(0.0, (date - datetime.now(UTC)).total_seconds())
 
 
 class PaprikaAPIClient(PaprikaClient):
     _conn: HTTPSConnection | None = None
     _base_url: str = "www.paprikaapp.com"
-    _request_lock_key: str = "paprika_request_lock"
+    _timeout: int = 60  # seconds
+    # Shared by every worker thread in the process
+    _rate_limiter: RateLimiter | None = None
+    _cache: ResponseCache | None = None
+    _shared_lock = threading.Lock()
 
     @cached_property
     def _headers(self):
@@ -293,61 +494,179 @@ class PaprikaAPIClient(PaprikaClient):
         user_and_pass = b64encode(bytes(f"{email}:{password}", "utf-8")).decode(
             "ascii"
         )
-        return {"Authorization": f"Basic {user_and_pass}"}
+        return {
+            "Authorization": f"Basic {user_and_pass}",
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+        }
 
-    def __enter__(self):
-        self.connection = HTTPSConnection(self._base_url)
-        return self
+    @property
+    def connection(self) -> HTTPSConnection:
+        # Kept open across with blocks; opened again on first use if closed
+        if self._conn is None:
+            self._conn = HTTPSConnection(self._base_url, timeout=self._timeout)
+        return self._conn
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        if self.connection:
-            self.connection.close()
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
-    def _request(self, method, endpoint) -> dict:
-        lock = cache_client()
-        while lock.get(key=self._request_lock_key):
-            time.sleep(Config.paprika.api_delay / 2)
+    @classmethod
+    def rate_limiter(cls) -> RateLimiter:
+        with cls._shared_lock:
+            if cls._rate_limiter is None:
+                cls._rate_limiter = RateLimiter(
+                    interval=Config.paprika.api_delay,
+                    min_interval=Config.paprika.min_api_delay,
+                )
+            return cls._rate_limiter
+
+    def _response_cache(self) -> ResponseCache | None:
+        size = Config.paprika.response_cache_mb
+        if not size:
+            return None
+        with self._shared_lock:
+            if PaprikaAPIClient._cache is None:
+                PaprikaAPIClient._cache = ResponseCache(
+                    CACHE_DIR, size * 1024 * 1024
+                )
+            return PaprikaAPIClient._cache
 
-        self.connection.request(method, endpoint, headers=self._headers)
-        response = self.connection.getresponse().read()
-        result = json.loads(response)
+    @property
+    def _record_dir(self) -> Path | None:
+        return (
+            Path(Config.paprika.record_dir)
+            if Config.paprika.record_dir
+            else None
+        )
 
-        if (
-            "error" in result
-            and "not found" in result["error"]["message"].lower()
-        ):
-            raise DoesNotExistError("Record not found")
-        elif "result" in result:
-            result = result["result"]
-        else:
-            raise ClientError("Error retrieving data from Paprika")
+    def _record(self, record_dir: Path, endpoint: str, result) -> None:
+        # Photos are saved alongside so the session replays offline
+        photo_url = isinstance(result, dict) and result.get("photo_url")
+        if photo_url:
+            path = record_dir / "photos" / Path(urlparse(photo_url).path).name
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._fetch(photo_url, path)
+            result = result | {"photo_url": str(path)}
+        with recording(record_dir, endpoint) as file:
+            file.write(json.dumps({"result": result}, indent=4).encode())
+
+    def _open(self, method, endpoint) -> HTTPResponse:
+        try:
+            self.connection.request(method, endpoint, headers=self._headers)
+            return self.connection.getresponse()
+        except (ConnectionError, ImproperConnectionState):
+            # The server closed the idle connection
+            logger.debug("Reconnecting to Paprika")
+            self.close()
+            self.connection.request(method, endpoint, headers=self._headers)
+            return self.connection.getresponse()
+
+    def _send(self, method, endpoint) -> HTTPResponse:
+        limiter = self.rate_limiter()
+        retries = Config.paprika.max_retries if method == "GET" else 0
+        for attempt in range(retries + 1):
+            limiter.wait()
+            try:
+                response = self._open(method, endpoint)
+            except OSError as e:
+                self.close()
+                if attempt == retries:
+                    raise
+                error = str(e)
+                retry_after = None
+            else:
+                if response.status != 429 and response.status < 500:
+                    limiter.speed_up()
+                    record_api_rate(limiter.rate)
+                    return response
+                error = f"HTTP {response.status}"
+                response.read()
+                if attempt == retries:
+                    raise ClientError(f"Paprika {endpoint}: {error}")
+                retry_after = _retry_after(response.getheader("Retry-After"))
+            delay = limiter.back_off(attempt, retry_after)
+            record_api_retry(limiter.rate)
+            logger.warning(
+                f"Paprika {endpoint}: {error}, retrying in {delay:.1f}s at "
+                f"{limiter.rate:.2f} requests/s"
+            )
+        raise AssertionError("The last attempt returns or raises")
 
-        lock.setex(
-            key=self._request_lock_key, ttl=Config.paprika.api_delay, value=True
-        )
+    @staticmethod
+    def _body(
+        response: HTTPResponse, reader: "_CountingReader"
+    ) -> gzip.GzipFile | _CountingReader:
+        if response.getheader("Content-Encoding") == "gzip":
+            return gzip.GzipFile(fileobj=reader, mode="rb")
+        return reader
 
+    def _request(self, method, endpoint) -> dict:
+        response = self._send(method, endpoint)
+        reader = _CountingReader(response)
+        body = self._body(response, reader).read()
+        record_api_call(reader.count)
+        result = self._result(json.loads(body))
+        record_dir = self._record_dir
+        if record_dir is not None:
+            self._record(record_dir, endpoint, result)
         return result
 
-    def delete_photo(self, path: str) -> None:
-        parsed_url = urlparse(path)
-        if not parsed_url.path:
+    def _stream(self, method, endpoint) -> Iterator[dict]:
+        if self._record_dir is None:
+            yield from self._stream_to(method, endpoint, None)
             return
-        dest = _IMAGE_DIR / Path(parsed_url.path).name
-        if dest.exists():
-            dest.unlink()
-            logger.debug(f"Deleted photo: {dest}")
-        else:
-            logger.debug(f"Photo does not exist: {dest}")
-
-    def save_photo(self, path: str) -> None:
-        parsed_url = urlparse(path)
-        dest = _IMAGE_DIR / Path(parsed_url.path).name
-        if not dest.exists():
-            with requests.get(path, stream=True) as response:
-                response.raise_for_status()
-                response.raw.decode_content = True
-                with open(dest, "wb") as file:
-                    shutil.copyfileobj(response.raw, file)
-                logger.debug(f"Saved photo to: {dest}")
+        with recording(self._record_dir, endpoint) as file:
+            yield from self._stream_to(method, endpoint, file)
+
+    def _stream_to(self, method, endpoint, tee) -> Iterator[dict]:
+        response = self._send(method, endpoint)
+        reader = _CountingReader(response)
+        body = _CountingReader(self._body(response, reader), tee=tee)
+        rest: dict = {}
+        try:
+            found = yield from iter_json_array(body, "result", rest)
+            # Any trailing bytes, so the connection can be reused
+            body.read()
+        finally:
+            record_api_call(reader.count)
+            if not response.isclosed():
+                # Left unread, so the connection cannot be reused
+                self.close()
+        if not found:
+            self._result(rest)
+
+    def _result(self, response: dict):
+        if (
+            "error" in response
+            and "not found" in response["error"]["message"].lower()
+        ):
+            raise DoesNotExistError("Record not found")
+        elif "result" in response:
+            return response["result"]
         else:
-            logger.debug(f"Photo already exists: {dest}")
+            message = response.get("error", {}).get("message", response)
+            raise ClientError(f"Error retrieving data from Paprika: {message}")
+
+    @cached_property
+    def _session(self):
+        import requests
+
+        # Pools keep-alive connections to the photo host
+        return requests.Session()
+
+    def _fetch(self, url: str, dest: Path) -> None:
+        with self._session.get(
+            url, stream=True, timeout=self._timeout
+        ) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(dest, "wb") as file:
+                shutil.copyfileobj(response.raw, file)
+
+    def download_photo(self, url: str, dest: Path) -> None:
+        self._fetch(url, dest)
+        record_image(dest.stat().st_size)
+        logger.debug(f"Downloaded photo: {url}")
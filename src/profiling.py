@@ -0,0 +1,197 @@
+import cProfile
+import hmac
+import logging
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Sequence
+from pathlib import Path
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+_ROOT = "sync"
+_TOP_ALLOCATIONS = 25
+_TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+# cProfile and tracemalloc are process-wide, so one request is profiled at a
+# time
+_REQUEST_LOCK = threading.Lock()
+
+
+def _write_allocations(
+    path: Path, title: str, allocations: list[tuple[str, int, int]]
+) -> None:
+    allocations = sorted(allocations, key=lambda item: item[1], reverse=True)
+    lines = [title, ""]
+    for location, size, count in allocations[:_TOP_ALLOCATIONS]:
+        lines.append(f"{size / 1024:>12.1f} KiB {count:>9} blocks  {location}")
+    path.write_text("\n".join(lines) + "\n")
+
+
+class PhaseProfiler:
+    """Profile a sync run with one cProfile and allocation report per phase.
+
+    CPU time is attributed to the innermost active phase, like the phase
+    timings of the run. Allocations are measured between snapshots taken
+    around each outermost phase, so they include nested phases.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._profiles: dict[str, cProfile.Profile] = {}
+        self._active: cProfile.Profile | None = None
+        self._allocations: dict[str, dict[str, list[int]]] = defaultdict(
+            lambda: defaultdict(lambda: [0, 0])
+        )
+        self._peaks: dict[str, int] = defaultdict(int)
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._top: str | None = None
+
+    def start(self) -> None:
+        tracemalloc.start()
+        self.switch([])
+
+    def switch(self, stack: Sequence[str]) -> None:
+        name = stack[-1] if stack else _ROOT
+        if self._active is not None:
+            self._active.disable()
+        self._active = self._profiles.setdefault(name, cProfile.Profile())
+
+        if stack and self._top is None:
+            self._top = stack[0]
+            tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot()
+        elif not stack and self._top is not None:
+            self._record_allocations(self._top)
+            self._top = None
+
+        self._active.enable()
+
+    def _record_allocations(self, name: str) -> None:
+        _, peak = tracemalloc.get_traced_memory()
+        self._peaks[name] = max(self._peaks[name], peak)
+        if self._snapshot is None:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            _TRACEMALLOC_FILTERS
+        )
+        previous = self._snapshot.filter_traces(_TRACEMALLOC_FILTERS)
+        for diff in snapshot.compare_to(previous, "lineno"):
+            allocation = self._allocations[name][str(diff.traceback)]
+            allocation[0] += diff.size_diff
+            allocation[1] += diff.count_diff
+
+    def stop(self) -> Path:
+        if self._active is not None:
+            self._active.disable()
+            self._active = None
+        if self._top is not None:
+            self._record_allocations(self._top)
+            self._top = None
+        tracemalloc.stop()
+
+        directory = self.directory / time.strftime("sync-%Y%m%d-%H%M%S")
+        directory.mkdir(parents=True, exist_ok=True)
+        for name, profile in self._profiles.items():
+            profile.dump_stats(directory / f"{name}.prof")
+        for name, allocations in self._allocations.items():
+            _write_allocations(
+                directory / f"{name}.tracemalloc.txt",
+                f"Top allocations during {name} "
+                f"(peak {self._peaks[name] / 1024:.1f} KiB)",
+                [
+                    (location, size, count)
+                    for location, (size, count) in allocations.items()
+                ],
+            )
+        logger.info(f"Saved sync profile to: {directory}")
+        return directory
+
+
+class ProfilingMiddleware:
+    """Profile single requests that present the configured secret.
+
+    Only add this middleware when a secret is configured, so unprofiled
+    deployments pay nothing for it. A request that arrives while another is
+    being profiled is served without a profile.
+    """
+
+    header = "X-Profile"
+
+    def __init__(self, app: ASGIApp, secret: str, directory: Path):
+        self.app = app
+        self.secret = secret.encode()
+        self.directory = directory
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._authorized(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _REQUEST_LOCK.acquire(blocking=False):
+            logger.warning(
+                f"Not profiling {scope['path']}: another request is profiled"
+            )
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._profile(scope, receive, send)
+        finally:
+            _REQUEST_LOCK.release()
+
+    async def _profile(self, scope: Scope, receive: Receive, send: Send):
+        name = time.strftime("request-%Y%m%d-%H%M%S") + f"-{time.time_ns()}"
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        async def send_with_profile(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(
+                    "X-Profile-File", f"{name}.prof"
+                )
+            await send(message)
+
+        profile = cProfile.Profile()
+        tracemalloc.start()
+        snapshot = tracemalloc.take_snapshot()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            profile.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            diffs = (
+                tracemalloc.take_snapshot()
+                .filter_traces(_TRACEMALLOC_FILTERS)
+                .compare_to(
+                    snapshot.filter_traces(_TRACEMALLOC_FILTERS), "lineno"
+                )
+            )
+            tracemalloc.stop()
+            profile.dump_stats(self.directory / f"{name}.prof")
+            _write_allocations(
+                self.directory / f"{name}.tracemalloc.txt",
+                f"Top allocations during {scope['method']} {scope['path']} "
+                f"(peak {peak / 1024:.1f} KiB)",
+                [
+                    (str(diff.traceback), diff.size_diff, diff.count_diff)
+                    for diff in diffs
+                ],
+            )
+            logger.info(
+                f"Saved profile of {scope['path']} to: "
+                f"{self.directory / name}.prof"
+            )
+
+    def _authorized(self, scope: Scope) -> bool:
+        value = Headers(scope=scope).get(self.header)
+        return value is not None and hmac.compare_digest(
+            value.encode(), self.secret
+        )
@@ -1,57 +1,146 @@
 import re
+import threading
+from collections import defaultdict
+from collections.abc import Iterable
+from fractions import Fraction
 
-from markdown import markdown as _markdown
+from markdown import Markdown
 
-from src.paprika import Photo
+from src.ingredients import QUANTITY_PATTERN, Ingredient
+from src.paprika import Photo, Recipe
 
-_TEMPLATE = "[photo:{name}]"
+_PHOTO_PATTERN = re.compile(r"\[photo:(\d+)\]")
 
 
-def markdown(recipe_uid: int, content: str) -> str:
-    pattern = r"\[photo:(\d+)\]"
-    photo_names = re.findall(pattern, content)
+def photo_map(recipe_uids: Iterable[str]) -> dict[str, dict[str, str]]:
+    photos: defaultdict[str, dict[str, str]] = defaultdict(dict)
+    for recipe_uid, name, filename in (
+        Photo.select(Photo.recipe_uid, Photo.name, Photo.filename)
+        .where(Photo.recipe_uid.in_(list(recipe_uids)))
+        .tuples()
+        .iterator()
+    ):
+        photos[recipe_uid][name] = filename
+    return photos
 
-    if photo_names:
-        photos = Photo.select().where(Photo.recipe_uid == recipe_uid)
-        photo_html = {
-            photo.name: f'<img src="/static/images/{photo.filename}">'
-            for photo in photos
-        }
-        for name in photo_names:
-            search = _TEMPLATE.format(name=name)
-            content = content.replace(search, photo_html.get(name, search))
-
-    return _markdown(content, extensions=["nl2br"])
-
-
-def ingredients(recipe_uid: int, content: str) -> str:
-    integer = r"\d+"
-    decimal = r"\d+\.\d+"
-    ascii_fraction = r"\d+/\d+"
-    mixed_fraction = r"\d+\s+\d+/\d+"
-    unicode_fraction = r"[\u00BC-\u00BE\u2150-\u215E]"
-    single_number = (
-        rf"(?:{mixed_fraction}|{ascii_fraction}|{decimal}|{integer}|"
-        rf"{unicode_fraction})"
-    )
-    range_number = rf"(?:\s*[-–]\s*{single_number})?"
-    pattern_str = rf"^\s*({single_number}{range_number})"
-    pattern = re.compile(pattern_str)
-
-    lines = content.splitlines()
-    processed_lines = []
-    for line in lines:
-        if line.startswith("**") and line.endswith("**"):
-            if processed_lines:
-                processed_lines.append("</ul>")
-            processed_line = markdown(recipe_uid, line)
-            processed_lines.append(processed_line)
-            processed_lines.append("<ul>")
-        elif line != "":
+
+class Renderer:
+    """Render recipe fields to HTML.
+
+    The Markdown pipeline is built once and reset between documents, so a
+    renderer must not be shared between threads.
+    """
+
+    def __init__(self):
+        self._markdown = Markdown(extensions=["nl2br"])
+
+    def markdown(self, content: str, photos: dict[str, str]) -> str:
+        if "[photo:" in content:
+
+            def replace(match: re.Match) -> str:
+                filename = photos.get(match.group(1))
+                if filename is None:
+                    return match.group(0)
+                return f'<img src="/static/images/{filename}">'
+
+            content = _PHOTO_PATTERN.sub(replace, content)
+        return self._markdown.reset().convert(content)
+
+    def ingredients(self, content: str, photos: dict[str, str]) -> str:
+        processed_lines: list[str] = []
+        for line in content.splitlines():
+            if line.startswith("**") and line.endswith("**"):
+                if processed_lines:
+                    processed_lines.append("</ul>")
+                processed_lines.append(self.markdown(line, photos))
+                processed_lines.append("<ul>")
+            elif line != "":
+                if not processed_lines:
+                    processed_lines.append("<ul>")
+                line = QUANTITY_PATTERN.sub(r"<span>\g<quantity></span>", line)
+                processed_lines.append(f"<li>{line}</li>")
+        if processed_lines:
+            processed_lines.append("</ul>")
+        return "\n".join(processed_lines)
+
+    def structured_ingredients(
+        self,
+        ingredients: Iterable[Ingredient],
+        photos: dict[str, str],
+        scale: Fraction = Fraction(1),
+    ) -> str:
+        processed_lines: list[str] = []
+        for ingredient in ingredients:
+            if ingredient.heading:
+                if processed_lines:
+                    processed_lines.append("</ul>")
+                processed_lines.append(self.markdown(ingredient.text, photos))
+                processed_lines.append("<ul>")
+                continue
             if not processed_lines:
                 processed_lines.append("<ul>")
-            line = pattern.sub(r"<span>\1</span>", line)
-            processed_lines.append(f"<li>{line}</li>")
-    if processed_lines:
-        processed_lines.append("</ul>")
-    return "\n".join(processed_lines)
+            quantity = ingredient.scaled(scale)
+            if quantity is None:
+                processed_lines.append(f"<li>{ingredient.text}</li>")
+            else:
+                processed_lines.append(
+                    f"<li><span>{quantity}</span>{ingredient.text}</li>"
+                )
+        if processed_lines:
+            processed_lines.append("</ul>")
+        return "\n".join(processed_lines)
+
+    def render_field(
+        self, attribute: str, content: str, photos: dict[str, str]
+    ) -> str:
+        if attribute == "ingredients":
+            return self.ingredients(content, photos)
+        return self.markdown(content, photos)
+
+    def render_recipe(
+        self,
+        recipe: Recipe,
+        photos: dict[str, str],
+        ingredients: list[Ingredient] | None = None,
+        scale: Fraction = Fraction(1),
+    ) -> dict[str, str]:
+        rendered = {}
+        for attribute in Recipe.markdown_fields:
+            if attribute == "ingredients" and ingredients is not None:
+                rendered[attribute] = self.structured_ingredients(
+                    ingredients, photos, scale=scale
+                )
+            else:
+                rendered[attribute] = self.render_field(
+                    attribute, getattr(recipe, attribute), photos
+                )
+        return rendered
+
+    def render_recipes(
+        self, recipes: Iterable[Recipe]
+    ) -> dict[str, dict[str, str]]:
+        recipes = list(recipes)
+        photos = photo_map(recipe.uid for recipe in recipes)
+        return {
+            recipe.uid: self.render_recipe(recipe, photos.get(recipe.uid, {}))
+            for recipe in recipes
+        }
+
+
+_local = threading.local()
+
+
+def renderer() -> Renderer:
+    if not hasattr(_local, "renderer"):
+        _local.renderer = Renderer()
+    return _local.renderer
+
+
+def markdown(recipe_uid: str, content: str) -> str:
+    photos = photo_map([recipe_uid])[recipe_uid] if "[photo:" in content else {}
+    return renderer().markdown(content, photos)
+
+
+def ingredients(recipe_uid: str, content: str) -> str:
+    photos = photo_map([recipe_uid])[recipe_uid] if "[photo:" in content else {}
+    return renderer().ingredients(content, photos)
@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+_BASE_DIR: Path = Path(__file__).parent
+CACHE_DIR: Path = _BASE_DIR.parent / "data" / "responses"
+
+# Eviction goes below the limit so that it does not run on every write
+_EVICT_TO = 0.9
+
+
+class ResponseCache:
+    """Compressed API responses on disk, one per endpoint.
+
+    An entry is only served for the record hash it was saved with, so a
+    record that changed upstream is always fetched again. The least recently
+    read entries are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+    def _path(self, endpoint: str) -> Path:
+        key = hashlib.sha256(endpoint.encode()).hexdigest()
+        return self.directory / key[:2] / f"{key}.json.gz"
+
+    def _files(self) -> list[Path]:
+        return list(self.directory.glob("*/*.json.gz"))
+
+    def get(self, endpoint: str, record_hash: str) -> dict | None:
+        path = self._path(endpoint)
+        try:
+            with gzip.open(path, "rb") as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            logger.warning(f"Dropping unreadable cached response: {path}")
+            path.unlink(missing_ok=True)
+            return None
+        if entry.get("hash") != record_hash:
+            return None
+        # Reads count as use for eviction
+        os.utime(path)
+        return entry["result"]
+
+    def put(self, endpoint: str, record_hash: str, result: dict) -> None:
+        path = self._path(endpoint)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = gzip.compress(
+            json.dumps({"hash": record_hash, "result": result}).encode()
+        )
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        tmp.write_bytes(data)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(file.stat().st_size for file in self._files())
+            try:
+                self._size -= path.stat().st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, path)
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * _EVICT_TO
+        for _, size, path in sorted(entries):
+            if self._size <= target:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
+        logger.debug(f"Evicted cached responses down to {self._size} bytes")
+
+
+@contextmanager
+def recording(directory: Path, endpoint: str) -> Iterator[BinaryIO]:
+    """Write a response where PaprikaMockClient looks for it, replacing any
+    earlier recording only once the response is complete."""
+    path = directory / endpoint.strip("/")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    try:
+        with open(tmp, "wb") as file:
+            yield file
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
@@ -0,0 +1,363 @@
+import logging
+import math
+from collections import defaultdict
+
+from peewee import (
+    JOIN,
+    CharField,
+    CompositeKey,
+    FloatField,
+    ForeignKeyField,
+    IntegerField,
+    fn,
+)
+
+from src.database import BaseModel, db_proxy
+from src.facets import Facet, RecipeFacet
+from src.paprika import (
+    Category,
+    CategoryRecipe,
+    Recipe,
+    RecipeStatus,
+    recipe_status,
+)
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+TOP_K = 6
+
+_BLOCK_SIZE = 512
+_BATCH_SIZE = 500
+
+
+class SimilarRecipe(BaseModel):
+    recipe = ForeignKeyField(
+        Recipe, backref="similar_recipes", on_delete="CASCADE"
+    )
+    # Deleting a neighbour leaves a gap that marks the recipe as stale
+    similar = ForeignKeyField(
+        Recipe, backref="similar_to", null=True, on_delete="SET NULL"
+    )
+    rank = IntegerField()
+    score = FloatField()
+
+    class Meta:
+        table_name = "similar_recipes"
+        primary_key = CompositeKey("recipe", "rank")
+
+
+class SimilarityState(BaseModel):
+    # The recipe hash its neighbours were last computed for
+    recipe = ForeignKeyField(Recipe, primary_key=True, on_delete="CASCADE")
+    hash = CharField()
+
+    class Meta:
+        table_name = "similarity_state"
+
+
+class _Documents:
+    def __init__(self):
+        recipes = (
+            Recipe.select(Recipe.uid, Recipe.hash)
+            .where(Recipe.in_trash.is_null() | (Recipe.in_trash == 0))
+            .tuples()
+        )
+        self.hashes = dict(recipes)
+        self.uids = sorted(self.hashes)
+        self.terms: dict[str, set[str]] = {uid: set() for uid in self.uids}
+
+        for uid, value in (
+            RecipeFacet.select(RecipeFacet.recipe, RecipeFacet.value)
+            .where(RecipeFacet.facet == Facet.INGREDIENT)
+            .tuples()
+        ):
+            if uid in self.terms:
+                self.terms[uid].add(f"ingredient:{value}")
+
+        categories = defaultdict(set)
+        for uid, category_uid, name in (
+            CategoryRecipe.select(
+                CategoryRecipe.recipe, Category.uid, Category.name
+            )
+            .join(Category)
+            .tuples()
+        ):
+            if uid in self.terms:
+                self.terms[uid].add(f"category:{category_uid}")
+                categories[uid].add(name)
+
+        # Only listed recipes are offered as neighbours
+        self.candidates = {
+            uid
+            for uid in self.uids
+            if recipe_status(categories[uid]) == RecipeStatus.LISTED
+        }
+
+    def matrix(self) -> "_Vectors":
+        """L2-normalized TF-IDF rows, one per recipe."""
+        n = len(self.uids)
+        document_frequency: defaultdict[str, int] = defaultdict(int)
+        for terms in self.terms.values():
+            for term in terms:
+                document_frequency[term] += 1
+        idf = {
+            term: math.log((1 + n) / (1 + df)) + 1
+            for term, df in document_frequency.items()
+        }
+
+        # Terms in a single recipe only add to its norm, so they get no
+        # column of their own
+        vocabulary = {
+            term: i
+            for i, term in enumerate(
+                sorted(t for t, df in document_frequency.items() if df > 1)
+            )
+        }
+        rows = []
+        for uid in self.uids:
+            terms = self.terms[uid]
+            norm = math.sqrt(sum(idf[term] ** 2 for term in terms)) or 1.0
+            rows.append(
+                {
+                    column: idf[term] / norm
+                    for term in terms
+                    if (column := vocabulary.get(term)) is not None
+                }
+            )
+        return _Vectors(rows, len(vocabulary))
+
+
+class _Vectors:
+    """Sparse rows, kept by row for a recipe's terms and by column for the
+    recipes of a term.
+
+    Memory is bounded by the number of (recipe, term) pairs, about 16 bytes
+    each, rather than recipes times vocabulary. Scoring a block adds
+    _BLOCK_SIZE rows of float32 scores against every recipe.
+    """
+
+    def __init__(self, rows: list[dict[int, float]], columns: int):
+        import numpy as np
+
+        self.shape = (len(rows), columns)
+        lengths = np.array([len(row) for row in rows], dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(lengths)))
+        self.indices = np.fromiter(
+            (column for row in rows for column in sorted(row)),
+            dtype=np.int32,
+            count=int(self.indptr[-1]),
+        )
+        self.data = np.fromiter(
+            (row[column] for row in rows for column in sorted(row)),
+            dtype=np.float32,
+            count=int(self.indptr[-1]),
+        )
+
+        row_numbers = np.repeat(np.arange(len(rows), dtype=np.int32), lengths)
+        order = np.argsort(self.indices, kind="stable")
+        self.column_indptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(self.indices, minlength=columns)))
+        )
+        self.column_rows = row_numbers[order]
+        self.column_data = self.data[order]
+
+    def scores(self, row: int):
+        """Cosine similarity of a row with every row."""
+        import numpy as np
+
+        start, end = self.indptr[row], self.indptr[row + 1]
+        columns = self.indices[start:end]
+        if not len(columns):
+            return np.zeros(self.shape[0], dtype=np.float32)
+        postings = np.concatenate(
+            [
+                np.arange(self.column_indptr[c], self.column_indptr[c + 1])
+                for c in columns
+            ]
+        )
+        weights = np.repeat(
+            self.data[start:end],
+            self.column_indptr[columns + 1] - self.column_indptr[columns],
+        )
+        return np.bincount(
+            self.column_rows[postings],
+            weights=weights * self.column_data[postings],
+            minlength=self.shape[0],
+        ).astype(np.float32)
+
+
+def _top_k(vectors: _Vectors, rows: list[int], candidate_mask, k: int):
+    import numpy as np
+
+    for start in range(0, len(rows), _BLOCK_SIZE):
+        block = np.array(rows[start : start + _BLOCK_SIZE])
+        scores = np.stack([vectors.scores(row) for row in block])
+        scores[:, ~candidate_mask] = -np.inf
+        scores[np.arange(len(block)), block] = -np.inf
+        count = min(k, scores.shape[1])
+        if count == 0:
+            for row in block:
+                yield row, [], []
+            continue
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        for i, row in enumerate(block):
+            columns = top[i][np.argsort(-scores[i, top[i]], kind="stable")]
+            columns = [c for c in columns if scores[i, c] > 0]
+            yield row, columns, [float(scores[i, c]) for c in columns]
+
+
+def update_similar(force: bool = False, k: int = TOP_K) -> int:
+    import numpy as np
+
+    documents = _Documents()
+    uids = documents.uids
+    index = {uid: i for i, uid in enumerate(uids)}
+
+    state: dict[str, str] = dict(
+        SimilarityState.select(SimilarityState.recipe, SimilarityState.hash)
+        .tuples()
+        .iterator()
+    )
+    removed = set(state) - set(uids)
+    changed = {
+        uid for uid in uids if force or state.get(uid) != documents.hashes[uid]
+    }
+    changed |= set(uids) & {
+        uid
+        for (uid,) in SimilarRecipe.select(SimilarRecipe.recipe)
+        .where(SimilarRecipe.similar.is_null())
+        .tuples()
+        .iterator()
+    }
+    if not changed and not removed:
+        logger.debug("Similar recipes are up to date")
+        return 0
+
+    vectors = documents.matrix()
+    candidate_mask = np.array(
+        [uid in documents.candidates for uid in uids], dtype=bool
+    )
+
+    if force or len(changed) > len(uids) / 2:
+        rows = list(range(len(uids)))
+    else:
+        neighbours = defaultdict(list)
+        for uid, similar, score in (
+            SimilarRecipe.select(
+                SimilarRecipe.recipe, SimilarRecipe.similar, SimilarRecipe.score
+            )
+            .order_by(SimilarRecipe.recipe, SimilarRecipe.rank)
+            .tuples()
+            .iterator()
+        ):
+            neighbours[uid].append((similar, score))
+
+        stale = changed | removed
+        affected = set(changed)
+        for uid in uids:
+            if any(similar in stale for similar, _ in neighbours[uid]):
+                affected.add(uid)
+
+        # Recipes a changed recipe now beats the weakest neighbour of
+        changed_candidates = [
+            index[uid] for uid in changed if candidate_mask[index[uid]]
+        ]
+        if changed_candidates:
+            # Similarity is symmetric, so a changed recipe's row scores it
+            # against every recipe
+            best = np.zeros(len(uids), dtype=np.float32)
+            for row in changed_candidates:
+                np.maximum(best, vectors.scores(row), out=best)
+            for uid in uids:
+                current = neighbours[uid]
+                threshold = current[-1][1] if len(current) >= k else 0.0
+                if best[index[uid]] > threshold:
+                    affected.add(uid)
+        rows = sorted(index[uid] for uid in affected)
+
+    results = []
+    for row, columns, scores in _top_k(vectors, rows, candidate_mask, k):
+        for rank, (column, score) in enumerate(zip(columns, scores)):
+            results.append(
+                {
+                    "recipe": uids[row],
+                    "similar": uids[column],
+                    "rank": rank,
+                    "score": score,
+                }
+            )
+
+    recomputed = [uids[row] for row in rows]
+    with db_proxy.atomic():
+        for i in range(0, len(recomputed), _BATCH_SIZE):
+            batch = recomputed[i : i + _BATCH_SIZE]
+            SimilarRecipe.delete().where(
+                SimilarRecipe.recipe.in_(batch)
+            ).execute()
+        for i in range(0, len(results), _BATCH_SIZE):
+            SimilarRecipe.insert_many(results[i : i + _BATCH_SIZE]).execute()
+
+        removed_uids = sorted(removed)
+        for i in range(0, len(removed_uids), _BATCH_SIZE):
+            batch = removed_uids[i : i + _BATCH_SIZE]
+            SimilarRecipe.delete().where(
+                SimilarRecipe.recipe.in_(batch)
+                | SimilarRecipe.similar.in_(batch)
+            ).execute()
+            SimilarityState.delete().where(
+                SimilarityState.recipe.in_(batch)
+            ).execute()
+
+        states = [
+            {"recipe": uid, "hash": documents.hashes[uid]} for uid in changed
+        ]
+        for i in range(0, len(states), _BATCH_SIZE):
+            SimilarityState.insert_many(
+                states[i : i + _BATCH_SIZE]
+            ).on_conflict_replace().execute()
+
+    logger.info(
+        f"Updated similar recipes for {len(recomputed)} of {len(uids)} recipes"
+    )
+    return len(recomputed)
+
+
+def similar_recipes(recipe_uid: str) -> list[dict]:
+    return list(
+        Recipe.select(Recipe.name, Recipe.slug, Recipe.photo_large)
+        .join(SimilarRecipe, on=(SimilarRecipe.similar == Recipe.uid))
+        .where(SimilarRecipe.recipe == recipe_uid)
+        .order_by(SimilarRecipe.rank)
+        .dicts()
+        .iterator()
+    )
+
+
+def similar_updated(recipe_uids: list[str]):
+    return (
+        SimilarRecipe.select(fn.MAX(SimilarRecipe.time_created))
+        .where(SimilarRecipe.recipe.in_(recipe_uids))
+        .scalar()
+    )
+
+
+def similar_versions(recipe_uid: str) -> list[tuple]:
+    """What a recipe page shows of its neighbours, for its validators.
+
+    A deleted neighbour leaves a row of None, so deleting one changes this
+    even though nothing else about the recipe does.
+    """
+    return list(
+        SimilarRecipe.select(
+            SimilarRecipe.similar,
+            Recipe.hash,
+            Recipe.slug,
+            fn.COALESCE(Recipe.time_updated, Recipe.time_created),
+        )
+        .join(Recipe, JOIN.LEFT_OUTER, on=(SimilarRecipe.similar == Recipe.uid))
+        .where(SimilarRecipe.recipe == recipe_uid)
+        .order_by(SimilarRecipe.rank)
+        .tuples()
+        .iterator()
+    )
@@ -1,24 +1,43 @@
 #!/usr/bin/env python3
 """
 Usage:
-    ./%(script_name)s [--force] [--limit=<n>]
-    ./%(script_name)s categories [--force]
-    ./%(script_name)s recipes [--force] [--limit=<n>]
+    ./%(script_name)s [--force] [--limit=<n>] [--budget=<calls>]
+        [--time-budget=<seconds>] [--profile=<dir>]
+    ./%(script_name)s categories [--force] [--profile=<dir>]
+    ./%(script_name)s recipes [--force] [--limit=<n>] [--profile=<dir>]
     ./%(script_name)s recipe --uid=<uid> [--force] [--limit=<n>]
-    ./%(script_name)s photos [--force]
-    ./%(script_name)s photo --uid=<uid> [--force]
+        [--profile=<dir>]
+    ./%(script_name)s photos [--force] [--profile=<dir>]
+    ./%(script_name)s photo --uid=<uid> [--force] [--profile=<dir>]
+    ./%(script_name)s plan [--force] [--json]
+    ./%(script_name)s reindex
+    ./%(script_name)s audit [--repair] [--workers=<n>]
 
 Options:
     -h --help           Show this screen.
     --force             Force sync even if the hash is the same.
     --limit=<n>         Limit the number of records to add or update per record
                             type.
+    --budget=<calls>    Stop once this many API calls are made, leaving the
+                            rest for the next run [default: config].
+    --time-budget=<seconds>
+                        Stop starting new records after this many seconds
+                            [default: config].
     --uid=<uid>         The uid of the recipe or photo to sync.
+    --profile=<dir>     Save cProfile stats and tracemalloc top allocations
+                            per sync phase to a new directory in <dir>.
+    --json              Print the plan as JSON.
+    --repair            Re-download missing, truncated or corrupt images and
+                            adopt images from before the object store.
+    --workers=<n>       Number of threads hashing images [default: all cores].
 
 Examples:
     # Sync everything
     ./%(script_name)s
 
+    # Sync the most visible changes first, in at most 500 API calls
+    ./%(script_name)s --budget=500
+
     # Sync categories
     ./%(script_name)s categories
 
@@ -39,27 +58,68 @@ Examples:
 
     # Sync a photo
     ./%(script_name)s photo --uid=3
+
+    # Estimate what a forced sync would cost, without fetching details or
+    # writing anything
+    ./%(script_name)s plan --force --json
+
+    # Rebuild parsed ingredients and filter indexes without calling the API
+    ./%(script_name)s reindex
+
+    # Check that every image on disk matches the database, fixing broken ones
+    ./%(script_name)s audit --repair
+
+    # Profile a sync
+    ./%(script_name)s --profile=data/profiles
 """
 
+import json
 import logging
 import sys
+import time
+from collections import Counter, defaultdict
+from enum import IntEnum
 from pathlib import Path
 from typing import NamedTuple
-from urllib.parse import urlparse
 
 from docopt import docopt
-from huey import SqliteHuey, crontab
-from peewee import IntegrityError
+from peewee import IntegrityError, fn
 
+from src.backup import create_backup
 from src.config import Config
+from src.facets import save_facets
+from src.images import (
+    Audit,
+    Image,
+    audit_images,
+    collect_images,
+    repair_images,
+    store_image,
+)
+from src.ingredients import save_ingredients
+from src.metrics import (
+    Phase,
+    RecordType,
+    Stats,
+    current_run,
+    format_summary,
+    phase,
+    record_run,
+    record_stats,
+)
+from src.navigation import invalidate_category_tree
 from src.paprika import (
     Category,
+    CategoryItem,
     CategoryRecipe,
     DoesNotExistError,
     PaprikaClient,
     Photo,
     Recipe,
+    RecipeStatus,
+    recipe_status,
 )
+from src.similar import update_similar
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.DEBUG)
@@ -68,33 +128,22 @@ __doc__ %= {
     "script_name": Path(__file__).name,
 }
 
-_BASE_DIR = Path(__file__).parent
 
-huey = SqliteHuey(
-    Config.project_name, filename=_BASE_DIR.parent / "data" / "huey.db"
-)
-
-
-class Stats(NamedTuple):
-    added: int = 0
-    updated: int = 0
-    deleted: int = 0
-
-    def __add__(self, other):
-        if not isinstance(other, Stats):
-            return NotImplementedError
-        return Stats(
-            added=self.added + other.added,
-            updated=self.updated + other.updated,
-            deleted=self.deleted + other.deleted,
-        )
+def sync_photo(uid: str, force: bool = False, **kwargs) -> Stats:
+    with phase(Phase.PHOTOS):
+        stats = _sync_photo(uid, force=force, **kwargs)
+    record_stats(RecordType.PHOTO, stats)
+    return stats
 
 
-def sync_photo(uid: str, force: bool = False, **kwargs) -> Stats:
+def _sync_photo(uid: str, force: bool = False, **kwargs) -> Stats:
     logger.debug(f"Syncing Photo record: {uid}")
     try:
         with PaprikaClient.get() as client:
-            paprika_photo = client.get_photo(uid)
+            # A cached response is only used for the hash the list reported
+            paprika_photo = client.get_photo(
+                uid, None if force else kwargs.get("hash")
+            )
     except DoesNotExistError:
         paprika_photo = None
     db_photo = Photo.get_or_none(uid=uid)
@@ -102,43 +151,28 @@ def sync_photo(uid: str, force: bool = False, **kwargs) -> Stats:
     deleted = 0
     if not paprika_photo:
         if db_photo:
-            with PaprikaClient.get() as client:
-                client.delete_photo(db_photo.photo_url)
-            db_photo.delete_instance()
+            with phase(Phase.DB_WRITES):
+                db_photo.delete_instance()
             logger.debug(f"Deleted Photo record: {uid}")
             deleted += 1
         return Stats(deleted=deleted)
 
-    with PaprikaClient.get() as client:
-        client.save_photo(paprika_photo.photo_url)
+    store_image(paprika_photo.photo_url, source_hash=kwargs.get("hash"))
 
     added, updated = 0, 0
     if db_photo:
         if paprika_photo.hash != db_photo.hash or force:
-            paprika_parsed_url = (
-                urlparse(paprika_photo.photo_url)
-                if paprika_photo.photo_url
-                else ""
-            )
-            db_parsed_url = (
-                urlparse(db_photo.photo_url) if db_photo.photo_url else ""
-            )
-            if (
-                paprika_parsed_url.path
-                and Path(paprika_parsed_url.path).name
-                != Path(db_parsed_url.path).name
-            ):
-                with PaprikaClient.get() as client:
-                    client.delete_photo(db_photo.photo_url)
             db_photo.update_from_dict(
                 **(paprika_photo.__data__ | kwargs | {"uid": uid})
             )
-            db_photo.save()
+            with phase(Phase.DB_WRITES):
+                db_photo.save()
             logger.debug(f"Updated Photo record: {uid}")
             updated += 1
     else:
         paprika_photo.update_from_dict(**(kwargs | {"uid": uid}))
-        paprika_photo.save(force_insert=True)
+        with phase(Phase.DB_WRITES):
+            paprika_photo.save(force_insert=True)
         logger.debug(f"Saved Photo record: {uid}")
         added += 1
 
@@ -147,6 +181,13 @@ def sync_photo(uid: str, force: bool = False, **kwargs) -> Stats:
 
 def sync_photos(
     recipe_uid: str | list[str] | None = None, force: bool = False
+) -> Stats:
+    with phase(Phase.PHOTOS):
+        return _sync_photos(recipe_uid=recipe_uid, force=force)
+
+
+def _sync_photos(
+    recipe_uid: str | list[str] | None = None, force: bool = False
 ) -> Stats:
     if not recipe_uid:
         recipe_uid = []
@@ -158,15 +199,28 @@ def sync_photos(
     else:
         logger.debug("Syncing Photo records")
 
+    db_photos = Photo.select(Photo.uid, Photo.hash)
+    if recipe_uid:
+        db_photos = db_photos.where(Photo.recipe_uid.in_(recipe_uid))
+    db_photo_uids_to_hash: dict[str, str] = dict(db_photos.tuples().iterator())
+
     recipes = []
+    paprika_photo_uids = set()
+    changed_photos = []
     with PaprikaClient.get() as client:
-        paprika_photos = client.get_photos()
         for uid in recipe_uid:
             try:
                 recipe = client.get_recipe(uid)
             except DoesNotExistError:
                 continue
             recipes.append(recipe)
+        # Only what the diff needs is kept while the list streams in
+        for photo in client.get_photos():
+            if recipe_uid and photo.recipe_uid not in recipe_uid:
+                continue
+            paprika_photo_uids.add(photo.uid)
+            if photo.hash != db_photo_uids_to_hash.get(photo.uid) or force:
+                changed_photos.append(photo)
 
     recipe_photo_large_uids = {
         recipe.photo_large.split(".")[0]
@@ -174,37 +228,30 @@ def sync_photos(
         if recipe.photo_large
     }
 
-    db_photos = Photo.select()
-    if recipe_uid:
-        db_photos = db_photos.where(Photo.recipe_uid.in_(recipe_uid))
-
-    db_photo_uids_to_hash = {photo.uid: photo.hash for photo in db_photos}
-    paprika_photo_uids_to_hash = {
-        photo.uid: photo.hash
-        for photo in paprika_photos
-        if not recipe_uid or photo.recipe_uid in recipe_uid
-    }
-
     stats = Stats()
 
     uids_to_delete = (
         set(db_photo_uids_to_hash.keys())
-        - set(paprika_photo_uids_to_hash.keys())
+        - paprika_photo_uids
         - recipe_photo_large_uids
     )
     for uid in uids_to_delete:
         stats += sync_photo(uid=uid)
 
-    for photo in paprika_photos:
-        if recipe_uid and photo.recipe_uid not in recipe_uid:
-            continue
-        if photo.hash != db_photo_uids_to_hash.get(photo.uid) or force:
-            stats += sync_photo(force=force, **photo.__data__)
+    for photo in changed_photos:
+        stats += sync_photo(force=force, **photo._asdict())
 
+    if not recipe_uid:
+        collect_images()
     return stats
 
 
 def sync_category_recipes(recipe_uid: str, category_uids: list[str]) -> None:
+    with phase(Phase.DB_WRITES):
+        _sync_category_recipes(recipe_uid, category_uids)
+
+
+def _sync_category_recipes(recipe_uid: str, category_uids: list[str]) -> None:
     logger.debug(f"Syncing CategoryRecipe records for Recipe: {recipe_uid}")
     num_deleted = (
         CategoryRecipe.delete()
@@ -242,125 +289,570 @@ def sync_category_recipes(recipe_uid: str, category_uids: list[str]) -> None:
                 raise
 
 
-def sync_recipe(uid: str, force: bool = False, **kwargs):
+def save_index(recipe: Recipe) -> None:
+    ingredients = save_ingredients(recipe.uid, recipe.ingredients)
+    save_facets(recipe, ingredients)
+
+
+def reindex() -> int:
+    count = 0
+    for recipe in Recipe.select():
+        with phase(Phase.DB_WRITES):
+            save_index(recipe)
+        count += 1
+    update_similar(force=True)
+    logger.info(f"Reindexed {count} recipes")
+    return count
+
+
+def audit(repair: bool = False, workers: int | None = None) -> Audit:
+    # Only a repair adopts files from before the object store
+    result = audit_images(workers=workers, adopt=repair)
+    print(f"Checked {result.checked} images")
+    for name, problem in sorted(result.broken.items()):
+        print(f"{problem}: {name}")
+    for name in result.unadopted:
+        print(f"unadopted: {name}")
+    for path in result.orphaned:
+        print(f"orphaned: {path}")
+    if repair and result.broken:
+        repaired = repair_images(result.broken)
+        print(f"Repaired {repaired} of {len(result.broken)} broken images")
+    return result
+
+
+def sync_recipe(uid: str, force: bool = False, **kwargs) -> Stats:
+    with phase(Phase.RECIPE_DETAILS):
+        stats = _sync_recipe(uid, force=force, **kwargs)
+    record_stats(RecordType.RECIPE, stats)
+    if any(stats):
+        invalidate_category_tree()
+    return stats
+
+
+def _sync_recipe(uid: str, force: bool = False, **kwargs) -> Stats:
     logger.debug(f"Syncing Recipe record: {uid}")
     try:
         with PaprikaClient.get() as client:
-            paprika_recipe = client.get_recipe(uid)
+            paprika_recipe = client.get_recipe(
+                uid, None if force else kwargs.get("hash")
+            )
     except DoesNotExistError:
         paprika_recipe = None
     db_recipe = Recipe.get_or_none(uid=uid)
 
     sync_photos(recipe_uid=uid, force=force)
 
-    deleted = 0
     if not paprika_recipe:
         if db_recipe:
-            with PaprikaClient.get() as client:
-                client.delete_photo(db_recipe.photo_url)
-            db_recipe.delete_instance()
+            with phase(Phase.DB_WRITES):
+                db_recipe.delete_instance()
             logger.debug(f"Deleted Recipe record: {db_recipe.name}")
-            deleted += 1
-        return
+            return Stats(deleted=1)
+        return Stats()
 
+    added, updated = 0, 0
     if db_recipe:
         if paprika_recipe.hash != db_recipe.hash or force:
-            with PaprikaClient.get() as client:
-                # TODO: remove this when all photos are using the larger size
-                client.delete_photo(db_recipe.photo_url)
+            store_image(
+                paprika_recipe.photo_url, source_hash=paprika_recipe.photo_hash
+            )
             db_recipe.update_from_dict(**(paprika_recipe.__data__ | kwargs))
-            db_recipe.save()
+            with phase(Phase.DB_WRITES):
+                db_recipe.save()
+                save_index(db_recipe)
             logger.debug(f"Updated Recipe record: {db_recipe.name}")
+            updated += 1
     else:
+        store_image(
+            paprika_recipe.photo_url, source_hash=paprika_recipe.photo_hash
+        )
         paprika_recipe.update_from_dict(**(kwargs | {"uid": uid}))
-        paprika_recipe.save(force_insert=True)
+        with phase(Phase.DB_WRITES):
+            paprika_recipe.save(force_insert=True)
+            save_index(paprika_recipe)
         logger.debug(f"Saved Recipe record: {paprika_recipe.name}")
+        added += 1
 
     sync_category_recipes(
         recipe_uid=uid, category_uids=paprika_recipe.categories
     )
+    return Stats(added=added, updated=updated)
 
 
-def sync_recipes(force: bool = False, limit: int | None = None):
+def sync_recipes(force: bool = False, limit: int | None = None) -> Stats:
     logger.debug("Syncing Recipe records")
-    with PaprikaClient.get() as client:
-        paprika_recipes = client.get_recipes()
-    db_recipes = Recipe.select()
-
-    db_recipe_uids_to_hash = {recipe.uid: recipe.hash for recipe in db_recipes}
-    paprika_recipe_uids_to_hash = {
-        recipe.uid: recipe.hash for recipe in paprika_recipes
-    }
-    uids_to_delete = set(db_recipe_uids_to_hash.keys()) - set(
-        paprika_recipe_uids_to_hash.keys()
-    )
+    with phase(Phase.RECIPE_LIST):
+        db_recipe_uids_to_hash: dict[str, str] = dict(
+            Recipe.select(Recipe.uid, Recipe.hash).tuples().iterator()
+        )
+        paprika_recipe_uids = set()
+        changed_recipes = []
+        with PaprikaClient.get() as client:
+            for recipe in client.get_recipes():
+                paprika_recipe_uids.add(recipe.uid)
+                if (
+                    recipe.hash != db_recipe_uids_to_hash.get(recipe.uid)
+                    or force
+                ):
+                    changed_recipes.append(recipe)
+    uids_to_delete = set(db_recipe_uids_to_hash.keys()) - paprika_recipe_uids
+    stats = Stats()
     if uids_to_delete:
         for uid in uids_to_delete:
-            sync_recipe(uid=uid, force=force)
+            stats += sync_recipe(uid=uid, force=force)
 
-    i = 0
-    for recipe in paprika_recipes:
-        if recipe.hash != db_recipe_uids_to_hash.get(recipe.uid) or force:
-            sync_recipe(force=force, **recipe.__data__)
-            i += 1
+    for recipe in changed_recipes[:limit] if limit else changed_recipes:
+        stats += sync_recipe(force=force, **recipe._asdict())
 
-        if limit and i == limit:
-            break
+    finish_sync()
+    return stats
 
 
-def sync_categories(force: bool = False):
-    logger.debug("Syncing Category records")
-    with PaprikaClient.get() as client:
-        paprika_categories = client.get_categories()
-    db_categories = Category.select()
+def sync_categories(force: bool = False) -> Stats:
+    with phase(Phase.CATEGORIES):
+        stats = _sync_categories(force=force)
+    record_stats(RecordType.CATEGORY, stats)
+    if any(stats):
+        invalidate_category_tree()
+    return stats
+
+
+class CategoryDiff(NamedTuple):
+    added: list[CategoryItem]
+    updated: list[tuple[Category, CategoryItem]]
+    deleted: set[str]
 
-    db_category_by_uid = {category.uid: category for category in db_categories}
-    paprika_category_by_uid = {
-        category.uid: category for category in paprika_categories
-    }
-    uids_to_delete = set(db_category_by_uid.keys()) - set(
-        paprika_category_by_uid.keys()
-    )
-    if uids_to_delete:
-        Category.delete().where(Category.uid.in_(uids_to_delete)).execute()
-        logger.debug(f"Deleted Category records: {uids_to_delete}")
 
+def _diff_categories(force: bool = False) -> CategoryDiff:
+    with PaprikaClient.get() as client:
+        paprika_categories = list(client.get_categories())
+    db_category_by_uid = {category.uid: category for category in Category}
+
+    diff = CategoryDiff(
+        added=[],
+        updated=[],
+        deleted=set(db_category_by_uid)
+        - {category.uid for category in paprika_categories},
+    )
     for paprika_category in paprika_categories:
-        if paprika_category.uid in db_category_by_uid:
-            if (
-                paprika_category.hash
-                == db_category_by_uid.get(paprika_category.uid).hash
-                and not force
-            ):
-                continue
-            db_category = db_category_by_uid.get(paprika_category.uid)
-            db_category.update_from_dict(**(paprika_category.__data__))
+        db_category = db_category_by_uid.get(paprika_category.uid)
+        if db_category is None:
+            diff.added.append(paprika_category)
+        elif paprika_category.hash != db_category.hash or force:
+            diff.updated.append((db_category, paprika_category))
+    return diff
+
+
+def _sync_categories(force: bool = False) -> Stats:
+    logger.debug("Syncing Category records")
+    diff = _diff_categories(force=force)
+
+    deleted = 0
+    if diff.deleted:
+        with phase(Phase.DB_WRITES):
+            deleted = (
+                Category.delete()
+                .where(Category.uid.in_(diff.deleted))
+                .execute()
+            )
+        logger.debug(f"Deleted Category records: {diff.deleted}")
+
+    for db_category, paprika_category in diff.updated:
+        db_category.update_from_dict(**paprika_category._asdict())
+        with phase(Phase.DB_WRITES):
             db_category.save()
-            logger.debug(f"Updated Category record: {paprika_category.uid}")
-        else:
-            paprika_category.save(force_insert=True)
-            logger.debug(f"Saved Category record: {paprika_category.uid}")
+        logger.debug(f"Updated Category record: {paprika_category.uid}")
 
+    for paprika_category in diff.added:
+        with phase(Phase.DB_WRITES):
+            Category(**paprika_category._asdict()).save(force_insert=True)
+        logger.debug(f"Saved Category record: {paprika_category.uid}")
 
-def sync_all(force: bool = False, limit: int | None = None):
+    return Stats(
+        added=len(diff.added), updated=len(diff.updated), deleted=deleted
+    )
+
+
+class Priority(IntEnum):
+    TRASHED = 0
+    HIDDEN = 10
+    FAVORITE = 20
+    LISTED = 30
+    NEW_RECIPE = 40
+    DELETE = 50
+
+
+# API calls a job is expected to make: a recipe fetches itself, the photo
+# list and itself again for its cover, plus one call per changed photo
+_RECIPE_COST = 3
+_PHOTO_COST = 1
+
+
+class Job(NamedTuple):
+    record_type: RecordType
+    uid: str
+    priority: Priority
+    data: dict | None = None
+    cost: int = _RECIPE_COST
+
+
+class Budget:
+    """Limits the API calls and seconds a sync run may spend.
+
+    Calls are counted on the current run when there is one, and estimated
+    from job costs otherwise.
+    """
+
+    def __init__(
+        self, api_calls: int | None = None, seconds: float | None = None
+    ):
+        self.api_calls = api_calls or None
+        self.seconds = seconds or None
+        self._start = time.monotonic()
+        run = current_run()
+        self._start_calls = run.api_calls if run else 0
+        self._charged = 0
+
+    @property
+    def spent(self) -> int:
+        if run := current_run():
+            return run.api_calls - self._start_calls
+        return self._charged
+
+    def allows(self, cost: int) -> bool:
+        if (
+            self.seconds is not None
+            and time.monotonic() - self._start >= self.seconds
+        ):
+            return False
+        return self.api_calls is None or self.spent + cost <= self.api_calls
+
+    def charge(self, cost: int) -> None:
+        self._charged += cost
+
+    def take(self, jobs: list[Job]) -> list[Job]:
+        """The leading jobs whose estimated cost fits the budget."""
+        taken = []
+        for job in jobs:
+            if not self.allows(job.cost):
+                break
+            self.charge(job.cost)
+            taken.append(job)
+        return taken
+
+
+def _recipe_priority(
+    in_trash: bool, favorite: bool, categories: set[str]
+) -> Priority:
+    if in_trash:
+        return Priority.TRASHED
+    if recipe_status(categories) != RecipeStatus.HIDDEN:
+        return Priority.LISTED
+    if favorite:
+        return Priority.FAVORITE
+    return Priority.HIDDEN
+
+
+class Plan(NamedTuple):
+    jobs: list[Job]
+    stats: dict[RecordType, Stats]
+
+
+def plan_sync(force: bool = False) -> list[Job]:
+    """Sync categories, then list the recipes and photos left to sync.
+
+    Deletions and new recipes come first, then changed recipes by how much
+    they are seen: listed, pinned or favorite, hidden and finally trashed.
+    Within each, recipes last updated here most recently come first, and
+    photos follow the recipe they belong to.
+    """
     sync_categories(force=force)
-    sync_recipes(force=force, limit=limit)
+    return _plan(force=force).jobs
+
+
+def _plan(force: bool = False) -> Plan:
+    # Reads the list endpoints and the database only
+    with phase(Phase.RECIPE_LIST):
+        db_recipes = {
+            uid: (recipe_hash, str(updated), in_trash, pinned or favorite)
+            for uid, recipe_hash, updated, in_trash, pinned, favorite in (
+                Recipe.select(
+                    Recipe.uid,
+                    Recipe.hash,
+                    fn.COALESCE(Recipe.time_updated, Recipe.time_created),
+                    Recipe.in_trash,
+                    Recipe.is_pinned,
+                    Recipe.on_favorites,
+                )
+                .tuples()
+                .iterator()
+            )
+        }
+        categories: defaultdict[str, set[str]] = defaultdict(set)
+        for recipe_uid, name in (
+            CategoryRecipe.select(CategoryRecipe.recipe, Category.name)
+            .join(Category)
+            .tuples()
+            .iterator()
+        ):
+            categories[recipe_uid].add(name)
+        db_photos: dict[str, str] = dict(
+            Photo.select(Photo.uid, Photo.hash).tuples().iterator()
+        )
+
+        # Only what the diff needs is kept while the lists stream in
+        paprika_recipe_uids = set()
+        new, changed = [], []
+        hashes = {}
+        paprika_photo_uids = set()
+        changed_photos: Counter[str | None] = Counter()
+        photos = []
+        photos_added = photos_updated = 0
+        with PaprikaClient.get() as client:
+            for recipe in client.get_recipes():
+                paprika_recipe_uids.add(recipe.uid)
+                if recipe.uid not in db_recipes:
+                    new.append(recipe.uid)
+                elif force or recipe.hash != db_recipes[recipe.uid][0]:
+                    changed.append((db_recipes[recipe.uid][1], recipe.uid))
+                else:
+                    continue
+                hashes[recipe.uid] = recipe.hash
+            deleted = sorted(set(db_recipes) - paprika_recipe_uids)
+            # Recipe jobs sync their own photos
+            recipe_uids = set(deleted) | set(new) | {uid for _, uid in changed}
+            for photo in client.get_photos():
+                paprika_photo_uids.add(photo.uid)
+                if force or photo.hash != db_photos.get(photo.uid):
+                    if photo.uid in db_photos:
+                        photos_updated += 1
+                    else:
+                        photos_added += 1
+                    changed_photos[photo.recipe_uid] += 1
+                    if photo.recipe_uid not in recipe_uids:
+                        photos.append(photo)
+
+    def recipe_job(uid: str, priority: Priority) -> Job:
+        cost = _RECIPE_COST + changed_photos[uid] * _PHOTO_COST
+        data = {"hash": hashes[uid]} if uid in hashes else None
+        return Job(RecordType.RECIPE, uid, priority, data, cost)
+
+    recipe_priority = {
+        uid: _recipe_priority(in_trash, favorite, categories[uid])
+        for uid, (_, _, in_trash, favorite) in db_recipes.items()
+    }
+    jobs = [recipe_job(uid, Priority.DELETE) for uid in deleted]
+    jobs += [recipe_job(uid, Priority.NEW_RECIPE) for uid in new]
+    jobs += [
+        recipe_job(uid, recipe_priority[uid])
+        for _, uid in sorted(changed, reverse=True)
+    ]
+    jobs += [
+        Job(RecordType.PHOTO, uid, Priority.DELETE, cost=_PHOTO_COST)
+        for uid in sorted(set(db_photos) - paprika_photo_uids)
+    ]
+    for photo in photos:
+        priority = recipe_priority.get(photo.recipe_uid, Priority.HIDDEN)
+        jobs.append(
+            Job(
+                RecordType.PHOTO,
+                photo.uid,
+                priority,
+                photo._asdict(),
+                _PHOTO_COST,
+            )
+        )
+    deleted_photos = len(set(db_photos) - paprika_photo_uids)
+    return Plan(
+        jobs=sorted(jobs, key=lambda job: -job.priority),
+        stats={
+            RecordType.RECIPE: Stats(len(new), len(changed), len(deleted)),
+            RecordType.PHOTO: Stats(
+                photos_added, photos_updated, deleted_photos
+            ),
+        },
+    )
 
 
-def crontab_from_config(cron: str) -> crontab:
-    minute, hour, day, month, day_of_week = cron.strip().split()
-    return crontab(
-        minute=minute,
-        hour=hour,
-        day=day,
-        month=month,
-        day_of_week=day_of_week,
+# Calls every run makes before syncing any record: the category, recipe and
+# photo lists
+_LIST_COST = 3
+
+
+class Estimate(NamedTuple):
+    stats: dict[RecordType, Stats]
+    # Memberships removed with deleted recipes and categories; those of new
+    # and changed recipes are only known from their details
+    memberships_deleted: int
+    recipes_to_check: int
+    api_calls: int
+    jobs: int
+    jobs_within_budget: int
+    images: int
+    image_bytes: int
+    seconds: float
+    min_seconds: float
+
+    def as_dict(self) -> dict:
+        return dict(
+            **{
+                record_type: self.stats[record_type]._asdict()
+                for record_type in RecordType
+            },
+            memberships=dict(
+                deleted=self.memberships_deleted,
+                recipes_to_check=self.recipes_to_check,
+            ),
+            api_calls=self.api_calls,
+            jobs=self.jobs,
+            jobs_within_budget=self.jobs_within_budget,
+            images=self.images,
+            image_bytes=self.image_bytes,
+            seconds=round(self.seconds, 1),
+            min_seconds=round(self.min_seconds, 1),
+        )
+
+
+def estimate_sync(force: bool = False) -> Estimate:
+    """What a sync would do, from the list endpoints alone.
+
+    Nothing is written and no record details are fetched. Images are
+    counted for every new or changed recipe and photo, at the average size
+    of those already stored, so both are upper bounds.
+    """
+    with phase(Phase.CATEGORIES):
+        categories = _diff_categories(force=force)
+    plan = _plan(force=force)
+    stats = {
+        RecordType.CATEGORY: Stats(
+            len(categories.added),
+            len(categories.updated),
+            len(categories.deleted),
+        ),
+        **plan.stats,
+    }
+
+    deleted_recipes = [
+        job.uid
+        for job in plan.jobs
+        if job.record_type == RecordType.RECIPE
+        and job.priority == Priority.DELETE
+    ]
+    memberships_deleted = (
+        CategoryRecipe.select()
+        .where(
+            CategoryRecipe.recipe.in_(deleted_recipes)
+            | CategoryRecipe.category.in_(categories.deleted)
+        )
+        .count()
     )
 
+    recipes, photos = stats[RecordType.RECIPE], stats[RecordType.PHOTO]
+    images = recipes.added + recipes.updated + photos.added + photos.updated
+    average_size = Image.select(fn.AVG(Image.size)).scalar() or 0
 
-@huey.periodic_task(crontab_from_config(Config.paprika.cron))
-def schedule_sync():
-    sync_all()
+    api_calls = _LIST_COST + sum(job.cost for job in plan.jobs)
+    budget = Config.paprika.api_budget
+    if not budget:
+        within_budget = len(plan.jobs)
+    elif budget <= _LIST_COST:
+        within_budget = 0
+    else:
+        within_budget = len(Budget(budget - _LIST_COST).take(plan.jobs))
+
+    delay = Config.paprika.api_delay
+    return Estimate(
+        stats=stats,
+        memberships_deleted=memberships_deleted,
+        recipes_to_check=recipes.added + recipes.updated,
+        api_calls=api_calls,
+        jobs=len(plan.jobs),
+        jobs_within_budget=within_budget,
+        images=images,
+        image_bytes=int(images * average_size),
+        seconds=api_calls * delay,
+        min_seconds=api_calls * min(delay, Config.paprika.min_api_delay),
+    )
+
+
+def format_estimate(estimate: Estimate) -> str:
+    lines = []
+    for record_type in RecordType:
+        stats = estimate.stats[record_type]
+        label = f"{record_type.capitalize()} rows:"
+        lines.append(
+            f"  {label:<18}{stats.added} to add, {stats.updated} to update, "
+            f"{stats.deleted} to delete"
+        )
+    lines += [
+        f"  {'Memberships:':<18}{estimate.memberships_deleted} to delete, "
+        f"{estimate.recipes_to_check} recipes to check",
+        "",
+        f"  {'API calls:':<18}{estimate.api_calls} "
+        f"({estimate.jobs_within_budget} of {estimate.jobs} records "
+        "within budget)",
+        f"  {'Images:':<18}up to {estimate.images} "
+        f"(~{estimate.image_bytes} bytes)",
+        f"  {'Duration:':<18}~{estimate.seconds:.0f}s "
+        f"(~{estimate.min_seconds:.0f}s at the fastest rate)",
+    ]
+    return "\n".join(lines)
+
+
+def run_jobs(
+    jobs: list[Job], budget: Budget | None = None, force: bool = False
+) -> list[Job]:
+    """Sync jobs in order until the budget is spent.
+
+    Returns the jobs left over; their records keep their old hashes, so the
+    next run plans them again.
+    """
+    budget = budget or Budget()
+    for i, job in enumerate(jobs):
+        if not budget.allows(job.cost):
+            logger.info(f"Sync budget spent, leaving {len(jobs) - i} jobs")
+            return jobs[i:]
+        if job.record_type == RecordType.RECIPE:
+            sync_recipe(uid=job.uid, force=force, **(job.data or {}))
+        else:
+            sync_photo(uid=job.uid, force=force, **(job.data or {}))
+        budget.charge(job.cost)
+    return []
+
+
+def finish_sync() -> None:
+    update_similar()
+    with phase(Phase.PHOTOS):
+        collect_images()
+    if Config.backup.after_sync:
+        create_backup()
+
+
+def sync_all(
+    force: bool = False,
+    limit: int | None = None,
+    budget: Budget | None = None,
+) -> list[Job]:
+    jobs = plan_sync(force=force)
+    if limit:
+        # Deletions do not count towards the limit of each record type
+        counts: Counter[RecordType] = Counter()
+        kept = []
+        for job in jobs:
+            if job.priority != Priority.DELETE:
+                counts[job.record_type] += 1
+                if counts[job.record_type] > limit:
+                    continue
+            kept.append(job)
+        jobs = kept
+    left = run_jobs(jobs, budget=budget, force=force)
+    finish_sync()
+    return left
+
+
+def _budget_option(value: str | None, default: int) -> int:
+    return int(value) if value and value.isdigit() else default
 
 
 def main(argv: list[str] | None = None):
@@ -377,18 +869,68 @@ def main(argv: list[str] | None = None):
     photos = args.get("photos")
     photo = args.get("photo")
 
-    if categories:
-        sync_categories(force=force)
-    elif recipes:
-        sync_recipes(force=force, limit=limit)
-    elif recipe:
-        sync_recipe(uid=uid, force=force, limit=limit)
-    elif photos:
-        sync_photos(force=force)
-    elif photo:
-        sync_photo(uid=uid, force=force)
-    else:
-        sync_all(force=force, limit=limit)
+    if args.get("reindex"):
+        reindex()
+        return
+
+    if args.get("plan"):
+        estimate = estimate_sync(force=force)
+        if args.get("--json"):
+            print(json.dumps(estimate.as_dict(), indent=2))
+        else:
+            print(format_estimate(estimate))
+        return
+
+    if args.get("audit"):
+        workers = args.get("--workers")
+        audit(
+            repair=bool(args.get("--repair")),
+            workers=int(workers) if workers.isdigit() else None,
+        )
+        return
+
+    profiler = None
+    if args.get("--profile"):
+        from src.profiling import PhaseProfiler
+
+        profiler = PhaseProfiler(Path(args["--profile"]))
+
+    command = next(
+        (
+            name
+            for name in ("categories", "recipes", "recipe", "photos", "photo")
+            if args.get(name)
+        ),
+        "all",
+    )
+
+    left = []
+    with record_run(command, force=force, profiler=profiler) as run:
+        if categories:
+            sync_categories(force=force)
+        elif recipes:
+            sync_recipes(force=force, limit=limit)
+        elif recipe:
+            sync_recipe(uid=uid, force=force, limit=limit)
+            collect_images()
+        elif photos:
+            sync_photos(force=force)
+        elif photo:
+            sync_photo(uid=uid, force=force)
+            collect_images()
+        else:
+            budget = Budget(
+                api_calls=_budget_option(
+                    args.get("--budget"), Config.paprika.api_budget
+                ),
+                seconds=_budget_option(
+                    args.get("--time-budget"), Config.paprika.time_budget
+                ),
+            )
+            left = sync_all(force=force, limit=limit, budget=budget)
+    print(format_summary(run))
+    if left:
+        print(f"Left {len(left)} records for the next run")
 
 
 if __name__ == "__main__":
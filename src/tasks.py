@@ -0,0 +1,181 @@
+import logging
+from pathlib import Path
+from typing import Any
+
+from huey import SqliteHuey, crontab
+
+from src.config import Config
+from src.metrics import (
+    RecordType,
+    finish_run,
+    format_summary,
+    record_run,
+    record_task,
+)
+from src.sync import (
+    Budget,
+    Job,
+    finish_sync,
+    plan_sync,
+    sync_photo,
+    sync_recipe,
+)
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+_BASE_DIR = Path(__file__).parent
+
+huey = SqliteHuey(
+    Config.project_name, filename=_BASE_DIR.parent / "data" / "huey.db"
+)
+
+_RETRIES = 3
+_RETRY_DELAY = 60  # seconds
+# How often the finishing task checks whether record tasks are done, and
+# how many checks before it stops waiting on a worker that died mid-task
+_FINISH_DELAY = 30  # seconds
+_FINISH_CHECKS = 120
+# Counts record tasks currently running across all workers
+_ACTIVE_KEY = "sync.active"
+_FINISH_KEY = "sync.queued.finish"
+
+
+def crontab_from_config(cron: str) -> crontab:
+    minute, hour, day, month, day_of_week = cron.strip().split()
+    return crontab(
+        minute=minute,
+        hour=hour,
+        day=day,
+        month=month,
+        day_of_week=day_of_week,
+    )
+
+
+def _queued_key(record_type: RecordType, uid: str) -> str:
+    return f"sync.queued.{record_type}.{uid}"
+
+
+def _run_record(
+    task,
+    record_type: RecordType,
+    uid: str,
+    sync,
+    run_id: int | None = None,
+    **kwargs,
+):
+    # Cleared before the work starts, so changes made during it are queued
+    # again; kept while a failed task waits for its retry
+    key = _queued_key(record_type, uid)
+    huey.delete(key)
+    huey.storage.incr(_ACTIVE_KEY)
+    try:
+        with huey.lock_task(f"sync.{record_type}.{uid}"), record_task(run_id):
+            sync(uid=uid, **kwargs)
+    except Exception:
+        if task.retries:
+            huey.put(key, True)
+        raise
+    finally:
+        huey.storage.incr(_ACTIVE_KEY, -1)
+
+
+@huey.task(retries=_RETRIES, retry_delay=_RETRY_DELAY, context=True)
+def sync_recipe_task(
+    uid: str,
+    data: dict | None = None,
+    force: bool = False,
+    run_id: int | None = None,
+    task=None,
+):
+    _run_record(
+        task,
+        RecordType.RECIPE,
+        uid,
+        sync_recipe,
+        run_id=run_id,
+        force=force,
+        **(data or {}),
+    )
+
+
+@huey.task(retries=_RETRIES, retry_delay=_RETRY_DELAY, context=True)
+def sync_photo_task(
+    uid: str,
+    data: dict | None = None,
+    force: bool = False,
+    run_id: int | None = None,
+    task=None,
+):
+    _run_record(
+        task,
+        RecordType.PHOTO,
+        uid,
+        sync_photo,
+        run_id=run_id,
+        force=force,
+        **(data or {}),
+    )
+
+
+_RECORD_TASKS = {
+    RecordType.RECIPE: sync_recipe_task,
+    RecordType.PHOTO: sync_photo_task,
+}
+
+
+def enqueue(
+    jobs: list[Job], force: bool = False, run_id: int | None = None
+) -> int:
+    """Queue a task per job unless one is already queued for the record.
+
+    The work of the tasks is recorded in the sync run run_id.
+    """
+    queued = 0
+    for job in jobs:
+        if not huey.put_if_empty(_queued_key(job.record_type, job.uid), True):
+            logger.debug(f"Already queued: {job.record_type} {job.uid}")
+            continue
+        kwargs: dict[str, Any] = {
+            "force": force,
+            "run_id": run_id,
+            "priority": job.priority,
+        }
+        if job.data:
+            kwargs["data"] = job.data
+        huey.enqueue(_RECORD_TASKS[job.record_type].s(job.uid, **kwargs))
+        queued += 1
+    return queued
+
+
+@huey.task(priority=-1)
+def finish_sync_task(checks: int = 0, run_id: int | None = None):
+    if huey.pending_count() or huey.scheduled_count():
+        finish_sync_task.schedule((checks + 1, run_id), delay=_FINISH_DELAY)
+        return
+    if huey.storage.incr(_ACTIVE_KEY, 0) > 0:
+        if checks < _FINISH_CHECKS:
+            finish_sync_task.schedule((checks + 1, run_id), delay=_FINISH_DELAY)
+            return
+        logger.warning("Finishing sync with record tasks still counted")
+        huey.storage.delete_counter(_ACTIVE_KEY)
+    huey.delete(_FINISH_KEY)
+    with record_task(run_id):
+        finish_sync()
+    if run_id is not None:
+        finish_run(run_id)
+
+
+@huey.periodic_task(crontab_from_config(Config.paprika.cron))
+def schedule_sync():
+    with record_run("schedule") as run:
+        jobs = plan_sync()
+    # Workers spend the calls, so the budget is estimated from the plan,
+    # after the calls made listing the records
+    budget = Budget(api_calls=Config.paprika.api_budget)
+    budget.charge(run.api_calls)
+    queued = enqueue(budget.take(jobs), run_id=run.id)
+    if huey.put_if_empty(_FINISH_KEY, True):
+        finish_sync_task(run_id=run.id)
+    logger.info(format_summary(run))
+    logger.info(f"Queued {queued} of {len(jobs)} sync tasks")
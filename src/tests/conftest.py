@@ -0,0 +1,19 @@
+import asyncio
+from collections.abc import Callable
+
+import pytest
+
+from src import asgi_client
+from src.asgi_client import Response
+
+
+@pytest.fixture
+def asgi_get() -> Callable[..., Response]:
+    """GET a path from an ASGI app and return the collected response."""
+
+    def get(
+        app, path: str = "/", headers: dict[str, str] | None = None
+    ) -> Response:
+        return asyncio.run(asgi_client.get(app, path, headers))
+
+    return get
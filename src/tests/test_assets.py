@@ -0,0 +1,81 @@
+import gzip
+import json
+from unittest.mock import patch
+
+import brotli
+import pytest
+
+from src.assets import IMMUTABLE, AssetFiles, build, static_url
+
+_CSS = b"body { color: red; }\n" * 100
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "style.css").write_bytes(_CSS)
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "photo.png").write_bytes(b"png")
+    with (
+        patch("src.assets.STATIC_DIR", tmp_path),
+        patch("src.assets.DIST_DIR", tmp_path / "dist"),
+        patch("src.assets.MANIFEST_FILE", tmp_path / "dist" / "manifest.json"),
+    ):
+        yield tmp_path
+
+
+def test_build(static_dir):
+    manifest = build(skip_sass=True)
+
+    assert set(manifest) == {"css/style.css"}
+    fingerprinted = static_dir / manifest["css/style.css"]
+    assert fingerprinted.read_bytes() == _CSS
+    assert (
+        brotli.decompress(
+            fingerprinted.with_name(fingerprinted.name + ".br").read_bytes()
+        )
+        == _CSS
+    )
+    assert (
+        gzip.decompress(
+            fingerprinted.with_name(fingerprinted.name + ".gz").read_bytes()
+        )
+        == _CSS
+    )
+    assert json.loads((static_dir / "dist" / "manifest.json").read_text()) == (
+        manifest
+    )
+    assert static_url(manifest, "css/style.css") == (
+        f"/static/{manifest['css/style.css']}"
+    )
+    assert static_url(manifest, "css/other.css") == "/static/css/other.css"
+
+
+def test_asset_files(static_dir, asgi_get):
+    manifest = build(skip_sass=True)
+    app = AssetFiles(
+        directory=static_dir, cache_control={"images": "max-age=60"}
+    )
+    path = f"/{manifest['css/style.css']}"
+
+    response = asgi_get(app, path, {"accept-encoding": "gzip, br"})
+    assert response.status == 200
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["content-type"].startswith("text/css")
+    assert response.headers["cache-control"] == IMMUTABLE
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert brotli.decompress(response.body) == _CSS
+
+    response = asgi_get(app, path, {"accept-encoding": "gzip, br;q=0"})
+    assert response.headers["content-encoding"] == "gzip"
+
+    response = asgi_get(app, path)
+    assert "content-encoding" not in response.headers
+    assert response.body == _CSS
+
+    response = asgi_get(app, "/images/photo.png")
+    assert response.headers["cache-control"] == "max-age=60"
+
+    etag = asgi_get(app, path).headers["etag"]
+    response = asgi_get(app, path, {"if-none-match": etag})
+    assert response.status == 304
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from src import images
+from src.backup import create_backup, snapshots
+from src.images import store_image
+
+_PHOTOS = Path(__file__).parent / "fixtures" / "photos"
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    with sqlite3.connect(data_dir / "sqlite.db") as connection:
+        connection.execute("CREATE TABLE recipe (name TEXT)")
+        connection.execute("INSERT INTO recipe VALUES ('Soup')")
+    connection.close()
+    with mock.patch("src.backup._DATA_DIR", data_dir):
+        yield data_dir
+
+
+def test_create_backup(data_dir, tmp_path):
+    backup_dir = tmp_path / "backups"
+    store_image(str(_PHOTOS / "photo-1.png"))
+    store_image(str(_PHOTOS / "photo-1-cover.png"))
+
+    first = create_backup(backup_dir, keep=2)
+    # One object, two names for it
+    assert (first.copied, first.linked) == (1, 2)
+    with sqlite3.connect(first.path / "sqlite.db") as connection:
+        assert connection.execute("SELECT name FROM recipe").fetchall() == [
+            ("Soup",)
+        ]
+    connection.close()
+    assert not (first.path / "huey.db").exists()
+    public = first.path / "images" / "photo-1.png"
+    assert public.samefile(first.path / "images" / "photo-1-cover.png")
+
+    store_image(str(_PHOTOS / "photo-2.png"))
+    second = create_backup(backup_dir, keep=2)
+    assert (second.copied, second.linked) == (1, 4)
+    assert (second.path / "images" / "photo-1.png").samefile(public)
+    assert (second.path / "images" / "photo-2.png").read_bytes() == (
+        images._IMAGE_DIR / "photo-2.png"
+    ).read_bytes()
+
+    third = create_backup(backup_dir, keep=2)
+    assert third.copied == 0
+    assert snapshots(backup_dir) == [second.path, third.path]
+
+
+def test_backup_copies_replaced_public_names(data_dir, tmp_path):
+    backup_dir = tmp_path / "backups"
+    store_image(str(_PHOTOS / "photo-1.png"))
+    first = create_backup(backup_dir, keep=2)
+
+    # Same size and mtime, but no longer the stored object
+    public = images._IMAGE_DIR / "photo-1.png"
+    stat = public.stat()
+    data = bytes(255 - byte for byte in public.read_bytes())
+    public.unlink()
+    public.write_bytes(data)
+    os.utime(public, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    second = create_backup(backup_dir, keep=2)
+    assert (second.copied, second.linked) == (1, 1)
+    assert (second.path / "images" / "photo-1.png").read_bytes() == data
+    assert (first.path / "images" / "photo-1.png").read_bytes() != data
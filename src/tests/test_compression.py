@@ -0,0 +1,102 @@
+import gzip
+import zlib
+
+import brotli
+
+from src.compression import CompressedBodyCache, CompressionMiddleware
+
+_PAGE = b"<html>" + b"<p>Recipe</p>" * 200 + b"</html>"
+
+
+def _html_app(chunks: list[bytes], etag: str | None = None):
+    async def app(scope, receive, send):
+        headers = [(b"content-type", b"text/html; charset=utf-8")]
+        if len(chunks) == 1:
+            headers.append((b"content-length", str(len(chunks[0])).encode()))
+        if etag:
+            headers.append((b"etag", etag.encode()))
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": headers}
+        )
+        for i, chunk in enumerate(chunks):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": i < len(chunks) - 1,
+                }
+            )
+
+    return app
+
+
+def _accept(encoding: str) -> dict[str, str]:
+    return {"accept-encoding": encoding}
+
+
+def test_brotli_preferred(asgi_get):
+    response = asgi_get(
+        CompressionMiddleware(_html_app([_PAGE])),
+        headers=_accept("gzip, deflate, br"),
+    )
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["content-length"] == str(len(response.body))
+    assert brotli.decompress(response.body) == _PAGE
+
+
+def test_gzip(asgi_get):
+    response = asgi_get(
+        CompressionMiddleware(_html_app([_PAGE])), headers=_accept("gzip")
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(response.body) == _PAGE
+
+
+def test_identity(asgi_get):
+    app = CompressionMiddleware(_html_app([_PAGE]))
+    for accept_encoding in ("", "br;q=0, gzip;q=0"):
+        response = asgi_get(app, headers=_accept(accept_encoding))
+        assert "content-encoding" not in response.headers
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.body == _PAGE
+
+
+def test_small_response_not_compressed(asgi_get):
+    response = asgi_get(
+        CompressionMiddleware(_html_app([b"<p>Hi</p>"])), headers=_accept("br")
+    )
+    assert "content-encoding" not in response.headers
+    assert response.body == b"<p>Hi</p>"
+
+
+def test_streamed_response(asgi_get):
+    chunks = [_PAGE[:1000], _PAGE[1000:2000], _PAGE[2000:]]
+    response = asgi_get(
+        CompressionMiddleware(_html_app(chunks)), headers=_accept("gzip")
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert zlib.decompress(response.body, 16 + zlib.MAX_WBITS) == _PAGE
+
+
+def test_compressed_body_cached_by_etag(asgi_get):
+    app = CompressionMiddleware(
+        _html_app([_PAGE], etag='W/"abc"'), cache_bytes=1024 * 1024
+    )
+    response = asgi_get(app, headers=_accept("br"))
+    assert app.cache.get(('W/"abc"', "br")) == response.body
+
+    # A cached body is reused as is for the same ETag
+    app.cache.set(('W/"abc"', "br"), b"cached")
+    assert asgi_get(app, headers=_accept("br")).body == b"cached"
+
+
+def test_cache_evicts_least_recently_used():
+    cache = CompressedBodyCache(max_bytes=10)
+    cache.set(("a", "br"), b"12345")
+    cache.set(("b", "br"), b"12345")
+    cache.get(("a", "br"))
+    cache.set(("c", "br"), b"12345")
+    assert cache.get(("a", "br")) == b"12345"
+    assert cache.get(("b", "br")) is None
@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from starlette.datastructures import Headers
+
+from src.app import recipe_validators
+from src.conditional import Validators
+from src.loadtest import generate_database
+from src.navigation import invalidate_category_tree
+from src.paprika import Recipe
+from src.similar import SimilarRecipe
+
+_LAST_MODIFIED = datetime(2024, 6, 15, 12, 0, 0, 500, tzinfo=timezone.utc)
+
+
+def test_headers():
+    validators = Validators("a", 1, last_modified=_LAST_MODIFIED)
+    headers = validators.headers("no-cache")
+    assert headers["ETag"].startswith('W/"')
+    assert headers["Last-Modified"] == "Sat, 15 Jun 2024 12:00:00 GMT"
+    assert headers["Cache-Control"] == "no-cache"
+    assert Validators("a", 1).etag == validators.etag
+    assert Validators("a", 2).etag != validators.etag
+
+
+def test_if_none_match():
+    validators = Validators("a", last_modified=_LAST_MODIFIED)
+    strong = validators.etag.removeprefix("W/")
+    for value, expected in (
+        (validators.etag, True),
+        (strong, True),
+        (f'"other", {validators.etag}', True),
+        ("*", True),
+        ('"other"', False),
+    ):
+        headers = Headers({"if-none-match": value})
+        assert validators.is_not_modified(headers) is expected
+
+
+def test_if_modified_since():
+    validators = Validators("a", last_modified=_LAST_MODIFIED)
+    for value, expected in (
+        ("Sat, 15 Jun 2024 12:00:00 GMT", True),
+        ("Sun, 16 Jun 2024 12:00:00 GMT", True),
+        ("Fri, 14 Jun 2024 12:00:00 GMT", False),
+        ("not a date", False),
+    ):
+        headers = Headers({"if-modified-since": value})
+        assert validators.is_not_modified(headers) is expected
+
+    # If-None-Match takes precedence over If-Modified-Since
+    headers = Headers(
+        {
+            "if-none-match": '"other"',
+            "if-modified-since": "Sun, 16 Jun 2024 12:00:00 GMT",
+        }
+    )
+    assert not validators.is_not_modified(headers)
+    assert validators.not_modified().status_code == 304
+
+
+def test_recipe_validators_follow_page_contents(tmp_path):
+    generate_database(tmp_path / "conditional.db", recipes=3, categories=0)
+    recipe, neighbour, other = Recipe.select().order_by(Recipe.uid)
+    SimilarRecipe.insert_many(
+        [
+            {
+                "recipe": recipe.uid,
+                "similar": similar.uid,
+                "rank": rank,
+                "score": 1.0,
+            }
+            for rank, similar in enumerate((neighbour, other))
+        ]
+    ).execute()
+
+    with patch("src.navigation._STAMP_FILE", tmp_path / "categories.stamp"):
+        etags = [recipe_validators(recipe.slug).etag]
+
+        # The page links to its neighbours by name and photo
+        neighbour.slug = "renamed"
+        neighbour.hash = "renamed"
+        neighbour.save()
+        etags.append(recipe_validators(recipe.slug).etag)
+
+        other.delete_instance()
+        etags.append(recipe_validators(recipe.slug).etag)
+
+        # And shows the category navigation with its recipe counts
+        invalidate_category_tree()
+        etags.append(recipe_validators(recipe.slug).etag)
+        assert recipe_validators(recipe.slug).etag == etags[-1]
+
+    assert len(set(etags)) == len(etags)
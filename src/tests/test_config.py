@@ -0,0 +1,50 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from src.config import LazySettings
+
+_ROOT = Path(__file__).parents[2]
+
+
+def test_lazy_settings():
+    loads = []
+
+    class Settings:
+        title = "Recipes"
+
+    def load():
+        loads.append(1)
+        return Settings()
+
+    settings = LazySettings(load)
+    assert not loads
+    assert settings.title == "Recipes"
+    assert settings.title == "Recipes"
+    assert len(loads) == 1
+
+
+def test_cli_import_does_no_setup():
+    code = (
+        "import sys\n"
+        "import src.sync\n"
+        "from src.config import Config\n"
+        "from src.database import db_proxy\n"
+        "assert Config._settings is None\n"
+        "assert db_proxy.obj is None\n"
+        "assert 'dynaconf' not in sys.modules\n"
+        "assert 'huey' not in sys.modules\n"
+        "assert 'requests' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=_ROOT, check=True)
+
+
+def test_app_import_does_no_setup():
+    code = (
+        "import src.app\n"
+        "from src.config import Config\n"
+        "from src.database import db_proxy\n"
+        "assert Config._settings is None\n"
+        "assert db_proxy.obj is None\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=_ROOT, check=True)
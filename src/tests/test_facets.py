@@ -0,0 +1,124 @@
+from src.facets import (
+    Facet,
+    facet_counts,
+    facet_options,
+    ingredient_terms,
+    matching_recipes,
+    parse_filters,
+    parse_minutes,
+    recipe_facets,
+    save_facets,
+    time_bucket,
+)
+from src.ingredients import parse_ingredients
+from src.loadtest import generate_database
+from src.paprika import Recipe
+
+
+def test_parse_minutes():
+    assert parse_minutes("45 mins") == 45
+    assert parse_minutes("1 hr 15 mins") == 75
+    assert parse_minutes("1.5 hours") == 90
+    assert parse_minutes("2h30m") == 150
+    assert parse_minutes("1:05") == 65
+    assert parse_minutes("20") == 20
+    assert parse_minutes("overnight") is None
+    assert parse_minutes(None) is None
+
+
+def test_time_bucket():
+    assert time_bucket(10) == "15"
+    assert time_bucket(30) == "30"
+    assert time_bucket(31) == "60"
+    assert time_bucket(300) == "more"
+
+
+def test_ingredient_terms():
+    assert ingredient_terms(" cups chopped tomatoes") == {"tomato"}
+    assert ingredient_terms(" tbsp fresh berries and eggs") == {"berry", "egg"}
+
+
+def test_parse_filters():
+    assert parse_filters(
+        {
+            "rating": "4",
+            "total_time": "30",
+            "prep_time": "7",
+            "source": "Example.com",
+            "ingredient": "",
+            "other": "x",
+        }
+    ) == {
+        Facet.RATING: "4",
+        Facet.TOTAL_TIME: "30",
+        Facet.SOURCE: "example.com",
+    }
+    assert parse_filters({"rating": "9"}) == {}
+
+
+def test_recipe_facets():
+    recipe = Recipe(
+        rating=4,
+        total_time="1 hr",
+        prep_time="10 min",
+        source_url="https://www.example.com/recipe",
+    )
+    ingredients = parse_ingredients("**Sauce**\n2 cloves garlic\n1 cup rice")
+    assert recipe_facets(recipe, ingredients) == {
+        (Facet.RATING, "4"),
+        (Facet.TOTAL_TIME, "60"),
+        (Facet.PREP_TIME, "15"),
+        (Facet.SOURCE, "example.com"),
+        (Facet.INGREDIENT, "garlic"),
+        (Facet.INGREDIENT, "rice"),
+    }
+
+
+def _uids(query) -> set[str]:
+    return {row.recipe_id for row in query}
+
+
+def test_filter_and_count(tmp_path):
+    generate_database(tmp_path / "facets.db", recipes=3, categories=0)
+    quick, slow, unrated = Recipe.select().order_by(Recipe.uid)
+    for recipe, rating, total_time, ingredients in (
+        (quick, 5, "20 min", "1 egg\n2 cups rice"),
+        (slow, 3, "3 hours", "1 egg\n1 lb beef"),
+        (unrated, 0, None, "2 cups rice"),
+    ):
+        recipe.rating = rating
+        recipe.total_time = total_time
+        save_facets(recipe, parse_ingredients(ingredients))
+
+    assert _uids(matching_recipes({Facet.RATING: "3"})) == {
+        quick.uid,
+        slow.uid,
+    }
+    assert _uids(
+        matching_recipes({Facet.RATING: "3", Facet.TOTAL_TIME: "30"})
+    ) == {quick.uid}
+    assert _uids(matching_recipes({Facet.INGREDIENT: "eggs, beef"})) == {
+        slow.uid
+    }
+    assert matching_recipes({}) is None
+
+    counts = facet_counts([quick.uid, slow.uid, unrated.uid])
+    assert counts[Facet.INGREDIENT] == {"egg": 2, "rice": 2, "beef": 1}
+
+    filters = {Facet.RATING: "3"}
+    options = facet_options("/", filters, counts)
+    rating = next(facet for facet in options if facet["name"] == "Rating")
+    assert [
+        (option["label"], option["count"], option["url"], option["active"])
+        for option in rating["options"]
+    ] == [
+        ("1+ ★", 2, "/?rating=1", False),
+        ("2+ ★", 2, "/?rating=2", False),
+        ("3+ ★", 2, "/", True),
+        ("4+ ★", 1, "/?rating=4", False),
+        ("5+ ★", 1, "/?rating=5", False),
+    ]
+
+    recipe = Recipe.get_by_id(slow.uid)
+    recipe.delete_instance()
+    assert _uids(matching_recipes({Facet.INGREDIENT: "beef"})) == set()
@@ -0,0 +1,122 @@
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from src import images
+from src.images import (
+    Image,
+    Problem,
+    audit_images,
+    collect_images,
+    repair_images,
+    store_image,
+)
+from src.paprika import PaprikaMockClient, Photo
+
+_PHOTOS = Path(__file__).parent / "fixtures" / "photos"
+
+
+def test_store_image_skips_known_content():
+    with patch.object(
+        PaprikaMockClient,
+        "download_photo",
+        autospec=True,
+        side_effect=PaprikaMockClient.download_photo,
+    ) as download:
+        assert store_image(str(_PHOTOS / "photo-1.png"), "hash-1") == (
+            "photo-1.png"
+        )
+        store_image(str(_PHOTOS / "photo-1.png"), "hash-1")
+        # Renamed upstream but the same photo hash: no download
+        store_image(str(_PHOTOS / "photo-1-cover.png"), "hash-1")
+        # A new hash but the same bytes: downloaded and deduplicated
+        store_image(str(_PHOTOS / "photo-2.png"), "hash-2")
+        store_image(str(_PHOTOS / "photo-2-cover.png"), "hash-3")
+    assert download.call_count == 3
+
+    image_dir = images._IMAGE_DIR
+    assert (image_dir / "photo-1.png").samefile(image_dir / "photo-1-cover.png")
+    assert (image_dir / "photo-2.png").samefile(image_dir / "photo-2-cover.png")
+    assert len(set((image_dir / ".objects").glob("*/*"))) == 2
+    assert store_image(None) is None
+
+
+def test_collect_images():
+    image_dir = images._IMAGE_DIR
+    store_image(str(_PHOTOS / "photo-1.png"))
+    store_image(str(_PHOTOS / "photo-2.png"))
+    # A file from before the object store, and a stray one
+    (image_dir / "photo-3.png").write_bytes(
+        (_PHOTOS / "photo-3.png").read_bytes()
+    )
+    (image_dir / "orphan.png").write_bytes(b"orphan")
+    Photo.create(uid="1", photo_url="https://example.com/photos/photo-1.png")
+    Photo.create(uid="3", photo_url="https://example.com/photos/photo-3.png")
+
+    assert collect_images() == 3
+    assert {path.name for path in image_dir.iterdir() if path.is_file()} == {
+        "photo-1.png",
+        "photo-3.png",
+    }
+    assert set(Image.select(Image.name).tuples()) == {
+        ("photo-1.png",),
+        ("photo-3.png",),
+    }
+    assert len(set((image_dir / ".objects").glob("*/*"))) == 2
+    assert collect_images() == 0
+
+
+def test_collect_images_keeps_recent_files():
+    image_dir = images._IMAGE_DIR
+    # Stored, but the photo row is not committed yet
+    store_image(str(_PHOTOS / "photo-1.png"))
+    with patch("src.images._GC_GRACE", 60):
+        assert collect_images() == 0
+        assert (image_dir / "photo-1.png").exists()
+        assert Image.get_or_none(name="photo-1.png") is not None
+
+        with patch("src.images.time.time", return_value=time.time() + 120):
+            assert collect_images() == 2
+    assert not (image_dir / "photo-1.png").exists()
+    assert not set((image_dir / ".objects").glob("*/*"))
+
+
+def test_audit_and_repair_images():
+    image_dir = images._IMAGE_DIR
+    for n in (1, 2, 3, 4):
+        url = str(_PHOTOS / f"photo-{n}.png")
+        Photo.create(uid=str(n), photo_url=url, hash=f"hash-{n}")
+        store_image(url, f"hash-{n}")
+    (image_dir / "photo-1.png").unlink()
+    with open(image_dir / "photo-2.png", "r+b") as file:
+        file.truncate(10)
+    data = bytearray((image_dir / "photo-3.png").read_bytes())
+    data[-1] ^= 0xFF
+    (image_dir / "photo-3.png").write_bytes(bytes(data))
+    (image_dir / "orphan.png").write_bytes(b"orphan")
+    # A file from before the object store is not reported missing
+    Photo.create(uid="5", photo_url=str(_PHOTOS / "photo-5.png"))
+    (image_dir / "photo-5.png").write_bytes(b"legacy")
+
+    audit = audit_images(workers=2)
+    assert audit.checked == 5
+    assert audit.broken == {
+        "photo-1.png": Problem.MISSING,
+        "photo-2.png": Problem.TRUNCATED,
+        "photo-3.png": Problem.CORRUPT,
+    }
+    assert audit.orphaned == [image_dir / "orphan.png"]
+    assert audit.unadopted == ["photo-5.png"]
+    # Without adopt the audit is read-only
+    assert Image.get_or_none(name="photo-5.png") is None
+
+    audit = audit_images(workers=2, adopt=True)
+    assert len(audit.broken) == 3
+    assert audit.unadopted == []
+    assert Image.get(name="photo-5.png").size == len(b"legacy")
+
+    assert repair_images(audit.broken) == 3
+    assert audit_images().broken == {}
+    assert (image_dir / "photo-3.png").read_bytes() == (
+        _PHOTOS / "photo-3.png"
+    ).read_bytes()
@@ -0,0 +1,101 @@
+from fractions import Fraction
+
+from src.ingredients import (
+    Ingredient,
+    format_quantity,
+    load_ingredients,
+    parse_ingredients,
+    parse_line,
+    parse_scale,
+    save_ingredients,
+    scale_text,
+)
+from src.loadtest import generate_database
+from src.paprika import Recipe
+from src.render import Renderer
+
+
+def test_parse_line():
+    assert parse_line("2 cups flour") == Ingredient(
+        text=" cups flour",
+        quantity=Fraction(2),
+        quantity_text="2",
+        unit="cups",
+    )
+    assert parse_line("1 1/2 Tbsp. sugar").quantity == Fraction(3, 2)
+    assert parse_line("1 1/2 Tbsp. sugar").unit == "tbsp"
+    assert parse_line("2-3 eggs") == Ingredient(
+        text=" eggs",
+        quantity=Fraction(2),
+        quantity_max=Fraction(3),
+        quantity_text="2-3",
+    )
+    assert parse_line("0.5 l milk").quantity == Fraction(1, 2)
+    assert parse_line("Salt") == Ingredient(text="Salt")
+    assert parse_line("**Dough**") == Ingredient(text="**Dough**", heading=True)
+
+
+def test_parse_unicode_fractions():
+    assert parse_line("½ tsp salt").quantity == Fraction(1, 2)
+    assert parse_line("1½ cups water").quantity == Fraction(3, 2)
+    assert parse_line("1 ⅓ cups oats").quantity == Fraction(4, 3)
+    assert parse_line("¼–¾ cup sugar").quantity_max == Fraction(3, 4)
+
+
+def test_parse_invalid_quantities():
+    for line in ("1/0 cup milk", "2-3/0 eggs"):
+        assert parse_line(line) == Ingredient(text=line)
+    assert scale_text("1/0 servings", Fraction(2)) == "1/0 servings"
+
+
+def test_format_quantity():
+    assert format_quantity(Fraction(4)) == "4"
+    assert format_quantity(Fraction(3, 2)) == "1 1/2"
+    assert format_quantity(Fraction(1, 3)) == "1/3"
+    assert format_quantity(Fraction(7, 10)) == "0.7"
+
+
+def test_parse_scale():
+    assert parse_scale("2") == 2
+    assert parse_scale("1/2") == Fraction(1, 2)
+    assert parse_scale("0.5") == Fraction(1, 2)
+    for value in (None, "", "abc", "0", "-1", "1/0", "1000"):
+        assert parse_scale(value) == 1
+
+
+def test_scale_text():
+    assert scale_text("4 servings", Fraction(3, 2)) == "6 servings"
+    assert scale_text("4 servings", Fraction(1)) == "4 servings"
+    assert scale_text("A crowd", Fraction(2)) == "A crowd"
+    assert scale_text(None, Fraction(2)) is None
+
+
+def test_structured_ingredients_match_regex_rendering():
+    content = "**Dough**\n1 1/2 cups flour\n\n2-3 eggs\n½ tsp salt\nWater"
+    renderer = Renderer()
+    assert renderer.structured_ingredients(
+        parse_ingredients(content), {}
+    ) == renderer.ingredients(content, {})
+
+    scaled = renderer.structured_ingredients(
+        parse_ingredients(content), {}, scale=Fraction(2)
+    )
+    assert "<li><span>3</span> cups flour</li>" in scaled
+    assert "<li><span>4-6</span> eggs</li>" in scaled
+    assert "<li><span>1</span> tsp salt</li>" in scaled
+    assert "<li>Water</li>" in scaled
+
+
+def test_save_and_load_ingredients(tmp_path):
+    generate_database(tmp_path / "ingredients.db", recipes=1, categories=0)
+    recipe = Recipe.get()
+    save_ingredients(recipe.uid, "**Sauce**\n2 tbsp butter\nPepper")
+    assert load_ingredients(recipe.uid) == parse_ingredients(
+        "**Sauce**\n2 tbsp butter\nPepper"
+    )
+
+    save_ingredients(recipe.uid, "1 lb pasta")
+    assert load_ingredients(recipe.uid) == [parse_line("1 lb pasta")]
+
+    recipe.delete_instance()
+    assert load_ingredients(recipe.uid) == []
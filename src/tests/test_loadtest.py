@@ -0,0 +1,40 @@
+import pytest
+
+from src.loadtest import (
+    generate_database,
+    parse_mix,
+    percentile,
+    request_paths,
+    run_in_process,
+    summarize,
+)
+
+
+def test_parse_mix():
+    assert parse_mix("index=1,category=2,recipe") == {
+        "index": 1,
+        "category": 2,
+        "recipe": 1,
+    }
+    with pytest.raises(ValueError):
+        parse_mix("unknown=1")
+    with pytest.raises(ValueError):
+        parse_mix("index=0")
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == pytest.approx(50.5)
+    assert percentile(values, 99) == pytest.approx(99.01)
+    assert percentile([3.0], 95) == 3.0
+
+
+@pytest.mark.integration
+def test_run_in_process(tmp_path):
+    generate_database(tmp_path / "loadtest.db", recipes=20, categories=3)
+    paths = request_paths(30, parse_mix("index=1,category=1,recipe=1"))
+    report = summarize(run_in_process(paths, concurrency=3), duration=1.0)
+
+    assert report["requests"] == 30
+    assert report["routes"]["all"]["errors"] == 0
+    assert report["routes"]["recipe"]["queries_per_request"] > 0
@@ -0,0 +1,56 @@
+import pytest
+
+from src.metrics import (
+    Phase,
+    RecordType,
+    Stats,
+    SyncRun,
+    SyncRunStatus,
+    phase,
+    record_api_call,
+    record_run,
+    record_stats,
+)
+from src.sync import sync_all
+
+
+def test_phase_without_run():
+    with phase(Phase.PHOTOS):
+        record_api_call(100)
+        record_stats(RecordType.PHOTO, Stats(added=1))
+    assert SyncRun.select().count() == 0
+
+
+def test_nested_phases_are_exclusive():
+    with record_run("test") as run:
+        with phase(Phase.RECIPE_DETAILS):
+            with phase(Phase.DB_WRITES):
+                pass
+    assert run.phases[Phase.DB_WRITES] > 0
+    assert sum(run.phases.values()) <= run.duration
+
+
+@pytest.mark.parametrize("exception", [RuntimeError, KeyboardInterrupt])
+def test_record_run_failure(exception):
+    with pytest.raises(exception):
+        with record_run("test"):
+            raise exception("boom")
+    sync_run = SyncRun.get()
+    assert sync_run.status == SyncRunStatus.FAILED
+    assert "boom" in sync_run.error
+
+
+@pytest.mark.integration
+def test_record_run_sync_all():
+    with record_run("all") as run:
+        sync_all()
+
+    sync_run = SyncRun.get_by_id(run.id)
+    assert sync_run.status == SyncRunStatus.SUCCESS
+    assert sync_run.api_calls == run.api_calls > 0
+    # Three photos and three recipe covers
+    assert sync_run.images_downloaded == 6
+    assert run.stats[RecordType.CATEGORY] == Stats(added=4)
+    assert run.stats[RecordType.RECIPE] == Stats(added=3)
+    assert run.stats[RecordType.PHOTO] == Stats(added=3)
+    assert sync_run.added == 10
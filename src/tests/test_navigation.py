@@ -0,0 +1,69 @@
+from unittest import mock
+
+from src.loadtest import generate_database
+from src.navigation import (
+    CategoryNode,
+    build_category_tree,
+    category_tree,
+    invalidate_category_tree,
+)
+from src.paprika import Category, CategoryRecipe, Recipe
+
+
+def _create_categories():
+    for uid, order_flag, name, parent_uid in (
+        ("mains", 0, "Mains", None),
+        ("pasta", 0, "Pasta", "mains"),
+        ("soup", 1, "Soup", "mains"),
+        ("private", 1, "Private", None),
+        ("drafts", 0, "Drafts", "private"),
+        ("dessert", 2, "Dessert", "missing"),
+    ):
+        Category.create(
+            uid=uid, order_flag=order_flag, name=name, parent_uid=parent_uid
+        )
+
+
+def test_build_category_tree(tmp_path):
+    generate_database(tmp_path / "navigation.db", recipes=3, categories=0)
+    _create_categories()
+    first, second, third = Recipe.select().order_by(Recipe.uid)
+    for recipe, category in (
+        (first, "pasta"),
+        (second, "pasta"),
+        (second, "mains"),
+        (third, "soup"),
+        (third, "private"),
+    ):
+        CategoryRecipe.create(recipe=recipe.uid, category=category)
+
+    with mock.patch(
+        "src.navigation.Config.paprika.hidden_categories", ["Private"]
+    ):
+        tree = build_category_tree()
+    assert tree == [
+        # Moved up from under the hidden category
+        CategoryNode("Drafts", "drafts", 0, []),
+        CategoryNode(
+            "Mains",
+            "mains",
+            1,
+            [
+                CategoryNode("Pasta", "pasta", 2, []),
+                CategoryNode("Soup", "soup", 0, []),
+            ],
+        ),
+        CategoryNode("Dessert", "dessert", 0, []),
+    ]
+
+
+def test_category_tree_cache(tmp_path):
+    generate_database(tmp_path / "navigation.db", recipes=0, categories=2)
+    tree = category_tree()
+    assert len(tree) == 2
+
+    Category.create(uid="new", order_flag=9, name="New", parent_uid=None)
+    assert category_tree() is tree
+
+    invalidate_category_tree()
+    assert [node.name for node in category_tree()][-1] == "New"
@@ -1,10 +1,34 @@
-from datetime import datetime
+import gzip
+import io
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+from http.client import RemoteDisconnected
 from unittest import mock
 from zoneinfo import ZoneInfo
 
 import pytest
 
-from src.paprika import Recipe
+from src.paprika import (
+    Category,
+    CategoryItem,
+    ClientError,
+    DoesNotExistError,
+    PaprikaAPIClient,
+    PaprikaClient,
+    PaprikaMockClient,
+    PhotoItem,
+    Recipe,
+    RecipeItem,
+    RecipeRedirect,
+    _retry_after,
+)
+from src.util import RateLimiter
+
+
+def _recipe(uid: str, name: str) -> Recipe:
+    recipe = Recipe(uid=uid, hash=f"{uid}-hash", name=name)
+    recipe.save(force_insert=True)
+    return recipe
 
 
 class TestRecipe:
@@ -33,3 +57,230 @@ class TestRecipe:
         expected_utc = local_date.astimezone(ZoneInfo("UTC"))
         expected_utc_str = expected_utc.strftime(date_format)
         assert recipe.created == expected_utc_str
+
+    def test_unique_slugs(self):
+        first = _recipe("1", "Pancakes")
+        second = _recipe("2", "Pancakes!")
+        third = _recipe("3", "pancakes")
+        assert [first.slug, second.slug, third.slug] == [
+            "pancakes",
+            "pancakes-2",
+            "pancakes-3",
+        ]
+
+        # Saving again keeps the slug it already has
+        third.save()
+        assert third.slug == "pancakes-3"
+
+    def test_renamed_recipe_redirect(self):
+        recipe = _recipe("1", "Pancakes")
+        recipe.name = "Buttermilk Pancakes"
+        recipe.save()
+        assert recipe.slug == "buttermilk-pancakes"
+        assert RecipeRedirect.get_by_id("pancakes").recipe_id == "1"
+
+        # A new recipe can take the old slug back
+        _recipe("2", "Pancakes")
+        assert not RecipeRedirect.select().exists()
+
+    def test_migrate_deduplicates_slugs(self):
+        # A table created before the unique index existed
+        Recipe._meta.database.execute_sql("DROP INDEX recipe_slug")
+        Recipe.insert_many(
+            [
+                {"uid": "b", "hash": "b", "name": "Soup", "slug": "soup"},
+                {"uid": "a", "hash": "a", "name": "Soup", "slug": "soup"},
+            ]
+        ).execute()
+
+        Recipe.migrate()
+        Recipe.create_table()
+        assert dict(Recipe.select(Recipe.uid, Recipe.slug).tuples()) == {
+            "a": "soup",
+            "b": "soup-2",
+        }
+
+
+def test_category_slug_suffix():
+    for uid in ("1", "2"):
+        Category(uid=uid, order_flag=0, name="Sides").save(force_insert=True)
+    assert [c.slug for c in Category.select().order_by(Category.uid)] == [
+        "sides",
+        "sides-2",
+    ]
+
+
+def test_list_items():
+    with PaprikaClient.get() as client:
+        recipes = list(client.get_recipes())
+        photos = list(client.get_photos())
+        categories = list(client.get_categories())
+    assert recipes[0] == RecipeItem("recipe-1-uid", "recipe-1-hash")
+    assert photos[0] == PhotoItem(
+        uid="photo-1-uid",
+        filename="photo-1-uid.png",
+        recipe_uid="recipe-2-uid",
+        order_flag=1,
+        name="1",
+        hash="photo-1-hash",
+    )
+    category = categories[0]
+    assert isinstance(category, CategoryItem)
+    assert category.hash == Category(**category._asdict()).hash
+
+
+def _response(
+    body: bytes, status: int = 200, headers: dict | None = None
+) -> mock.Mock:
+    response = mock.Mock(status=status)
+    response.read = io.BytesIO(body).read
+    response.getheader.side_effect = (headers or {}).get
+    response.isclosed.return_value = True
+    return response
+
+
+@pytest.fixture
+def rate_limiter():
+    limiter = RateLimiter(interval=0)
+    with mock.patch.object(PaprikaAPIClient, "_rate_limiter", limiter):
+        yield limiter
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        (b'{"result": [{"uid": "1", "hash": "a"}]}\n', ["1"]),
+        (b'{"error": {"message": "Record not found"}}', DoesNotExistError),
+    ],
+)
+def test_api_client_stream(body, expected, rate_limiter):
+    client = PaprikaAPIClient()
+    client._conn = mock.Mock()
+    client._conn.getresponse.return_value = _response(body)
+
+    if isinstance(expected, list):
+        assert [item.uid for item in client.get_recipes()] == expected
+    else:
+        with pytest.raises(expected):
+            list(client.get_recipes())
+    client.connection.close.assert_not_called()
+
+
+def test_api_client_reconnects_with_gzip(rate_limiter):
+    stale, fresh = mock.Mock(), mock.Mock()
+    stale.getresponse.side_effect = RemoteDisconnected("closed")
+    body = gzip.compress(b'{"result": {"uid": "1", "hash": "a"}}')
+    fresh.getresponse.return_value = _response(
+        body, headers={"Content-Encoding": "gzip"}
+    )
+    client = PaprikaAPIClient()
+    client._conn = stale
+
+    with mock.patch("src.paprika.HTTPSConnection", return_value=fresh):
+        with client:
+            assert client._request("GET", "/api/v1/sync/recipe/1") == {
+                "uid": "1",
+                "hash": "a",
+            }
+        # Kept open for the next block
+        assert client.connection is fresh
+    stale.close.assert_called_once()
+    fresh.close.assert_not_called()
+    assert (
+        "gzip" in fresh.request.call_args.kwargs["headers"]["Accept-Encoding"]
+    )
+
+
+def test_api_client_retries_throttled_requests(rate_limiter):
+    client = PaprikaAPIClient()
+    client._conn = mock.Mock()
+    client._conn.getresponse.side_effect = [
+        _response(b"Slow down", status=429, headers={"Retry-After": "0"}),
+        _response(b"", status=503),
+        _response(b'{"result": {"uid": "1"}}'),
+    ]
+
+    with mock.patch("src.util.time.sleep") as sleep:
+        assert client._request("GET", "/api/v1/sync/recipe/1") == {"uid": "1"}
+    assert client._conn.request.call_count == 3
+    # Backed off twice, then sped up once
+    assert rate_limiter.interval == pytest.approx(0.5 * 0.9)
+    assert sleep.call_count >= 1
+
+    client._conn.getresponse.side_effect = [_response(b"", status=500)] * 6
+    with mock.patch("src.util.time.sleep"), pytest.raises(ClientError):
+        client._request("GET", "/api/v1/sync/recipe/1")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        ("120", 120.0),
+        ("soon", None),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0),
+        # Parsed as a naive date
+        ("Wed, 21 Oct 2015 07:28:00 -0000", 0.0),
+    ],
+)
+def test_retry_after(value, expected):
+    assert _retry_after(value) == expected
+
+
+def test_retry_after_future_date():
+    later = datetime.now(UTC) + timedelta(seconds=60)
+    for value in (
+        format_datetime(later),
+        format_datetime(later.replace(tzinfo=None)),
+    ):
+        assert _retry_after(value) == pytest.approx(60, abs=2)
+
+
+def test_api_client_serves_cached_records(rate_limiter, tmp_path):
+    client = PaprikaAPIClient()
+    client._conn = mock.Mock()
+    client._conn.getresponse.return_value = _response(
+        b'{"result": {"uid": "1", "hash": "a", "name": "Soup"}}'
+    )
+    with (
+        mock.patch("src.paprika.CACHE_DIR", tmp_path),
+        mock.patch.object(PaprikaAPIClient, "_cache", None),
+        mock.patch("src.paprika.Config.paprika.response_cache_mb", 1),
+    ):
+        assert client.get_recipe("1", "a").name == "Soup"
+        assert client.get_recipe("1", "a").name == "Soup"
+        assert client._conn.request.call_count == 1
+
+
+def test_record_and_replay(rate_limiter, tmp_path):
+    client = PaprikaAPIClient()
+    client._conn = mock.Mock()
+    client._conn.getresponse.side_effect = [
+        _response(b'{"result": [{"uid": "1", "hash": "a"}]}'),
+        _response(
+            b'{"result": {"uid": "1", "hash": "a", '
+            b'"photo_url": "https://example.com/photos/1.jpg"}}'
+        ),
+    ]
+    with (
+        mock.patch("src.paprika.Config.paprika.record_dir", str(tmp_path)),
+        mock.patch.object(
+            PaprikaAPIClient,
+            "_fetch",
+            side_effect=lambda url, dest: dest.write_bytes(b"jpeg"),
+        ),
+    ):
+        recipes = list(client.get_recipes())
+        recipe = client.get_recipe("1")
+    assert recipe.photo_url == "https://example.com/photos/1.jpg"
+
+    with mock.patch("src.paprika.Config.paprika.mock_dir", str(tmp_path)):
+        replay = PaprikaMockClient()
+        assert list(replay.get_recipes()) == recipes
+        replayed = replay.get_recipe("1")
+        assert replayed.photo_url == str(tmp_path / "photos" / "1.jpg")
+        dest = tmp_path / "copy.jpg"
+        replay.download_photo(replayed.photo_url, dest)
+        assert dest.read_bytes() == b"jpeg"
+        with pytest.raises(DoesNotExistError):
+            replay.get_recipe("2")
@@ -0,0 +1,69 @@
+import pstats
+
+from src import asgi_client
+from src.metrics import Phase, phase, record_run
+from src.profiling import PhaseProfiler, ProfilingMiddleware
+
+
+async def _app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def test_phase_profiler(tmp_path):
+    profiler = PhaseProfiler(tmp_path)
+    with record_run("test", profiler=profiler):
+        with phase(Phase.RECIPE_DETAILS):
+            with phase(Phase.DB_WRITES):
+                sorted(range(1000))
+
+    (directory,) = tmp_path.iterdir()
+    files = {path.name for path in directory.iterdir()}
+    assert {
+        "sync.prof",
+        "recipe_details.prof",
+        "db_writes.prof",
+        "recipe_details.tracemalloc.txt",
+    } <= files
+    pstats.Stats(str(directory / "db_writes.prof"))
+
+
+def test_profiling_middleware(tmp_path, asgi_get):
+    app = ProfilingMiddleware(_app, secret="s3cret", directory=tmp_path)
+
+    assert "x-profile-file" not in asgi_get(app).headers
+    assert (
+        "x-profile-file"
+        not in asgi_get(app, headers={"x-profile": "wrong"}).headers
+    )
+    assert list(tmp_path.iterdir()) == []
+
+    response = asgi_get(app, headers={"x-profile": "s3cret"})
+    name = response.headers["x-profile-file"]
+    assert (tmp_path / name).exists()
+    pstats.Stats(str(tmp_path / name))
+
+
+def test_profiling_middleware_overlapping_requests(tmp_path, asgi_get):
+    inner = []
+
+    async def app(scope, receive, send):
+        if scope["path"] == "/outer":
+            # Arrives while the outer request is profiled
+            inner.append(
+                await asgi_client.get(
+                    middleware, "/inner", headers={"x-profile": "s3cret"}
+                )
+            )
+        await _app(scope, receive, send)
+
+    middleware = ProfilingMiddleware(app, secret="s3cret", directory=tmp_path)
+    response = asgi_get(middleware, "/outer", headers={"x-profile": "s3cret"})
+
+    assert response.status == 200
+    assert "x-profile-file" in response.headers
+    assert inner[0].status == 200
+    assert "x-profile-file" not in inner[0].headers
+    # The lock is released for the next request
+    response = asgi_get(middleware, "/", headers={"x-profile": "s3cret"})
+    assert "x-profile-file" in response.headers
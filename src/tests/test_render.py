@@ -0,0 +1,56 @@
+from src.loadtest import generate_database
+from src.paprika import Photo, Recipe
+from src.render import Renderer, photo_map
+
+
+def test_markdown_photos():
+    renderer = Renderer()
+    html = renderer.markdown(
+        "Step 1\n\n[photo:1]\n\n[photo:9]", {"1": "photo-1.jpg"}
+    )
+    assert '<img src="/static/images/photo-1.jpg">' in html
+    assert "[photo:9]" in html
+
+
+def test_markdown_reuses_pipeline():
+    renderer = Renderer()
+    assert renderer.markdown("*a*", {}) == "<p><em>a</em></p>"
+    assert renderer.markdown("line 1\nline 2", {}) == (
+        "<p>line 1<br />\nline 2</p>"
+    )
+
+
+def test_ingredients():
+    html = Renderer().ingredients(
+        "**Dough**\n1 1/2 cups flour\n\n2-3 eggs\n½ tsp salt\n1½ cups milk\n"
+        "Water",
+        {},
+    )
+    assert html.splitlines() == [
+        "<p><strong>Dough</strong></p>",
+        "<ul>",
+        "<li><span>1 1/2</span> cups flour</li>",
+        "<li><span>2-3</span> eggs</li>",
+        "<li><span>½</span> tsp salt</li>",
+        # Highlighted like the quantity that ?scale= scales
+        "<li><span>1½</span> cups milk</li>",
+        "<li>Water</li>",
+        "</ul>",
+    ]
+
+
+def test_render_recipes(tmp_path):
+    generate_database(tmp_path / "render.db", recipes=10, categories=0)
+    recipes = list(Recipe.select())
+    photos = photo_map(recipe.uid for recipe in recipes)
+    assert (
+        sum(len(names) for names in photos.values()) == Photo.select().count()
+    )
+
+    rendered = Renderer().render_recipes(recipes)
+    assert set(rendered) == {recipe.uid for recipe in recipes}
+    for recipe in recipes:
+        fields = rendered[recipe.uid]
+        assert set(fields) == set(Recipe.markdown_fields)
+        assert fields["ingredients"].startswith("<ul>")
+        assert "[photo:" not in fields["directions"]
@@ -0,0 +1,52 @@
+import os
+
+from src.responses import ResponseCache, recording
+
+
+def test_response_cache(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=1024 * 1024)
+    cache.put("/api/v1/sync/recipe/1", "a", {"uid": "1", "hash": "a"})
+
+    assert cache.get("/api/v1/sync/recipe/1", "a") == {"uid": "1", "hash": "a"}
+    # Changed upstream since it was cached
+    assert cache.get("/api/v1/sync/recipe/1", "b") is None
+    assert cache.get("/api/v1/sync/recipe/2", "a") is None
+
+    (path,) = tmp_path.glob("*/*.json.gz")
+    path.write_bytes(b"not gzip")
+    assert cache.get("/api/v1/sync/recipe/1", "a") is None
+    assert not path.exists()
+
+
+def test_response_cache_evicts_least_recently_read(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=10**6)
+    for n in range(3):
+        cache.put(f"/recipe/{n}", "a", {"notes": os.urandom(100).hex()})
+        os.utime(cache._path(f"/recipe/{n}"), ns=(n, n))
+    assert cache.get("/recipe/0", "a") is not None
+
+    cache.max_bytes = sum(
+        path.stat().st_size for path in tmp_path.glob("*/*.json.gz")
+    )
+    cache.put("/recipe/3", "a", {"notes": os.urandom(100).hex()})
+
+    assert cache.get("/recipe/1", "a") is None
+    assert cache.get("/recipe/2", "a") is None
+    assert cache.get("/recipe/0", "a") is not None
+    assert cache.get("/recipe/3", "a") is not None
+
+
+def test_recording_replaces_only_when_complete(tmp_path):
+    with recording(tmp_path, "/api/v1/sync/recipes") as file:
+        file.write(b'{"result": []}')
+    path = tmp_path / "api" / "v1" / "sync" / "recipes"
+    assert path.read_bytes() == b'{"result": []}'
+
+    try:
+        with recording(tmp_path, "/api/v1/sync/recipes") as file:
+            file.write(b'{"result": [')
+            raise ConnectionError
+    except ConnectionError:
+        pass
+    assert path.read_bytes() == b'{"result": []}'
+    assert list(path.parent.iterdir()) == [path]
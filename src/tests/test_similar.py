@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from src.facets import save_facets
+from src.ingredients import parse_ingredients
+from src.loadtest import generate_database
+from src.paprika import Recipe
+from src.similar import (
+    SimilarRecipe,
+    _Vectors,
+    similar_recipes,
+    similar_updated,
+    update_similar,
+)
+
+
+def test_update_similar(tmp_path):
+    generate_database(tmp_path / "similar.db", recipes=4, categories=0)
+    pasta, risotto, salad, cake = Recipe.select().order_by(Recipe.uid)
+    for recipe, ingredients in (
+        (pasta, "1 lb pasta\n2 cloves garlic\n1 cup tomato\n1 cup basil"),
+        (risotto, "1 cup rice\n2 cloves garlic\n1 cup tomato"),
+        (salad, "1 head lettuce\n1 cup tomato\n1 cup basil"),
+        (cake, "2 cups flour\n1 cup sugar\n2 eggs"),
+    ):
+        save_facets(recipe, parse_ingredients(ingredients))
+
+    assert update_similar() == 4
+    assert [r["slug"] for r in similar_recipes(pasta.uid)] == [
+        risotto.slug,
+        salad.slug,
+    ]
+    assert similar_recipes(cake.uid) == []
+    assert similar_updated([pasta.uid]) is not None
+
+    # Nothing changed since the last run
+    assert update_similar() == 0
+
+    # Only the changed recipe and the recipes it now neighbours are redone
+    save_facets(cake, parse_ingredients("2 cups flour\n1 cup basil"))
+    cake.hash = "changed"
+    cake.save()
+    assert update_similar() == 3
+    assert cake.slug in [r["slug"] for r in similar_recipes(pasta.uid)]
+    assert update_similar() == 0
+
+    salad.delete_instance()
+    assert update_similar() == 3
+    assert (
+        not SimilarRecipe.select()
+        .where(SimilarRecipe.similar == salad.uid)
+        .exists()
+    )
+    assert update_similar(force=True) == 3
+
+
+def test_sparse_scores_match_dense_product():
+    rows = [{0: 0.6, 2: 0.8}, {1: 1.0}, {}, {0: 0.8, 1: 0.6}]
+    dense = np.zeros((len(rows), 3))
+    for i, row in enumerate(rows):
+        for column, value in row.items():
+            dense[i, column] = value
+
+    vectors = _Vectors(rows, 3)
+    for i in range(len(rows)):
+        assert vectors.scores(i) == pytest.approx(dense @ dense[i])
@@ -1,11 +1,28 @@
+import json
 from datetime import datetime
 from unittest.mock import patch
 
 import pytest
 
+from src.metrics import RecordType, Stats, record_run
 from src.paprika import _BASE_DIR as PAPRIKA_BASE_DIR
 from src.paprika import Category, Photo, Recipe
-from src.sync import sync_categories, sync_photos, sync_recipes
+from src.sync import (
+    estimate_sync,
+    main,
+    sync_all,
+    sync_categories,
+    sync_photos,
+    sync_recipes,
+)
+
+
+def _public_files(image_dir):
+    return {path for path in image_dir.iterdir() if path.is_file()}
+
+
+def _stored_objects(image_dir):
+    return set((image_dir / ".objects").glob("*/*"))
 
 
 @pytest.fixture
@@ -375,7 +392,7 @@ def test_sync_categories(categories):
 
 @pytest.mark.integration
 def test_sync_recipes(recipes):
-    from src.paprika import _IMAGE_DIR
+    from src.images import _IMAGE_DIR
 
     response_0, response_1, response_2 = recipes
 
@@ -394,7 +411,7 @@ def test_sync_recipes(recipes):
             assert observed_recipe == expected_recipe
 
     compare(response_0)
-    assert set() == set(_IMAGE_DIR.iterdir())
+    assert set() == _public_files(_IMAGE_DIR)
 
     sync_recipes()
     compare(response_1)
@@ -405,7 +422,12 @@ def test_sync_recipes(recipes):
         _IMAGE_DIR / "photo-1-cover.png",
         _IMAGE_DIR / "photo-2-cover.png",
         _IMAGE_DIR / "photo-3-cover.png",
-    } == set(_IMAGE_DIR.iterdir())
+    } == _public_files(_IMAGE_DIR)
+    # Covers have the same content as the photos and share their file
+    assert (_IMAGE_DIR / "photo-1.png").samefile(
+        _IMAGE_DIR / "photo-1-cover.png"
+    )
+    assert len(_stored_objects(_IMAGE_DIR)) == 3
 
     with (
         patch(
@@ -422,12 +444,13 @@ def test_sync_recipes(recipes):
         _IMAGE_DIR / "photo-1-cover.png",
         _IMAGE_DIR / "photo-2-cover-edited.png",
         _IMAGE_DIR / "photo-4-cover.png",
-    } == set(_IMAGE_DIR.iterdir())
+    } == _public_files(_IMAGE_DIR)
+    assert len(_stored_objects(_IMAGE_DIR)) == 3
 
 
 @pytest.mark.integration
 def test_sync_photos(photos):
-    from src.paprika import _IMAGE_DIR
+    from src.images import _IMAGE_DIR
 
     response_0, response_1, response_2 = photos
 
@@ -446,7 +469,7 @@ def test_sync_photos(photos):
             assert observed_photo == expected_photo
 
     compare(response_0)
-    assert set() == set(_IMAGE_DIR.iterdir())
+    assert set() == _public_files(_IMAGE_DIR)
 
     sync_photos()
     compare(response_1)
@@ -454,7 +477,7 @@ def test_sync_photos(photos):
         _IMAGE_DIR / "photo-1.png",
         _IMAGE_DIR / "photo-2.png",
         _IMAGE_DIR / "photo-3.png",
-    } == set(_IMAGE_DIR.iterdir())
+    } == _public_files(_IMAGE_DIR)
 
     with patch(
         "src.paprika.PaprikaMockClient._response_folder",
@@ -466,4 +489,25 @@ def test_sync_photos(photos):
         _IMAGE_DIR / "photo-1.png",
         _IMAGE_DIR / "photo-2-edited.png",
         _IMAGE_DIR / "photo-4.png",
-    } == set(_IMAGE_DIR.iterdir())
+    } == _public_files(_IMAGE_DIR)
+
+
+def test_estimate_sync_matches_run(capsys):
+    estimate = estimate_sync()
+    assert estimate.stats[RecordType.RECIPE] == Stats(added=3)
+    assert estimate.stats[RecordType.PHOTO] == Stats(added=3)
+    # Nothing written
+    assert Category.select().count() == 0
+    assert Recipe.select().count() == 0
+
+    with record_run("test") as run:
+        sync_all()
+    assert run.api_calls == estimate.api_calls
+    assert run.images_downloaded == estimate.images
+    assert run.stats[RecordType.CATEGORY] == estimate.stats[RecordType.CATEGORY]
+
+    main(["plan", "--json"])
+    plan = json.loads(capsys.readouterr().out)
+    assert plan["recipe"] == {"added": 0, "updated": 0, "deleted": 0}
+    assert plan["api_calls"] == 3
+    assert plan["image_bytes"] == 0
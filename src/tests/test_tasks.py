@@ -0,0 +1,117 @@
+from unittest import mock
+
+import pytest
+
+from src.metrics import RecordType, SyncRun, record_run
+from src.paprika import Photo, Recipe
+from src.sync import Budget, Job, Priority, plan_sync, run_jobs
+from src.tasks import _queued_key, enqueue, huey, schedule_sync
+
+
+@pytest.fixture
+def immediate():
+    huey.immediate = True
+    try:
+        yield huey
+    finally:
+        huey.immediate = False
+
+
+def _new_recipe_job(n: int, cost: int = 3) -> Job:
+    return Job(
+        RecordType.RECIPE,
+        f"recipe-{n}-uid",
+        Priority.NEW_RECIPE,
+        {"hash": f"recipe-{n}-hash"},
+        cost,
+    )
+
+
+def test_plan_sync():
+    Recipe.create(uid="gone", hash="gone", name="Gone")
+    Photo.create(uid="gone-photo", hash="gone")
+
+    jobs = plan_sync()
+    assert jobs == [
+        Job(RecordType.RECIPE, "gone", Priority.DELETE),
+        Job(RecordType.PHOTO, "gone-photo", Priority.DELETE, cost=1),
+        _new_recipe_job(1),
+        # Plus a call for each of its photos
+        _new_recipe_job(2, cost=6),
+        _new_recipe_job(3),
+    ]
+
+
+def test_enqueue(immediate):
+    jobs = plan_sync()
+    # A task for this recipe is already waiting
+    immediate.put(_queued_key(RecordType.RECIPE, "recipe-3-uid"), True)
+
+    assert enqueue(jobs) == 2
+    assert {recipe.uid for recipe in Recipe.select()} == {
+        "recipe-1-uid",
+        "recipe-2-uid",
+    }
+    assert Photo.select().count() == 3
+    assert immediate.get(_queued_key(RecordType.RECIPE, "recipe-1-uid")) is None
+    assert plan_sync() == [_new_recipe_job(3)]
+
+
+@pytest.mark.parametrize(
+    "api_budget, synced",
+    [
+        # Listing the records takes 3 calls and the first recipe 3 more
+        (5, []),
+        (6, ["recipe-1-uid"]),
+    ],
+)
+def test_schedule_sync_budget(immediate, api_budget, synced):
+    with mock.patch("src.tasks.Config.paprika.api_budget", api_budget):
+        schedule_sync.call_local()
+    # The rest wait for the next run
+    assert [recipe.uid for recipe in Recipe.select()] == synced
+    assert SyncRun.get().api_calls <= api_budget
+
+
+def test_schedule_sync_records_task_work(immediate):
+    schedule_sync.call_local()
+
+    # The work of the record tasks is added to the run that queued them
+    sync_run = SyncRun.get()
+    assert sync_run.command == "schedule"
+    assert sync_run.added == 4 + 3 + 3
+    assert sync_run.images_downloaded == 6
+    assert sync_run.recipe_details_time > 0
+
+
+def test_plan_sync_orders_by_value():
+    run_jobs(plan_sync())
+    Recipe.update(hash="stale").execute()
+    Recipe.update(in_trash=True).where(Recipe.uid == "recipe-1-uid").execute()
+    Recipe.update(is_pinned=True).where(Recipe.uid == "recipe-3-uid").execute()
+
+    with mock.patch("src.sync.Config.paprika.show_uncategorized", False):
+        jobs = plan_sync()
+    assert [(job.uid, job.priority) for job in jobs] == [
+        ("recipe-3-uid", Priority.FAVORITE),
+        ("recipe-2-uid", Priority.HIDDEN),
+        ("recipe-1-uid", Priority.TRASHED),
+    ]
+
+
+def test_run_jobs_budget():
+    with record_run("test") as run:
+        budget = Budget(api_calls=12)
+        jobs = plan_sync()
+        left = run_jobs(jobs, budget)
+    # Planning took 3 calls, recipe 1 another 3 and recipe 2 six more
+    assert run.api_calls == 12
+    assert left == jobs[2:]
+    assert plan_sync() == left
+
+
+def test_budget_seconds():
+    with mock.patch("src.sync.time.monotonic", side_effect=[0, 0.5, 1]):
+        budget = Budget(seconds=1)
+        assert budget.allows(100)
+        assert not budget.allows(0)
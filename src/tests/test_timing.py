@@ -0,0 +1,38 @@
+import logging
+
+from src.database import db_proxy
+from src.timing import TimingMiddleware, timer
+
+
+async def _app(scope, receive, send):
+    db_proxy.execute_sql("SELECT 1")
+    with timer("render"):
+        pass
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def test_server_timing_header(asgi_get):
+    response = asgi_get(TimingMiddleware(_app))
+    server_timing = response.headers["server-timing"]
+    assert "db;dur=" in server_timing
+    assert 'desc="1 queries"' in server_timing
+    assert "render;dur=" in server_timing
+    assert "total;dur=" in server_timing
+
+
+def test_server_timing_disabled(asgi_get):
+    response = asgi_get(TimingMiddleware(_app, server_timing=False))
+    assert "server-timing" not in response.headers
+
+
+def test_slow_request_logging(asgi_get, caplog):
+    with caplog.at_level(logging.WARNING):
+        asgi_get(TimingMiddleware(_app, slow_request_ms=-1))
+    assert "Slow request: GET /" in caplog.text
+    assert "SELECT 1" in caplog.text
+
+
+def test_timer_without_request():
+    with timer("render"):
+        pass
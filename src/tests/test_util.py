@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+from src.util import RateLimiter, iter_json_array
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_iter_json_array(chunk_size):
+    items = [{"uid": f"{i}", "name": "Crème brûlée", "n": i} for i in range(50)]
+    data = json.dumps(
+        {"count": 50, "result": items, "nested": {"a": [1, 2.5]}}, indent=2
+    ).encode()
+    rest = {}
+
+    stream = iter_json_array(io.BytesIO(data), "result", rest, chunk_size)
+    assert list(stream) == items
+    assert rest == {"count": 50, "nested": {"a": [1, 2.5]}}
+
+
+def test_iter_json_array_missing_key():
+    data = b'{"error": {"message": "Not found"}, "result": 12345}'
+    rest = {}
+    stream = iter_json_array(io.BytesIO(data), "result", rest, chunk_size=3)
+    with pytest.raises(StopIteration) as stop:
+        next(stream)
+    assert stop.value.value is False
+    assert rest == {"error": {"message": "Not found"}, "result": 12345}
+
+
+def test_iter_json_array_truncated():
+    stream = iter_json_array(
+        io.BytesIO(b'{"result": [{"uid": "1"}, {"u'), "result"
+    )
+    assert next(stream) == {"uid": "1"}
+    with pytest.raises(ValueError):
+        next(stream)
+
+
+def test_rate_limiter_adapts():
+    limiter = RateLimiter(interval=1, min_interval=0.5, max_interval=4)
+    for _ in range(10):
+        limiter.speed_up()
+    assert limiter.interval == 0.5
+    assert limiter.rate == 2
+
+    assert limiter.back_off(0, retry_after=3) == 3
+    assert limiter.interval == 1
+    # Jittered between half and all of the capped exponential delay
+    assert 2 <= limiter.back_off(2) <= 4
+    assert limiter.interval == 2
+    limiter.back_off(0)
+    limiter.back_off(0)
+    assert limiter.interval == 4
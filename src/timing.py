@@ -0,0 +1,105 @@
+import logging
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.database import Query, track_queries
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.DEBUG)
+
+_TIMINGS: ContextVar[dict[str, float] | None] = ContextVar(
+    "timings", default=None
+)
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    timings = _TIMINGS.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - start
+
+
+def server_timing(
+    timings: dict[str, float], queries: list[Query], total: float
+) -> str:
+    db = sum(query.duration for query in queries)
+    metrics = [f'db;dur={db * 1000:.2f};desc="{len(queries)} queries"']
+    for name, duration in timings.items():
+        metrics.append(f"{name};dur={duration * 1000:.2f}")
+    metrics.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(metrics)
+
+
+class TimingMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        server_timing: bool = True,
+        slow_request_ms: int | None = None,
+    ):
+        self.app = app
+        self.server_timing = server_timing
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings: dict[str, float] = defaultdict(float)
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start" and self.server_timing:
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    server_timing(
+                        timings, queries, time.perf_counter() - start
+                    ),
+                )
+            await send(message)
+
+        token = _TIMINGS.set(timings)
+        try:
+            with track_queries() as queries:
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            _TIMINGS.reset(token)
+
+        total = (time.perf_counter() - start) * 1000
+        if self.slow_request_ms is not None and total > self.slow_request_ms:
+            self._log_slow_request(scope, timings, queries, total)
+
+    def _log_slow_request(
+        self,
+        scope: Scope,
+        timings: dict[str, float],
+        queries: list[Query],
+        total: float,
+    ) -> None:
+        db = sum(query.duration for query in queries) * 1000
+        lines = [
+            f"Slow request: {scope['method']} {scope['path']} took "
+            f"{total:.2f}ms (db {db:.2f}ms in {len(queries)} queries"
+            + "".join(
+                f", {name} {duration * 1000:.2f}ms"
+                for name, duration in timings.items()
+            )
+            + ")"
+        ]
+        for query in queries:
+            lines.append(f"  {query.duration * 1000:8.2f}ms  {query.sql}")
+        logger.warning("\n".join(lines))
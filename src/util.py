@@ -1,44 +1,188 @@
+import codecs
+import json
+import random
+import re
 import threading
 import time
-from typing import Any
+from collections.abc import Generator
+from typing import Any, Protocol, TypeVar
 
+_T = TypeVar("_T")
 
-def get_all_subclasses(cls) -> set[type]:
+
+def get_all_subclasses(cls: type[_T]) -> set[type[_T]]:
     subclasses = set(cls.__subclasses__())
     for subclass in cls.__subclasses__():
         subclasses.update(get_all_subclasses(subclass))
     return subclasses
 
 
-class InMemoryCache:
-    def __init__(self):
-        self._store = {}
+class RateLimiter:
+    """Spaces calls an interval apart across threads.
+
+    The interval shrinks towards min_interval while calls succeed and
+    doubles, up to max_interval, whenever the server pushes back.
+    """
+
+    # Interval kept after each successful call
+    _SPEEDUP = 0.9
+    # Smallest interval to back off from, when calls were not spaced at all
+    _MIN_BACKOFF = 0.25
+
+    def __init__(
+        self,
+        interval: float = 1.0,
+        min_interval: float = 0.0,
+        max_interval: float = 60.0,
+    ):
+        self.interval = interval
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self._next = 0.0
         self._lock = threading.Lock()
 
-    def setex(
-        self, key: str, ttl: int | None = None, value: Any | None = None
-    ) -> None:
-        expire_at = time.time() + ttl
+    @property
+    def rate(self) -> float:
+        """Calls per second at the current interval."""
+        return 1 / self.interval if self.interval else float("inf")
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def speed_up(self) -> None:
         with self._lock:
-            self._store[key] = (value, expire_at)
+            self.interval = max(
+                self.min_interval, self.interval * self._SPEEDUP
+            )
 
-    def get(self, key) -> Any | None:
+    def back_off(self, attempt: int, retry_after: float | None = None) -> float:
+        """Slow down, and hold every caller for the returned delay: the
+        server's Retry-After if given, otherwise a jittered exponential
+        backoff for this attempt.
+        """
         with self._lock:
-            item = self._store.get(key)
-            if not item:
-                return None
-            value, expire_at = item
-            if expire_at and time.time() >= expire_at:
-                del self._store[key]
-                return None
-            return value
+            self.interval = min(
+                self.max_interval, max(self.interval * 2, self._MIN_BACKOFF)
+            )
+            if retry_after is None:
+                cap = min(self.max_interval, self.interval * 2**attempt)
+                delay = random.uniform(cap / 2, cap)
+            else:
+                delay = retry_after
+            self._next = max(self._next, time.monotonic() + delay)
+        return delay
+
+
+_JSON_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_json_decoder = json.JSONDecoder()
+
+
+class Readable(Protocol):
+    def read(self, size: int = -1, /) -> bytes: ...
+
+
+class _JSONReader:
+    def __init__(self, file: Readable, chunk_size: int):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> None:
+        if self.eof:
+            raise ValueError("Unexpected end of JSON")
+        chunk = self._file.read(self._chunk_size)
+        self.eof = not chunk
+        # Only the unread part is kept
+        self.buffer = self.buffer[self.pos :] + self._text.decode(
+            chunk, final=self.eof
+        )
+        self.pos = 0
+
+    def _skip_whitespace(self) -> None:
+        # The pattern matches the empty string, so there is always a match
+        match = _WHITESPACE.match(self.buffer, self.pos)
+        assert match is not None
+        self.pos = match.end()
+
+    def next_char(self) -> str:
+        while True:
+            self._skip_whitespace()
+            if self.pos < len(self.buffer):
+                self.pos += 1
+                return self.buffer[self.pos - 1]
+            self._fill()
 
+    def value(self) -> Any:
+        while True:
+            self._skip_whitespace()
+            try:
+                value, end = _json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # A number at the end of the buffer may go on in the next chunk
+            if end < len(self.buffer) or self.eof:
+                self.pos = end
+                return value
+            self._fill()
 
-_CACHE: InMemoryCache | None = None
 
+def iter_json_array(
+    file: Readable,
+    key: str,
+    rest: dict | None = None,
+    chunk_size: int = _JSON_CHUNK_SIZE,
+) -> Generator[Any, None, bool]:
+    """Yield the items of the array under a key of a JSON object as the
+    file is read, holding at most a chunk and an item in memory.
 
-def cache_client() -> InMemoryCache:
-    global _CACHE
-    if _CACHE is None:
-        _CACHE = InMemoryCache()
-    return _CACHE
+    Other members of the object are decoded into rest. Returns whether the
+    key held an array.
+    """
+    reader = _JSONReader(file, chunk_size)
+    if reader.next_char() != "{":
+        raise ValueError("Expected a JSON object")
+    found = False
+    char = reader.next_char()
+    while char != "}":
+        if char != '"':
+            raise ValueError(f"Expected a member name at {char!r}")
+        reader.pos -= 1
+        name = reader.value()
+        if reader.next_char() != ":":
+            raise ValueError(f"Expected ':' after {name!r}")
+        if name == key and reader.next_char() == "[":
+            found = True
+            char = reader.next_char()
+            if char != "]":
+                reader.pos -= 1
+                while True:
+                    yield reader.value()
+                    char = reader.next_char()
+                    if char == "]":
+                        break
+                    if char != ",":
+                        raise ValueError(f"Expected ',' in {key!r}")
+        else:
+            if name == key:
+                reader.pos -= 1
+            value = reader.value()
+            if rest is not None:
+                rest[name] = value
+        char = reader.next_char()
+        if char == ",":
+            char = reader.next_char()
+        elif char != "}":
+            raise ValueError(f"Expected ',' or '}}' after {name!r}")
+    return found